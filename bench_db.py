@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# bench_db.py
+#
+# Compares the old connect-per-call pattern with the pooled WAL connection in
+# db.py on a throwaway database file. Usage: python bench_db.py [operations]
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+import db
+
+def legacy_connection():
+    # What every helper in db.py used to do before connections were pooled.
+    conn = sqlite3.connect(db.DATABASE, check_same_thread=False, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def legacy_add_ticket(i):
+    conn = legacy_connection()
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO tickets (order_id, issue_description, issue_reason, issue_type, client, image_url, status, da_id, logs)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (f"ORD{i}", "bench", "المخزن", "تالف", "بيبس", None, "Opened", 1, "[]"))
+    ticket_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return ticket_id
+
+def legacy_get_ticket(ticket_id):
+    conn = legacy_connection()
+    c = conn.cursor()
+    c.execute("SELECT * FROM tickets WHERE ticket_id=?", (ticket_id,))
+    ticket = c.fetchone()
+    conn.close()
+    return ticket
+
+def pooled_add_ticket(i):
+    return db.add_ticket(f"ORD{i}", "bench", "المخزن", "تالف", "بيبس", None, "Opened", 1)
+
+def run(label, add, get, operations):
+    start = time.perf_counter()
+    ids = [add(i) for i in range(operations)]
+    write_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    for ticket_id in ids:
+        get(ticket_id)
+    read_elapsed = time.perf_counter() - start
+    print(f"{label:<8} writes: {operations / write_elapsed:10.0f} ops/s   "
+          f"reads: {operations / read_elapsed:10.0f} ops/s")
+
+def main():
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        # Legacy run uses the default rollback journal, as the old code did.
+        db.DATABASE = os.path.join(tmp, "legacy.db")
+        conn = legacy_connection()
+        conn.execute("CREATE TABLE tickets (ticket_id INTEGER PRIMARY KEY AUTOINCREMENT, order_id TEXT, "
+                     "issue_description TEXT, issue_reason TEXT, issue_type TEXT, client TEXT, image_url TEXT, "
+                     "status TEXT, da_id INTEGER, logs TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+        conn.commit()
+        conn.close()
+        run("legacy", legacy_add_ticket, legacy_get_ticket, operations)
+
+        db.DATABASE = os.path.join(tmp, "pooled.db")
+        db.ARCHIVE_DATABASE = os.path.join(tmp, "pooled_archive.db")
+        db.close_connection()
+        db.init_db()
+        run("pooled", pooled_add_ticket, db.get_ticket, operations)
+        db.close_connection()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# bench_fanout.py
+#
+# Measures notification delivery against a local fake Bot API server that
+# answers like Telegram, including 429 retry_after when a bot exceeds 30
+# messages/s or a chat gets more than one message per second.
+#
+#   python bench_fanout.py [chats] [messages_per_chat] [latency_ms]
+#
+# Runs the old one-at-a-time loop and then fanout.FanOut over the same load,
+# once with a default Bot and once with a pooled bots.make_bot(), and prints
+# delivered messages/s, how many 429s each provoked and how many connections
+# it had to open.
+import json
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from telegram import Bot
+from telegram.error import RetryAfter
+import bots
+import fanout
+
+FAKE_TOKEN = "123456:fake-bench-token"
+
+class FakeBotAPI:
+    """Just enough of sendMessage/sendPhoto, with Telegram's flood limits."""
+
+    def __init__(self, latency, bot_rate=30, chat_interval=0.95):
+        self.latency = latency
+        self.bot_rate = bot_rate
+        self.chat_interval = chat_interval
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.last_per_chat = {}
+        self.delivered = defaultdict(list)
+        self.rejected = 0
+        self.message_id = 0
+        self.connections = 0
+
+    def handle(self, chat_id, text):
+        time.sleep(self.latency)
+        with self.lock:
+            now = time.monotonic()
+            # Telegram is not millisecond-exact either; allow some scheduling jitter.
+            while self.recent and now - self.recent[0] > 0.95:
+                self.recent.popleft()
+            last = self.last_per_chat.get(chat_id)
+            if len(self.recent) >= self.bot_rate or (last is not None and now - last < self.chat_interval):
+                self.rejected += 1
+                return 429, {"ok": False, "error_code": 429,
+                             "description": "Too Many Requests: retry after 1",
+                             "parameters": {"retry_after": 1}}
+            self.recent.append(now)
+            self.last_per_chat[chat_id] = now
+            self.delivered[chat_id].append(text)
+            self.message_id += 1
+            return 200, {"ok": True, "result": {"message_id": self.message_id, "date": int(time.time()),
+                                                "chat": {"id": chat_id, "type": "private"}, "text": text}}
+
+    def serve(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like api.telegram.org.
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                with api.lock:
+                    api.connections += 1
+                super().setup()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or "{}")
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body).items()}
+                status, payload = api.handle(int(params.get("chat_id", 0)),
+                                             params.get("text") or params.get("caption"))
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 128
+
+        server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+def sequential(bot, chats, messages):
+    # The loop the handlers used to run: one blocking call per recipient,
+    # a 429 just loses the message.
+    for i in range(messages):
+        for chat_id in chats:
+            try:
+                bot.send_message(chat_id=chat_id, text=f"message {i}")
+            except RetryAfter:
+                pass
+
+def fanned_out(bot, chats, messages):
+    engine = fanout.FanOut()
+    futures = []
+    for i in range(messages):
+        futures += [engine.submit(bot, chat_id, "send_message", text=f"message {i}") for chat_id in chats]
+    for future in futures:
+        future.exception()
+    engine.shutdown()
+
+def run(label, send, chats, messages, latency, make_bot=Bot):
+    api = FakeBotAPI(latency)
+    server = api.serve()
+    bot = make_bot(FAKE_TOKEN, base_url=f"http://127.0.0.1:{server.server_address[1]}/bot")
+    start = time.perf_counter()
+    send(bot, chats, messages)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    delivered = sum(len(texts) for texts in api.delivered.values())
+    in_order = all(texts == sorted(texts, key=lambda t: int(t.split()[1])) for texts in api.delivered.values())
+    print(f"{label:<14} delivered {delivered}/{len(chats) * messages} in {elapsed:6.2f}s "
+          f"({delivered / elapsed:6.1f} msg/s), 429s: {api.rejected}, connections: {api.connections}, "
+          f"per-chat order kept: {in_order}")
+
+def main():
+    chats = range(1, (int(sys.argv[1]) if len(sys.argv) > 1 else 60) + 1)
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    latency = (int(sys.argv[3]) if len(sys.argv) > 3 else 50) / 1000
+    run("sequential", sequential, chats, messages, latency)
+    run("fanout", fanned_out, chats, messages, latency)
+    run("fanout pooled", fanned_out, chats, messages, latency, make_bot=bots.make_bot)
+
+if __name__ == '__main__':
+    main()
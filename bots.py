@@ -0,0 +1,82 @@
+# bots.py
+#
+# One long-lived Bot per token and process, shared by the Updaters, the
+# outbox worker and the notifier:
+#
+#   bots.get("supervisor").send_message(...)
+#
+# Each Bot keeps its HTTPS connections to api.telegram.org open between
+# calls, so a notification reuses a warm connection instead of paying for a
+# TCP connect and TLS handshake. python-telegram-bot's default pool holds a
+# single connection, which means concurrent sends (fanout workers, the
+# dispatcher, long polling) keep opening sockets and throwing them away; the
+# pool here is sized for that concurrency. stats() reports how many requests
+# were served per connection opened.
+import logging
+import threading
+from telegram import Bot
+from telegram.utils.request import Request
+import cache
+import config
+import fanout
+
+logger = logging.getLogger(__name__)
+
+# Fanout workers, the Updater's dispatcher workers (4) and its long poll all
+# share one pool.
+BOT_POOL_SIZE = fanout.FANOUT_WORKERS + 8
+BOT_CONNECT_TIMEOUT = 5.0
+BOT_READ_TIMEOUT = 10.0
+BOT_STATS_INTERVAL = 600  # seconds between connection reuse log lines
+
+BOT_TOKENS = {
+    "da": config.DA_BOT_TOKEN,
+    "supervisor": config.SUPERVISOR_BOT_TOKEN,
+    "client": config.CLIENT_BOT_TOKEN,
+}
+
+_bots = cache.PerProcess(dict)  # pooled sockets must not be shared with the parent process
+_bots_lock = threading.Lock()
+
+def make_bot(token, **kwargs):
+    """A Bot with a keep-alive connection pool sized for concurrent sends."""
+    request = Request(con_pool_size=BOT_POOL_SIZE, connect_timeout=BOT_CONNECT_TIMEOUT,
+                      read_timeout=BOT_READ_TIMEOUT)
+    return Bot(token=token, request=request, **kwargs)
+
+def get(name):
+    """The process-wide Bot for "da", "supervisor" or "client" (recreated after a fork)."""
+    bots = _bots.get()
+    with _bots_lock:
+        bot = bots.get(name)
+        if bot is None:
+            if name not in BOT_TOKENS:
+                raise ValueError(f"unknown bot {name!r}")
+            bot = bots[name] = make_bot(BOT_TOKENS[name])
+        return bot
+
+def pool_stats(bot):
+    """Connections opened and requests sent through `bot`'s pool so far."""
+    manager = bot.request._con_pool
+    connections = requests = 0
+    # The manager keeps one HTTPConnectionPool per host.
+    for key in manager.pools.keys():
+        pool = manager.pools.get(key)
+        if pool is not None:
+            connections += pool.num_connections
+            requests += pool.num_requests
+    return {"connections": connections, "requests": requests,
+            "reused": max(requests - connections, 0)}
+
+def stats():
+    """pool_stats() of every Bot this process has created, by name."""
+    with _bots_lock:
+        current = dict(_bots.peek() or {})
+    return {name: pool_stats(bot) for name, bot in current.items()}
+
+def log_stats(context=None):
+    """Log connection reuse; usable directly as a JobQueue callback."""
+    for name, s in stats().items():
+        ratio = s["requests"] / s["connections"] if s["connections"] else 0.0
+        logger.info("bots: %s bot sent %d requests over %d connections (%.1f requests/connection)",
+                    name, s["requests"], s["connections"], ratio)
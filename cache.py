@@ -0,0 +1,83 @@
+# cache.py
+#
+# Small in-process building blocks shared by the bot modules:
+#
+#   _cache = cache.LRUCache(2048)                  # bounded, thread-safe
+#   _cache = cache.LRUCache(1000, ttl=120)         # ... entries expire
+#   _client = cache.PerProcess(OrdersClient)       # _client.get()
+#
+# PerProcess holds an object that must not cross a fork (pooled sockets,
+# worker threads): main.py forks one process per bot, and each process
+# builds its own on first use.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    Mapping of at most `maxsize` entries that drops the least recently used
+    one when full. With `ttl`, an entry older than `ttl` seconds is a miss.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at or None, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        self.update({key: value})
+
+    def update(self, mapping):
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class PerProcess:
+    """The object `factory()` returns, created once per process on first get()."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._value = self.factory()
+                self._pid = os.getpid()
+            return self._value
+
+    def peek(self):
+        """The object if this process has created it already, else None."""
+        with self._lock:
+            return self._value if self._pid == os.getpid() else None
@@ -0,0 +1,71 @@
+# callbacks.py
+#
+# Compact callback_data for inline buttons whose payload is free text (order
+# and client names, Arabic issue reasons and types). Telegram caps
+# callback_data at 64 bytes, so instead of packing the text into it
+#
+#   InlineKeyboardButton(issue_type, callback_data=callbacks.data("issue_type", issue_type))
+#
+# stores the payload under a 12-character token and sends "issue_type|<token>";
+#
+#   issue_type = callbacks.resolve(query.data)
+#
+# gives the payload back, or None once the token has expired. A keyboard
+# with several such buttons gets its callback_data from one data_many()
+# call, which stores all of its tokens with a single database write. A token is a
+# hash of the action and payload, so re-rendering a keyboard reuses its
+# tokens and a stored payload can be checked against its token. Tokens live
+# in a bounded in-memory LRU and, with config.CALLBACK_TOKENS_PERSIST, in the
+# callback_tokens table so buttons keep working after a restart.
+import base64
+import hashlib
+import json
+import time
+import cache
+import config
+import db
+
+CALLBACK_TOKEN_TTL = 7 * 24 * 3600
+CALLBACK_CACHE_SIZE = 20000
+
+_tokens = cache.LRUCache(CALLBACK_CACHE_SIZE)  # token -> (expires_at, payload JSON)
+
+def _token(action, payload_json):
+    digest = hashlib.blake2b(f"{action}\0{payload_json}".encode(), digest_size=9).digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+def data_many(action, payloads):
+    """callback_data "<action>|<token>" for each JSON-serializable payload, in order."""
+    now = time.time()
+    expires_at = now + CALLBACK_TOKEN_TTL
+    result, new_rows = [], []
+    for payload in payloads:
+        payload_json = json.dumps(payload, ensure_ascii=False)
+        token = _token(action, payload_json)
+        entry = _tokens.get(token)
+        # Rendering the same keyboard again only touches the database once
+        # the stored expiry is half used up.
+        if entry is None or entry[0] <= now + CALLBACK_TOKEN_TTL / 2:
+            _tokens.put(token, (expires_at, payload_json))
+            new_rows.append((token, payload_json, expires_at))
+        result.append(f"{action}|{token}")
+    if new_rows and config.CALLBACK_TOKENS_PERSIST:
+        db.save_callback_tokens(new_rows)
+    return result
+
+def data(action, payload):
+    """callback_data "<action>|<token>" for a JSON-serializable payload."""
+    return data_many(action, [payload])[0]
+
+def resolve(callback_data):
+    """The payload registered for `callback_data`, or None if unknown or expired."""
+    action, _, token = callback_data.partition("|")
+    entry = _tokens.get(token)
+    if entry is None and config.CALLBACK_TOKENS_PERSIST:
+        row = db.get_callback_token(token)
+        if row is not None:
+            entry = (row["expires_at"], row["payload"])
+            _tokens.put(token, entry)
+    if entry is None or entry[0] < time.time() or _token(action, entry[1]) != token:
+        return None
+    return json.loads(entry[1])
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 # client_bot.py
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply, Bot
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, ConversationHandler, CallbackContext
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler, CallbackContext
+import bots
 import db
-import config
+import digest
+import photos
+import router
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -58,72 +61,82 @@ def subscription_client(update: Update, context: CallbackContext):
     update.message.reply_text("تم الاشتراك بنجاح كـ Client!", reply_markup=reply_markup)
     return MAIN_MENU
 
-def client_main_menu_callback(update: Update, context: CallbackContext):
+# =============================================================================
+# Callback routes
+# =============================================================================
+def unknown_callback(update: Update, context: CallbackContext):
+    safe_edit_message(update.callback_query, text="الإجراء غير معروف.")
+    return MAIN_MENU
+
+routes = router.Router("client", unknown=unknown_callback)
+
+@routes.route("menu_show_tickets")
+def show_tickets(update: Update, context: CallbackContext):
     query = update.callback_query
-    query.answer()
-    data = query.data
-    if data == "menu_show_tickets":
-        sub = db.get_subscription(query.from_user.id, "Client")
-        client_name = sub['client']
-        tickets = [t for t in db.get_all_open_tickets() if t['status'] == "Awaiting Client Response" and t['client'] == client_name]
-        if tickets:
-            for ticket in tickets:
-                text = (f"<b>تذكرة #{ticket['ticket_id']}</b>\n"
-                        f"<b>رقم الطلب:</b> {ticket['order_id']}\n"
-                        f"<b>الوصف:</b> {ticket['issue_description']}\n"
-                        f"<b>الحالة:</b> {ticket['status']}")
-                keyboard = [
-                    [InlineKeyboardButton("حالياً", callback_data=f"notify_pref|{ticket['ticket_id']}|now")],
-                    [InlineKeyboardButton("خلال 15 دقيقة", callback_data=f"notify_pref|{ticket['ticket_id']}|15")],
-                    [InlineKeyboardButton("خلال 10 دقائق", callback_data=f"notify_pref|{ticket['ticket_id']}|10")],
-                    [InlineKeyboardButton("حل المشكلة", callback_data=f"solve|{ticket['ticket_id']}")],
-                    [InlineKeyboardButton("تجاهل", callback_data=f"ignore|{ticket['ticket_id']}")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                if ticket['image_url']:
-                    query.message.reply_photo(photo=ticket['image_url'])
-                safe_edit_message(query, text=text, reply_markup=reply_markup, parse_mode="HTML")
-        else:
-            safe_edit_message(query, text="لا توجد تذاكر في انتظار ردك.")
-        return MAIN_MENU
-    elif data.startswith("notify_pref|"):
-        parts = data.split("|")
-        ticket_id = int(parts[1])
-        pref = parts[2]
-        if pref == "now":
-            send_full_issue_details_to_client(query, ticket_id)
-        else:
-            delay = 900 if pref == "15" else 600
-            context.job_queue.run_once(reminder_callback, delay,
-                                       context={'chat_id': query.message.chat_id, 'ticket_id': ticket_id})
-            send_issue_details_to_client(query, ticket_id)
+    sub = db.get_subscription(query.from_user.id, "Client")
+    client_name = sub['client']
+    tickets = db.get_tickets_by_client_status(client_name, "Awaiting Client Response")
+    if tickets:
+        for ticket in tickets:
+            text = (f"<b>تذكرة #{ticket['ticket_id']}</b>\n"
+                    f"<b>رقم الطلب:</b> {ticket['order_id']}\n"
+                    f"<b>الوصف:</b> {ticket['issue_description']}\n"
+                    f"<b>الحالة:</b> {ticket['status']}")
+            keyboard = [
+                [InlineKeyboardButton("حالياً", callback_data=f"notify_pref|{ticket['ticket_id']}|now")],
+                [InlineKeyboardButton("خلال 15 دقيقة", callback_data=f"notify_pref|{ticket['ticket_id']}|15")],
+                [InlineKeyboardButton("خلال 10 دقائق", callback_data=f"notify_pref|{ticket['ticket_id']}|10")],
+                [InlineKeyboardButton("حل المشكلة", callback_data=f"solve|{ticket['ticket_id']}")],
+                [InlineKeyboardButton("تجاهل", callback_data=f"ignore|{ticket['ticket_id']}")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            if ticket['image_url']:
+                photos.send_photo("client", query.message.reply_photo, ticket['image_url'])
+            safe_edit_message(query, text=text, reply_markup=reply_markup, parse_mode="HTML")
+    else:
+        safe_edit_message(query, text="لا توجد تذاكر في انتظار ردك.")
+    return MAIN_MENU
+
+@routes.route("notify_pref", int, str)
+def set_notify_pref(update: Update, context: CallbackContext, ticket_id, pref):
+    query = update.callback_query
+    if pref == "now":
+        send_full_issue_details_to_client(query, ticket_id)
+    else:
+        delay = 900 if pref == "15" else 600
+        context.job_queue.run_once(reminder_callback, delay,
+                                   context={'chat_id': query.message.chat_id, 'ticket_id': ticket_id})
+        send_issue_details_to_client(query, ticket_id)
+    return MAIN_MENU
+
+@routes.route("solve", int)
+def ask_for_solution(update: Update, context: CallbackContext, ticket_id):
+    query = update.callback_query
+    ticket = db.get_ticket(ticket_id)
+    if ticket['status'] in ("Client Responded", "Client Ignored", "Closed"):
+        safe_edit_message(query, text="التذكرة مغلقة أو تمت معالجتها بالفعل ولا يمكن تعديلها.")
         return MAIN_MENU
-    elif data.startswith("solve|"):
-        ticket_id = int(data.split("|")[1])
-        ticket = db.get_ticket(ticket_id)
-        if ticket['status'] in ("Client Responded", "Client Ignored", "Closed"):
-            safe_edit_message(query, text="التذكرة مغلقة أو تمت معالجتها بالفعل ولا يمكن تعديلها.")
-            return MAIN_MENU
-        context.user_data['ticket_id'] = ticket_id
-        context.user_data['awaiting_response'] = True
-        context.bot.send_message(chat_id=query.message.chat_id,
-                                 text="أدخل الحل للمشكلة:",
-                                 reply_markup=ForceReply(selective=True))
-        return AWAITING_RESPONSE
-    elif data.startswith("ignore|"):
-        ticket_id = int(data.split("|")[1])
-        ticket = db.get_ticket(ticket_id)
-        if ticket['status'] in ("Client Responded", "Client Ignored", "Closed"):
-            safe_edit_message(query, text="التذكرة مغلقة أو تمت معالجتها بالفعل ولا يمكن تعديلها.")
-            return MAIN_MENU
-        db.update_ticket_status(ticket_id, "Client Ignored", {"action": "client_ignored"})
-        db.update_ticket_status(ticket_id, "Client Responded", {"action": "client_final_response", "message": "ignored"})
-        notify_supervisors_client_response(ticket_id, ignored=True)
-        safe_edit_message(query, text="تم إرسال ردك (تم تجاهل التذكرة).")
+    context.user_data['ticket_id'] = ticket_id
+    context.user_data['awaiting_response'] = True
+    context.bot.send_message(chat_id=query.message.chat_id,
+                             text="أدخل الحل للمشكلة:",
+                             reply_markup=ForceReply(selective=True))
+    return AWAITING_RESPONSE
+
+@routes.route("ignore", int)
+def ignore_ticket(update: Update, context: CallbackContext, ticket_id):
+    query = update.callback_query
+    ticket = db.get_ticket(ticket_id)
+    if ticket is None:
+        safe_edit_message(query, text="التذكرة غير موجودة.")
         return MAIN_MENU
-    else:
-        safe_edit_message(query, text="الإجراء غير معروف.")
+    event_id = db.transition_ticket(ticket_id, "client_ignored", actor=query.from_user.id,
+                                    notifications=client_response_notifications(ticket, ignored=True))
+    if not event_id:
+        safe_edit_message(query, text="التذكرة مغلقة أو تمت معالجتها بالفعل ولا يمكن تعديلها.")
         return MAIN_MENU
+    safe_edit_message(query, text="تم إرسال ردك (تم تجاهل التذكرة).")
+    return MAIN_MENU
 
 def send_issue_details_to_client(query, ticket_id):
     ticket = db.get_ticket(ticket_id)
@@ -140,7 +153,7 @@ def send_issue_details_to_client(query, ticket_id):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     if ticket['image_url']:
-        query.bot.send_photo(chat_id=query.message.chat_id, photo=ticket['image_url'])
+        photos.send_photo("client", query.bot.send_photo, ticket['image_url'], chat_id=query.message.chat_id)
     safe_edit_message(query, text=text, reply_markup=reply_markup, parse_mode="HTML")
 
 def send_full_issue_details_to_client(query, ticket_id):
@@ -155,7 +168,7 @@ def send_full_issue_details_to_client(query, ticket_id):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     if ticket['image_url']:
-        query.bot.send_photo(chat_id=query.message.chat_id, photo=ticket['image_url'])
+        photos.send_photo("client", query.bot.send_photo, ticket['image_url'], chat_id=query.message.chat_id)
     safe_edit_message(query, text=text, reply_markup=reply_markup, parse_mode="HTML")
 
 def reminder_callback(context: CallbackContext):
@@ -169,43 +182,43 @@ def client_awaiting_response_handler(update: Update, context: CallbackContext):
     solution = update.message.text.strip()
     ticket_id = context.user_data.get('ticket_id')
     ticket = db.get_ticket(ticket_id)
-    if ticket['status'] in ("Client Responded", "Client Ignored", "Closed"):
+    if ticket is None:
+        update.message.reply_text("التذكرة غير موجودة.")
+        context.user_data['awaiting_response'] = False
+        context.user_data.pop('ticket_id', None)
+        return MAIN_MENU
+    event_id = db.transition_ticket(ticket_id, "client_solution", actor=update.effective_user.id,
+                                    message=solution,
+                                    notifications=client_response_notifications(ticket, solution=solution))
+    if not event_id:
         update.message.reply_text("التذكرة مغلقة أو تمت معالجتها بالفعل ولا يمكن تعديلها.")
         return MAIN_MENU
-    db.update_ticket_status(ticket_id, "Client Responded", {"action": "client_solution", "message": solution})
-    notify_supervisors_client_response(ticket_id, solution=solution)
     update.message.reply_text("تم إرسال الحل إلى المشرف.")
     context.user_data['awaiting_response'] = False
     context.user_data.pop('ticket_id', None)
     return MAIN_MENU
 
-def notify_supervisors_client_response(ticket_id, solution=None, ignored=False):
-    ticket = db.get_ticket(ticket_id)
-    bot = Bot(token=config.SUPERVISOR_BOT_TOKEN)
+def client_response_notifications(ticket, solution=None, ignored=False):
+    """Supervisor notifications for the client_ignored / client_solution transition of `ticket`."""
+    ticket_id = ticket['ticket_id']
+    kind = "client_ignored" if ignored else "client_solution"
+    status = db.TRANSITIONS[kind][1]
     if ignored:
         text = (f"<b>تنبيه:</b> تم تجاهل التذكرة #{ticket_id} من قبل العميل.\n"
                 f"رقم الطلب: {ticket['order_id']}\n"
                 f"الوصف: {ticket['issue_description']}\n"
-                f"الحالة: {ticket['status']}")
+                f"الحالة: {status}")
         keyboard = [[InlineKeyboardButton("حل المشكلة", callback_data=f"sup_resolve|{ticket_id}")]]
     else:
         text = (f"<b>حل من العميل للتذكرة #{ticket_id}</b>\n"
                 f"رقم الطلب: {ticket['order_id']}\n"
                 f"الوصف: {ticket['issue_description']}\n"
                 f"الحل: {solution}\n"
-                f"الحالة: {ticket['status']}")
+                f"الحالة: {status}")
         keyboard = [[InlineKeyboardButton("إرسال للحالة إلى الوكيل", callback_data=f"sendto_da|{ticket_id}")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    for sup in db.get_supervisors():
-        try:
-            if ticket['image_url']:
-                bot.send_photo(chat_id=sup['chat_id'], photo=ticket['image_url'],
-                               caption=text, reply_markup=reply_markup, parse_mode="HTML")
-            else:
-                bot.send_message(chat_id=sup['chat_id'], text=text,
-                                 reply_markup=reply_markup, parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Error notifying supervisor {sup['chat_id']}: {e}")
+    return digest.supervisor_notifications(kind, ticket, text, photo=ticket['image_url'],
+                                           key=f"event:{db.EVENT_ID}", reply_markup=reply_markup)
 
 def default_handler_client(update: Update, context: CallbackContext):
     keyboard = [[InlineKeyboardButton("عرض المشاكل", callback_data="menu_show_tickets")]]
@@ -214,14 +227,16 @@ def default_handler_client(update: Update, context: CallbackContext):
     return MAIN_MENU
 
 def main():
-    updater = Updater(config.CLIENT_BOT_TOKEN, use_context=True)
+    updater = Updater(bot=bots.get("client"), use_context=True)
+    updater.job_queue.run_repeating(bots.log_stats, interval=bots.BOT_STATS_INTERVAL, first=bots.BOT_STATS_INTERVAL)
+    updater.job_queue.run_repeating(router.log_stats, interval=router.ROUTER_STATS_INTERVAL, first=router.ROUTER_STATS_INTERVAL)
     dp = updater.dispatcher
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
             SUBSCRIPTION_PHONE: [MessageHandler(Filters.text & ~Filters.command, subscription_phone)],
             SUBSCRIPTION_CLIENT: [MessageHandler(Filters.text & ~Filters.command, subscription_client)],
-            MAIN_MENU: [CallbackQueryHandler(client_main_menu_callback, pattern="^(menu_show_tickets|notify_pref\\|.*|solve\\|.*|ignore\\|.*)")],
+            MAIN_MENU: [routes.handler("menu_show_tickets", "notify_pref", "solve", "ignore")],
             AWAITING_RESPONSE: [MessageHandler(Filters.text & ~Filters.command, client_awaiting_response_handler)]
         },
         fallbacks=[CommandHandler('cancel', lambda u, c: u.message.reply_text("تم إلغاء العملية."))]
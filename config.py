@@ -11,3 +11,37 @@ CLOUDINARY_API_SECRET = "xyeXhE2jNwnwT995FMBkhLBfrqM"
 
 # (Optional) If you want to hard–code a supervisor chat ID for notifications, add it here:
 # SUPERVISOR_CHAT_ID = 123456789
+
+# Single-writer mode: one process (db_writer.py) owns every database write and
+# the bots send their mutations to it over a local socket. Reads stay local.
+DB_SINGLE_WRITER = False
+DB_WRITER_ADDRESS = ("127.0.0.1", 6543)
+DB_WRITER_AUTHKEY = b"issue-resolution-db-writer"
+
+# Closed tickets older than ARCHIVE_AFTER_DAYS are moved into ARCHIVE_DATABASE by
+# maintenance.py, which runs every MAINTENANCE_INTERVAL_HOURS.
+ARCHIVE_DATABASE = "issue_resolution_archive.db"
+ARCHIVE_AFTER_DAYS = 30
+MAINTENANCE_INTERVAL_HOURS = 6
+
+# Notifications are queued in the database outbox and delivered by outbox.py;
+# a message that keeps failing is dead-lettered after OUTBOX_MAX_ATTEMPTS.
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETENTION_DAYS = 7
+
+# Supervisors can take non-urgent notifications as one digest message per
+# window, chosen with /digest in the supervisor bot. SUPERVISOR_DIGEST_MINUTES
+# applies to those who have not chosen (0 = send every event immediately);
+# events in DIGEST_URGENT_EVENTS always go out at once.
+SUPERVISOR_DIGEST_MINUTES = 0
+DIGEST_URGENT_EVENTS = ("client_ignored",)
+
+# Order lookup used by the DA bot (orders.py). ORDERS_DATE pins the order date
+# the lookup asks for; None asks for today's orders.
+ORDERS_API_URL = "https://3e5440qr0c.execute-api.eu-west-3.amazonaws.com/dev/locus_info"
+ORDERS_DATE = "2024-11-05"
+
+# Inline buttons with free-text payloads carry short tokens (callbacks.py).
+# With persistence the tokens are also stored in the database, so buttons
+# sent before a restart still work.
+CALLBACK_TOKENS_PERSIST = True
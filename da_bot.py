@@ -1,27 +1,21 @@
 #!/usr/bin/env python3
 # da_bot.py
 
+import html
 import logging
-import datetime
 import unicodedata
-import urllib.parse
-import requests  # <-- Added to perform HTTP requests to the API endpoint
-from io import BytesIO
-import cloudinary
-import cloudinary.uploader
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply, Bot
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters,
-                          CallbackQueryHandler, ConversationHandler, CallbackContext)
+                          ConversationHandler, CallbackContext)
+import bots
+import callbacks
 import db
-import config
-import notifier  # For sending notifications to supervisors
-
-# Configure Cloudinary using credentials from config.py
-cloudinary.config( 
-    cloud_name = config.CLOUDINARY_CLOUD_NAME, 
-    api_key = config.CLOUDINARY_API_KEY, 
-    api_secret = config.CLOUDINARY_API_SECRET
-)
+import digest  # For sending notifications to supervisors
+import notifier
+import orders
+import router
+import uploads
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     level=logging.DEBUG)
@@ -49,6 +43,9 @@ ISSUE_OPTIONS = {
     "العميل": ["رفض الاستلام", "مغلق", "عطل بالسيستم", "لا يوجد مساحة للتخزين", "شك عميل فى سلامة العبوه"],
     "التسليم": ["وصول متاخر", "تالف", "عطل بالسياره"]
 }
+ISSUE_REASONS = list(ISSUE_OPTIONS)
+
+EXPIRED_BUTTON_TEXT = "انتهت صلاحية هذا الزر، يرجى البدء من جديد."
 
 def get_issue_types_for_reason(reason):
     """Return the list of issue types for the given reason."""
@@ -83,6 +80,9 @@ def start(update: Update, context: CallbackContext):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         update.message.reply_text(f"مرحباً {user.first_name}", reply_markup=reply_markup)
+        if sub['phone']:
+            # Most DAs tap "إضافة مشكلة" next; have their orders ready by then.
+            orders.prefetch(sub['phone'])
         return MAIN_MENU
 
 def subscription_phone(update: Update, context: CallbackContext):
@@ -102,9 +102,9 @@ def subscription_phone(update: Update, context: CallbackContext):
 # New function: fetch_orders
 #
 # This function uses the agent's (DA's) phone number from their subscription
-# and today’s date to call your external endpoint. It then parses the returned
-# JSON and builds a set of inline buttons. Each button’s callback data includes
-# the order_id and the client_name.
+# to look up their orders through orders.py (cached, time-bounded). It then
+# builds a set of inline buttons from the result. Each button’s callback data
+# includes the order_id and the client_name.
 # =============================================================================
 def fetch_orders(query, context):
     user = query.from_user
@@ -112,312 +112,371 @@ def fetch_orders(query, context):
     if not sub or not sub['phone']:
         safe_edit_message(query, text="لم يتم العثور على بيانات الاشتراك أو رقم الهاتف.")
         return MAIN_MENU
-    agent_phone = sub['phone']
-    today = datetime.datetime.now().strftime("%Y-%m-%d")
-    url = f"https://3e5440qr0c.execute-api.eu-west-3.amazonaws.com/dev/locus_info?agent_phone={agent_phone}&order_date='2024-11-05'"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        orders_data = response.json()
-        orders = orders_data.get("data", [])
-        if not orders:
-            safe_edit_message(query, text="لا توجد طلبات اليوم.")
-            return MAIN_MENU
-        keyboard = []
-        for order in orders:
-            order_id = order.get("order_id")
-            client_name = order.get("client_name")
-            # Build a callback data string that our handler will later parse
-            callback_data = f"select_order|{order_id}|{client_name}"
-            button_text = f"طلب {order_id} - {client_name}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        safe_edit_message(query, text="اختر الطلب الذي تريد رفع مشكلة عنه:", reply_markup=reply_markup)
-        return NEW_ISSUE_ORDER
-    except Exception as e:
-        safe_edit_message(query, text=f"حدث خطأ أثناء جلب الطلبات: {e}")
+        da_orders = orders.get_orders(sub['phone'])
+    except orders.OrdersUnavailable as e:
+        logger.warning("fetch_orders: order lookup failed: %s", e)
+        safe_edit_message(query, text="تعذر جلب الطلبات حالياً، يرجى المحاولة بعد قليل.")
+        return MAIN_MENU
+    if not da_orders:
+        safe_edit_message(query, text="لا توجد طلبات اليوم.")
         return MAIN_MENU
+    # Paging and searching work on this copy; the picker never refetches.
+    context.user_data['orders'] = da_orders
+    context.user_data['order_search'] = None
+    context.user_data['order_picker'] = (query.message.chat_id, query.message.message_id)
+    text, reply_markup = render_order_picker(da_orders, None, 0)
+    safe_edit_message(query, text=text, reply_markup=reply_markup)
+    return NEW_ISSUE_ORDER
 
-def da_main_menu_callback(update: Update, context: CallbackContext):
-    query = update.callback_query
-    query.answer()
-    data = query.data
-    logger.debug("da_main_menu_callback: Received data: %s", data)
-    if data == "menu_add_issue":
-        # Instead of asking the agent to choose a client and enter an order number manually,
-        # we now fetch the orders dynamically from the external API.
-        return fetch_orders(query, context)
-    elif data == "menu_query_issue":
-        user = query.from_user
-        tickets = [t for t in db.get_all_tickets() if t['da_id'] == user.id]
-        if tickets:
-            status_mapping = {
-                "Opened": "مفتوحة",
-                "Pending DA Action": "في انتظار إجراء الوكيل",
-                "Awaiting Client Response": "في انتظار رد العميل",
-                "Client Responded": "تم رد العميل",
-                "Client Ignored": "تم تجاهل العميل",
-                "Closed": "مغلقة",
-                "Additional Info Provided": "تم توفير معلومات إضافية",
-                "Pending DA Response": "في انتظار رد الوكيل"
-            }
-            for ticket in tickets:
-                status_ar = status_mapping.get(ticket['status'], ticket['status'])
-                resolution = ""
-                if ticket['status'] == "Closed":
-                    resolution = "\nالحل: تم الحل."
-                text = (f"<b>تذكرة #{ticket['ticket_id']}</b>\n"
-                        f"رقم الطلب: {ticket['order_id']}\n"
-                        f"الوصف: {ticket['issue_description']}\n"
-                        f"سبب المشكلة: {ticket['issue_reason']}\n"
-                        f"نوع المشكلة: {ticket['issue_type']}\n"
-                        f"الحالة: {status_ar}{resolution}")
-                query.message.reply_text(text, parse_mode="HTML")
-        else:
-            safe_edit_message(query, text="لا توجد تذاكر.")
+ORDER_PAGE_SIZE = 8
+
+def render_order_picker(da_orders, search, page):
+    """Text and keyboard for one page of the DA's orders, narrowed to those matching `search`."""
+    if search:
+        needle = db.normalize_arabic(search)
+        da_orders = [order for order in da_orders
+                     if needle in db.normalize_arabic(f"{order.get('order_id')} {order.get('client_name')}")]
+    pages = max(1, -(-len(da_orders) // ORDER_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    lines = ["اختر الطلب الذي تريد رفع مشكلة عنه:"]
+    if search:
+        lines.append(f"نتائج البحث عن «{html.escape(search)}»: {len(da_orders)}")
+    if pages > 1:
+        lines.append(f"صفحة {page + 1} من {pages}")
+    lines.append("للبحث، اكتب جزءاً من رقم الطلب أو اسم العميل.")
+    shown = [(order.get("order_id"), order.get("client_name"))
+             for order in da_orders[page * ORDER_PAGE_SIZE:(page + 1) * ORDER_PAGE_SIZE]]
+    keyboard = []
+    for (order_id, client_name), callback_data in zip(shown, callbacks.data_many("select_order", shown)):
+        button_text = f"طلب {order_id} - {client_name}"
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("السابق", callback_data=f"orders_page|{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("التالي", callback_data=f"orders_page|{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    if search:
+        keyboard.append([InlineKeyboardButton("إلغاء البحث", callback_data="orders_page|0|clear")])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+def order_search(update: Update, context: CallbackContext):
+    """Narrow the order picker to what the DA typed, editing the picker in place."""
+    da_orders = context.user_data.get('orders')
+    picker = context.user_data.get('order_picker')
+    if not da_orders or not picker:
+        update.message.reply_text("انتهت صلاحية قائمة الطلبات. اضغط «إضافة مشكلة» مرة أخرى.")
         return MAIN_MENU
-    # ---- New branch to handle the order selection from the API ----
-    elif data.startswith("select_order|"):
-        parts = data.split("|")
-        if len(parts) < 3:
-            safe_edit_message(query, text="بيانات الطلب غير صحيحة.")
-            return MAIN_MENU
-        order_id = parts[1]
-        client_name = parts[2]
-        context.user_data['order_id'] = order_id
-        context.user_data['client'] = client_name
-        safe_edit_message(query, text=f"تم اختيار الطلب رقم {order_id} للعميل {client_name}.\nالآن، صف المشكلة التي تواجهها:")
-        return NEW_ISSUE_DESCRIPTION
-    elif data.startswith("issue_reason_"):
-        reason = data.split("_", 2)[2]
-        context.user_data['issue_reason'] = reason
-        types = get_issue_types_for_reason(reason)
-        keyboard = [[InlineKeyboardButton(t, callback_data="issue_type_" + t)] for t in types]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        safe_edit_message(query, text="اختر نوع المشكلة:", reply_markup=reply_markup)
-        return NEW_ISSUE_TYPE
-    elif data.startswith("issue_type_"):
-        issue_type = urllib.parse.unquote(data.split("_", 2)[2])
-        context.user_data['issue_type'] = issue_type
-        keyboard = [
-            [InlineKeyboardButton("نعم", callback_data="attach_yes"),
-             InlineKeyboardButton("لا", callback_data="attach_no")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        safe_edit_message(query, text="هل تريد إرفاق صورة للمشكلة؟", reply_markup=reply_markup)
-        return ASK_IMAGE
-    elif data in ["attach_yes", "attach_no"]:
-        if data == "attach_yes":
-            safe_edit_message(query, text="يرجى إرسال الصورة:")
-            return WAIT_IMAGE
-        else:
-            return show_ticket_summary_for_edit(query, context)
-    elif data.startswith("da_moreinfo|"):
-        return da_moreinfo_callback_handler(update, context)
-    elif data.startswith("edit_ticket_") or data.startswith("edit_field_"):
-        return edit_ticket_prompt_callback(update, context)
+    search = update.message.text.strip()
+    context.user_data['order_search'] = search
+    text, reply_markup = render_order_picker(da_orders, search, 0)
+    try:
+        context.bot.edit_message_text(chat_id=picker[0], message_id=picker[1], text=text,
+                                      reply_markup=reply_markup, parse_mode="HTML")
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
+    return NEW_ISSUE_ORDER
+
+# =============================================================================
+# Callback routes
+# =============================================================================
+def unknown_callback(update: Update, context: CallbackContext):
+    safe_edit_message(update.callback_query, text="الخيار غير معروف.")
+    return MAIN_MENU
+
+def expired_callback(update: Update, context: CallbackContext):
+    safe_edit_message(update.callback_query, text=EXPIRED_BUTTON_TEXT)
+    return MAIN_MENU
+
+routes = router.Router("da", unknown=unknown_callback, expired=expired_callback)
+
+@routes.route("menu_add_issue")
+def add_issue(update: Update, context: CallbackContext):
+    # Instead of asking the agent to choose a client and enter an order number manually,
+    # we now fetch the orders dynamically from the external API.
+    return fetch_orders(update.callback_query, context)
+
+@routes.route("menu_query_issue")
+def show_my_tickets(update: Update, context: CallbackContext):
+    query = update.callback_query
+    user = query.from_user
+    tickets = db.get_tickets_by_da(user.id)
+    if tickets:
+        status_mapping = {
+            "Opened": "مفتوحة",
+            "Pending DA Action": "في انتظار إجراء الوكيل",
+            "Awaiting Client Response": "في انتظار رد العميل",
+            "Client Responded": "تم رد العميل",
+            "Client Ignored": "تم تجاهل العميل",
+            "Closed": "مغلقة",
+            "Additional Info Provided": "تم توفير معلومات إضافية",
+            "Pending DA Response": "في انتظار رد الوكيل"
+        }
+        for ticket in tickets:
+            status_ar = status_mapping.get(ticket['status'], ticket['status'])
+            resolution = ""
+            if ticket['status'] == "Closed":
+                solution = ticket['latest_supervisor_message'] or ticket['latest_client_solution'] or "تم الحل."
+                resolution = f"\nالحل: {solution}"
+                if ticket['resolved_at']:
+                    resolution += f"\nتاريخ الإغلاق: {ticket['resolved_at']}"
+            text = (f"<b>تذكرة #{ticket['ticket_id']}</b>\n"
+                    f"رقم الطلب: {ticket['order_id']}\n"
+                    f"الوصف: {ticket['issue_description']}\n"
+                    f"سبب المشكلة: {ticket['issue_reason']}\n"
+                    f"نوع المشكلة: {ticket['issue_type']}\n"
+                    f"الحالة: {status_ar}{resolution}")
+            query.message.reply_text(text, parse_mode="HTML")
     else:
-        safe_edit_message(query, text="الخيار غير معروف.")
+        safe_edit_message(query, text="لا توجد تذاكر.")
+    return MAIN_MENU
+
+@routes.route("orders_page", int)
+def orders_page(update: Update, context: CallbackContext, page, clear=None):
+    query = update.callback_query
+    da_orders = context.user_data.get('orders')
+    if not da_orders:
+        safe_edit_message(query, text="انتهت صلاحية قائمة الطلبات. اضغط «إضافة مشكلة» مرة أخرى.")
         return MAIN_MENU
+    if clear:
+        context.user_data['order_search'] = None
+    text, reply_markup = render_order_picker(da_orders, context.user_data.get('order_search'), page)
+    safe_edit_message(query, text=text, reply_markup=reply_markup)
+    return NEW_ISSUE_ORDER
+
+@routes.route("select_order", payload=True)
+def select_order(update: Update, context: CallbackContext, order):
+    order_id, client_name = order
+    context.user_data['order_id'] = order_id
+    context.user_data['client'] = client_name
+    for key in ('orders', 'order_search', 'order_picker'):
+        context.user_data.pop(key, None)
+    safe_edit_message(update.callback_query,
+                      text=f"تم اختيار الطلب رقم {order_id} للعميل {client_name}.\nالآن، صف المشكلة التي تواجهها:")
+    return NEW_ISSUE_DESCRIPTION
+
+@routes.route("issue_reason", payload=True)
+def choose_issue_reason(update: Update, context: CallbackContext, reason):
+    context.user_data['issue_reason'] = reason
+    types = get_issue_types_for_reason(reason)
+    keyboard = [[InlineKeyboardButton(t, callback_data=data)]
+                for t, data in zip(types, callbacks.data_many("issue_type", types))]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    safe_edit_message(update.callback_query, text="اختر نوع المشكلة:", reply_markup=reply_markup)
+    return NEW_ISSUE_TYPE
+
+@routes.route("issue_type", payload=True)
+def choose_issue_type(update: Update, context: CallbackContext, issue_type):
+    context.user_data['issue_type'] = issue_type
+    keyboard = [
+        [InlineKeyboardButton("نعم", callback_data="attach_yes"),
+         InlineKeyboardButton("لا", callback_data="attach_no")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    safe_edit_message(update.callback_query, text="هل تريد إرفاق صورة للمشكلة؟", reply_markup=reply_markup)
+    return ASK_IMAGE
+
+@routes.route("attach_yes")
+def attach_image(update: Update, context: CallbackContext):
+    safe_edit_message(update.callback_query, text="يرجى إرسال الصورة:")
+    return WAIT_IMAGE
+
+@routes.route("attach_no")
+def skip_image(update: Update, context: CallbackContext):
+    return show_ticket_summary_for_edit(update.callback_query, context)
 
 def new_issue_description(update: Update, context: CallbackContext):
     description = update.message.text.strip()
     context.user_data['description'] = description
-    keyboard = [
-        [InlineKeyboardButton("المخزن", callback_data="issue_reason_المخزن"),
-         InlineKeyboardButton("المورد", callback_data="issue_reason_المورد")],
-        [InlineKeyboardButton("العميل", callback_data="issue_reason_العميل"),
-         InlineKeyboardButton("التسليم", callback_data="issue_reason_التسليم")]
-    ]
+    buttons = [InlineKeyboardButton(reason, callback_data=data)
+               for reason, data in zip(ISSUE_REASONS, callbacks.data_many("issue_reason", ISSUE_REASONS))]
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
     reply_markup = InlineKeyboardMarkup(keyboard)
     update.message.reply_text("اختر سبب المشكلة:", reply_markup=reply_markup)
     return NEW_ISSUE_REASON
 
 def wait_image(update: Update, context: CallbackContext):
     if update.message.photo:
-        try:
-            photo = update.message.photo[-1]
-            file = photo.get_file()
-            bio = BytesIO()
-            file.download(out=bio)
-            bio.seek(0)
-            result = cloudinary.uploader.upload(bio)
-            secure_url = result.get('secure_url')
-            if secure_url:
-                context.user_data['image'] = secure_url
-                return show_ticket_summary_for_edit(update.message, context)
-            else:
-                update.message.reply_text("فشل رفع الصورة. حاول مرة أخرى:")
-                return WAIT_IMAGE
-        except Exception as e:
-            logger.error(f"Error uploading image: {e}")
-            update.message.reply_text("حدث خطأ أثناء رفع الصورة. حاول مرة أخرى:")
-            return WAIT_IMAGE
+        # The upload runs in the background; the summary shows its progress.
+        data = context.user_data
+        data.pop('image', None)
+        upload = data['image_upload'] = uploads.start(update.message.photo)
+        state = show_ticket_summary_for_edit(update.message, context)
+        upload.add_done_callback(lambda done: refresh_summary_image(context.bot, data, done))
+        return state
     else:
         update.message.reply_text("لم يتم إرسال صورة صحيحة. أعد الإرسال:")
         return WAIT_IMAGE
 
-def show_ticket_summary_for_edit(source, context: CallbackContext):
-    if hasattr(source, 'edit_message_text'):
-        msg_func = source.edit_message_text
-        kwargs = {}
-    else:
-        msg_func = context.bot.send_message
-        kwargs = {'chat_id': source.chat.id}
-    data = context.user_data
+def summary_image_status(data):
+    upload = data.get('image_upload')
+    if data.get('image') or upload is None:
+        return data.get('image') or "لا توجد"
+    if not upload.done():
+        return "جارٍ رفع الصورة..."
+    return "تم رفع الصورة" if uploads.result(upload, timeout=0) else "تعذر رفع الصورة"
+
+def ticket_summary(data):
     summary = (f"رقم الطلب: {data.get('order_id','')}\n"
                f"الوصف: {data.get('description','')}\n"
                f"سبب المشكلة: {data.get('issue_reason','')}\n"
                f"نوع المشكلة: {data.get('issue_type','')}\n"
                f"العميل: {data.get('client','')}\n"
-               f"الصورة: {data.get('image', 'لا توجد')}")
+               f"الصورة: {summary_image_status(data)}")
     text = "ملخص التذكرة المدخلة:\n" + summary + "\nهل تريد تعديل التذكرة قبل الإرسال؟"
     reply_markup = InlineKeyboardMarkup([
         [InlineKeyboardButton("نعم", callback_data="edit_ticket_yes"),
          InlineKeyboardButton("لا", callback_data="edit_ticket_no")]
     ])
-    msg_func(text=text, reply_markup=reply_markup, **kwargs)
+    return text, reply_markup
+
+def show_ticket_summary_for_edit(source, context: CallbackContext):
+    if hasattr(source, 'edit_message_text'):
+        msg_func = source.edit_message_text
+        kwargs = {}
+    else:
+        msg_func = context.bot.send_message
+        kwargs = {'chat_id': source.chat.id}
+    text, reply_markup = ticket_summary(context.user_data)
+    message = msg_func(text=text, reply_markup=reply_markup, **kwargs)
+    if hasattr(message, 'message_id'):
+        context.user_data['image_summary'] = (message.chat_id, message.message_id)
     return EDIT_PROMPT
 
-def edit_ticket_prompt_callback(update: Update, context: CallbackContext):
+def refresh_summary_image(bot, data, upload):
+    """
+    Upload done-callback (runs on the upload worker): replace the summary's
+    "uploading" line with the outcome, unless the DA has already moved on
+    from that message (whoever pops 'image_summary' first owns it).
+    """
+    if data.get('image_upload') is not upload:
+        return
+    summary = data.pop('image_summary', None)
+    if summary is None:
+        return
+    text, reply_markup = ticket_summary(data)
+    try:
+        bot.edit_message_text(chat_id=summary[0], message_id=summary[1], text=text, reply_markup=reply_markup)
+    except TelegramError as e:
+        logger.warning("refresh_summary_image: could not update summary: %s", e)
+
+@routes.route("edit_ticket_no")
+def submit_ticket(update: Update, context: CallbackContext):
+    return finalize_ticket_da(update.callback_query, context, image_url=context.user_data.get('image', None))
+
+@routes.route("edit_ticket_yes")
+def choose_field_to_edit(update: Update, context: CallbackContext):
+    context.user_data.pop('image_summary', None)
+    keyboard = [
+        [InlineKeyboardButton("رقم الطلب", callback_data="edit_field_order"),
+         InlineKeyboardButton("الوصف", callback_data="edit_field_description")],
+        [InlineKeyboardButton("سبب المشكلة", callback_data="edit_field_issue_reason"),
+         InlineKeyboardButton("نوع المشكلة", callback_data="edit_field_issue_type")],
+        [InlineKeyboardButton("العميل", callback_data="edit_field_client"),
+         InlineKeyboardButton("الصورة", callback_data="edit_field_image")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    safe_edit_message(update.callback_query, text="اختر الحقل الذي تريد تعديله:", reply_markup=reply_markup)
+    return EDIT_FIELD
+
+@routes.route("edit_field_issue_reason")
+def edit_issue_reason(update: Update, context: CallbackContext):
+    datas = callbacks.data_many("set_issue_reason", ISSUE_REASONS)
+    keyboard_buttons = [[InlineKeyboardButton(option, callback_data=data)]
+                        for option, data in zip(ISSUE_REASONS, datas)]
+    reply_markup = InlineKeyboardMarkup(keyboard_buttons)
+    safe_edit_message(update.callback_query, text="اختر سبب المشكلة الجديد:", reply_markup=reply_markup)
+    return EDIT_FIELD
+
+@routes.route("set_issue_reason", payload=True)
+def set_issue_reason(update: Update, context: CallbackContext, new_reason):
     query = update.callback_query
-    query.answer()
-    data = query.data
-    if data == "edit_ticket_no":
-        return finalize_ticket_da(query, context, image_url=context.user_data.get('image', None))
-    elif data == "edit_ticket_yes":
-        keyboard = [
-            [InlineKeyboardButton("رقم الطلب", callback_data="edit_field_order"),
-             InlineKeyboardButton("الوصف", callback_data="edit_field_description")],
-            [InlineKeyboardButton("سبب المشكلة", callback_data="edit_field_issue_reason"),
-             InlineKeyboardButton("نوع المشكلة", callback_data="edit_field_issue_type")],
-            [InlineKeyboardButton("العميل", callback_data="edit_field_client"),
-             InlineKeyboardButton("الصورة", callback_data="edit_field_image")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        safe_edit_message(query, text="اختر الحقل الذي تريد تعديله:", reply_markup=reply_markup)
+    context.user_data['issue_reason'] = new_reason
+    log_entry = {"action": "edit_field", "field": "سبب المشكلة", "new_value": new_reason}
+    context.user_data.setdefault('edit_log', []).append(log_entry)
+    types = get_issue_types_for_reason(new_reason)
+    if types:
+        keyboard_buttons = [[InlineKeyboardButton(opt, callback_data=data)]
+                            for opt, data in zip(types, callbacks.data_many("set_issue_type", types))]
+        reply_markup = InlineKeyboardMarkup(keyboard_buttons)
+        safe_edit_message(query, text=f"تم تعديل سبب المشكلة إلى: {new_reason}\nالآن اختر نوع المشكلة:", reply_markup=reply_markup)
         return EDIT_FIELD
     else:
-        keyboard = [
-            [InlineKeyboardButton("نعم", callback_data="edit_ticket_yes"),
-             InlineKeyboardButton("لا", callback_data="edit_ticket_no")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        safe_edit_message(query, text="هل تريد تعديل التذكرة قبل الإرسال؟", reply_markup=reply_markup)
+        safe_edit_message(query, text=f"تم تعديل سبب المشكلة إلى: {new_reason}\nولا توجد خيارات متاحة لنوع المشكلة لهذا السبب.")
         return EDIT_PROMPT
 
-def edit_field_callback(update: Update, context: CallbackContext):
+@routes.route("edit_field_issue_type")
+def edit_issue_type(update: Update, context: CallbackContext):
     query = update.callback_query
-    query.answer()
-    field = query.data
-    if field == "edit_field_issue_reason":
-        options = ["المخزن", "المورد", "العميل", "التسليم"]
-        mapping = {}
-        keyboard_buttons = []
-        for i, option in enumerate(options):
-            key = str(i)
-            mapping[key] = option
-            keyboard_buttons.append([InlineKeyboardButton(option, callback_data="edit_field_issue_reason_idx_" + key)])
-        context.user_data['edit_reason_map'] = mapping
-        reply_markup = InlineKeyboardMarkup(keyboard_buttons)
-        safe_edit_message(query, text="اختر سبب المشكلة الجديد:", reply_markup=reply_markup)
-        return EDIT_FIELD
-    if field.startswith("edit_field_issue_reason_idx_"):
-        idx = field[len("edit_field_issue_reason_idx_"):]
-        mapping = context.user_data.get('edit_reason_map', {})
-        new_reason = mapping.get(idx)
-        if not new_reason:
-            safe_edit_message(query, text="خطأ في اختيار سبب المشكلة.")
-            return EDIT_PROMPT
-        context.user_data['issue_reason'] = new_reason
-        log_entry = {"action": "edit_field", "field": "سبب المشكلة", "new_value": new_reason}
-        context.user_data.setdefault('edit_log', []).append(log_entry)
-        types = get_issue_types_for_reason(new_reason)
-        if types:
-            mapping2 = {}
-            keyboard_buttons = []
-            for i, opt in enumerate(types):
-                key = str(i)
-                mapping2[key] = opt
-                keyboard_buttons.append([InlineKeyboardButton(opt, callback_data="edit_field_issue_type_idx_" + key)])
-            context.user_data['edit_type_map'] = mapping2
-            reply_markup = InlineKeyboardMarkup(keyboard_buttons)
-            safe_edit_message(query, text=f"تم تعديل سبب المشكلة إلى: {new_reason}\nالآن اختر نوع المشكلة:", reply_markup=reply_markup)
-            return EDIT_FIELD
-        else:
-            safe_edit_message(query, text=f"تم تعديل سبب المشكلة إلى: {new_reason}\nولا توجد خيارات متاحة لنوع المشكلة لهذا السبب.")
-            return EDIT_PROMPT
-    if field == "edit_field_issue_type":
-        current_reason = context.user_data.get('issue_reason', '')
-        types = get_issue_types_for_reason(current_reason)
-        if not types:
-            safe_edit_message(query, text="لا توجد خيارات متاحة لنوع المشكلة.")
-            return EDIT_PROMPT
-        mapping = {}
-        keyboard_buttons = []
-        for i, option in enumerate(types):
-            key = str(i)
-            mapping[key] = option
-            keyboard_buttons.append([InlineKeyboardButton(option, callback_data="edit_field_issue_type_idx_" + key)])
-        context.user_data['edit_type_map'] = mapping
-        reply_markup = InlineKeyboardMarkup(keyboard_buttons)
-        safe_edit_message(query, text="اختر نوع المشكلة الجديد:", reply_markup=reply_markup)
-        return EDIT_FIELD
-    if field in ["edit_field_order", "edit_field_description", "edit_field_image", "edit_field_client"]:
-        context.user_data['edit_field'] = field
-        if field == "edit_field_client":
-            keyboard = [
-                [InlineKeyboardButton("بوبا", callback_data="edit_field_client_بوبا"),
-                 InlineKeyboardButton("بتلكو", callback_data="edit_field_client_بتلكو"),
-                 InlineKeyboardButton("بيبس", callback_data="edit_field_client_بيبس")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            safe_edit_message(query, text="اختر العميل الجديد:", reply_markup=reply_markup)
-            return EDIT_FIELD
-        else:
-            field_name = field.split('_')[-1]
-            safe_edit_message(query, text=f"أدخل القيمة الجديدة لـ {field_name}:")
-            return EDIT_FIELD
-    if field.startswith("edit_field_issue_type_idx_"):
-        idx = field[len("edit_field_issue_type_idx_"):]
-        mapping = context.user_data.get('edit_type_map', {})
-        new_type = mapping.get(idx)
-        if not new_type:
-            safe_edit_message(query, text="خطأ في اختيار نوع المشكلة.")
-            return EDIT_PROMPT
-        context.user_data['issue_type'] = new_type
-        log_entry = {"action": "edit_field", "field": "نوع المشكلة", "new_value": new_type}
-        context.user_data.setdefault('edit_log', []).append(log_entry)
-        safe_edit_message(query, text=f"تم تعديل نوع المشكلة إلى: {new_type}")
-        keyboard = [
-            [InlineKeyboardButton("نعم", callback_data="edit_ticket_yes"),
-             InlineKeyboardButton("لا", callback_data="edit_ticket_no")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.send_message(chat_id=query.message.chat.id,
-                                 text="هل تريد تعديل التذكرة مرة أخرى؟",
-                                 reply_markup=reply_markup)
-        return EDIT_PROMPT
-    if field.startswith("edit_field_client_"):
-        new_client = field[len("edit_field_client_"):].strip()
-        context.user_data['client'] = new_client
-        log_entry = {"action": "edit_field", "field": "العميل", "new_value": new_client}
-        context.user_data.setdefault('edit_log', []).append(log_entry)
-        safe_edit_message(query, text=f"تم تعديل العميل إلى: {new_client}")
-        keyboard = [
-            [InlineKeyboardButton("نعم", callback_data="edit_ticket_yes"),
-             InlineKeyboardButton("لا", callback_data="edit_ticket_no")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        context.bot.send_message(chat_id=query.message.chat.id,
-                                 text="هل تريد تعديل التذكرة مرة أخرى؟",
-                                 reply_markup=reply_markup)
+    current_reason = context.user_data.get('issue_reason', '')
+    types = get_issue_types_for_reason(current_reason)
+    if not types:
+        safe_edit_message(query, text="لا توجد خيارات متاحة لنوع المشكلة.")
         return EDIT_PROMPT
-    field_name = field.split('_')[-1]
+    keyboard_buttons = [[InlineKeyboardButton(option, callback_data=data)]
+                        for option, data in zip(types, callbacks.data_many("set_issue_type", types))]
+    reply_markup = InlineKeyboardMarkup(keyboard_buttons)
+    safe_edit_message(query, text="اختر نوع المشكلة الجديد:", reply_markup=reply_markup)
+    return EDIT_FIELD
+
+@routes.route("set_issue_type", payload=True)
+def set_issue_type(update: Update, context: CallbackContext, new_type):
+    query = update.callback_query
+    context.user_data['issue_type'] = new_type
+    log_entry = {"action": "edit_field", "field": "نوع المشكلة", "new_value": new_type}
+    context.user_data.setdefault('edit_log', []).append(log_entry)
+    safe_edit_message(query, text=f"تم تعديل نوع المشكلة إلى: {new_type}")
+    return ask_edit_again(query, context)
+
+@routes.route("edit_field_client")
+def edit_client(update: Update, context: CallbackContext):
+    context.user_data['edit_field'] = "edit_field_client"
+    clients = ("بوبا", "بتلكو", "بيبس")
+    keyboard = [[InlineKeyboardButton(client, callback_data=data)
+                 for client, data in zip(clients, callbacks.data_many("set_client", clients))]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    safe_edit_message(update.callback_query, text="اختر العميل الجديد:", reply_markup=reply_markup)
+    return EDIT_FIELD
+
+@routes.route("set_client", payload=True)
+def set_client(update: Update, context: CallbackContext, new_client):
+    query = update.callback_query
+    context.user_data['client'] = new_client
+    log_entry = {"action": "edit_field", "field": "العميل", "new_value": new_client}
+    context.user_data.setdefault('edit_log', []).append(log_entry)
+    safe_edit_message(query, text=f"تم تعديل العميل إلى: {new_client}")
+    return ask_edit_again(query, context)
+
+@routes.route("edit_field_order")
+@routes.route("edit_field_description")
+@routes.route("edit_field_image")
+def edit_text_field(update: Update, context: CallbackContext):
+    query = update.callback_query
+    field = query.data
     context.user_data['edit_field'] = field
+    field_name = field.split('_')[-1]
     safe_edit_message(query, text=f"أدخل القيمة الجديدة لـ {field_name}:")
     return EDIT_FIELD
 
+EDIT_FIELD_ROUTES = ("edit_field_order", "edit_field_description", "edit_field_image", "edit_field_client",
+                     "edit_field_issue_reason", "edit_field_issue_type",
+                     "set_issue_reason", "set_issue_type", "set_client")
+EDIT_ROUTES = ("edit_ticket_yes", "edit_ticket_no") + EDIT_FIELD_ROUTES
+
+def ask_edit_again(query, context):
+    keyboard = [
+        [InlineKeyboardButton("نعم", callback_data="edit_ticket_yes"),
+         InlineKeyboardButton("لا", callback_data="edit_ticket_no")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    context.bot.send_message(chat_id=query.message.chat.id,
+                             text="هل تريد تعديل التذكرة مرة أخرى؟",
+                             reply_markup=reply_markup)
+    return EDIT_PROMPT
+
 def edit_field_input_handler(update: Update, context: CallbackContext):
     if 'edit_field' in context.user_data:
         field = context.user_data['edit_field']
@@ -428,6 +487,7 @@ def edit_field_input_handler(update: Update, context: CallbackContext):
             context.user_data['description'] = new_value
         elif field == "edit_field_image":
             context.user_data['image'] = new_value
+            context.user_data.pop('image_upload', None)
         elif field == "edit_field_issue_reason":
             context.user_data['issue_reason'] = new_value
         field_name = field.split('_')[-1]
@@ -450,24 +510,57 @@ def finalize_ticket_da(source, context, image_url):
         user = source.from_user
     else:
         user = source.message.from_user
-    data = context.user_data
+    # Claim the summary message before touching it, so a finishing upload
+    # cannot edit it back to the summary and its buttons.
+    context.user_data.pop('image_summary', None)
+    data = dict(context.user_data)
+    context.user_data.clear()
+    upload = data.pop('image_upload', None)
+    if upload is not None and not upload.done():
+        # Waiting here would hold a dispatcher thread for up to
+        # uploads.UPLOAD_TIMEOUT; the upload's worker creates the ticket instead.
+        reply_to_da(source, context, user, "جارٍ رفع الصورة، سيتم إنشاء التذكرة عند اكتمال الرفع.")
+        upload.add_done_callback(lambda done: create_ticket_after_upload(context.bot, user.id, data, done))
+        return MAIN_MENU
+    reply_to_da(source, context, user, create_ticket_da(user.id, data, image_url, upload))
+    return MAIN_MENU
+
+def reply_to_da(source, context, user, text):
+    if hasattr(source, 'edit_message_text'):
+        source.edit_message_text(text)
+    else:
+        context.bot.send_message(chat_id=user.id, text=text)
+
+def create_ticket_da(user_id, data, image_url, upload=None):
+    """Create the ticket described by the conversation `data`; returns the confirmation text."""
+    image_note = ""
+    if upload is not None:
+        image_url = uploads.result(upload, timeout=0)
+        if not image_url:
+            image_note = "\nتعذر رفع الصورة، تم إنشاء التذكرة بدونها."
     order_id = data.get('order_id')
     description = data.get('description')
     issue_reason = data.get('issue_reason')
     issue_type = data.get('issue_type')
     client_selected = data.get('client', 'غير محدد')
-    ticket_id = db.add_ticket(order_id, description, issue_reason, issue_type, client_selected, image_url, "Opened", user.id)
-    if hasattr(source, 'edit_message_text'):
-        source.edit_message_text(f"تم إنشاء التذكرة برقم {ticket_id}.\nالحالة: Opened")
-    else:
-        context.bot.send_message(chat_id=user.id, text=f"تم إنشاء التذكرة برقم {ticket_id}.\nالحالة: Opened")
-    if 'edit_log' in context.user_data:
-        for log_entry in context.user_data['edit_log']:
-            db.update_ticket_status(ticket_id, "Opened", log_entry)
-    ticket = db.get_ticket(ticket_id)
-    notifier.notify_supervisors(ticket)
-    context.user_data.clear()
-    return MAIN_MENU
+    new_ticket = {"ticket_id": db.TICKET_ID, "order_id": order_id, "issue_description": description,
+                  "image_url": image_url}
+    ticket = db.create_ticket(order_id, description, issue_reason, issue_type, client_selected, image_url,
+                              "Opened", user_id, events=data.get('edit_log', []),
+                              notifications=notifier.new_ticket_notifications(new_ticket))
+    return f"تم إنشاء التذكرة برقم {ticket['ticket_id']}.\nالحالة: Opened{image_note}"
+
+def create_ticket_after_upload(bot, user_id, data, upload):
+    """Upload done-callback for a ticket submitted while its photo was still uploading."""
+    try:
+        text = create_ticket_da(user_id, data, None, upload)
+    except Exception as e:
+        logger.error("create_ticket_after_upload: could not create ticket for %s: %s", user_id, e)
+        text = "حدث خطأ أثناء إنشاء التذكرة. أعد المحاولة."
+    try:
+        bot.send_message(chat_id=user_id, text=text)
+    except TelegramError as e:
+        logger.warning("create_ticket_after_upload: could not tell DA %s: %s", user_id, e)
 
 # =============================================================================
 # Additional Info & Close Issue Flows
@@ -479,48 +572,46 @@ def da_awaiting_response_handler(update: Update, context: CallbackContext):
     if not ticket_id:
         update.message.reply_text("حدث خطأ. أعد المحاولة.")
         return MAIN_MENU
-    db.update_ticket_status(ticket_id, "Additional Info Provided", {"action": "da_moreinfo", "message": additional_info})
+    ticket = db.get_ticket(ticket_id)
+    if ticket is None:
+        update.message.reply_text("التذكرة غير موجودة.")
+        context.user_data.pop('ticket_id', None)
+        return MAIN_MENU
+    event_id = db.transition_ticket(ticket_id, "da_moreinfo", actor=update.effective_user.id,
+                                    message=additional_info,
+                                    notifications=da_moreinfo_notifications(ticket, additional_info))
+    if not event_id:
+        update.message.reply_text("لم تعد التذكرة بانتظار معلومات إضافية.")
+        context.user_data.pop('ticket_id', None)
+        return MAIN_MENU
     logger.debug("da_awaiting_response_handler: Updated ticket status for ticket_id=%s", ticket_id)
-    notify_supervisors_da_moreinfo(ticket_id, additional_info)
     update.message.reply_text("تم إرسال المعلومات الإضافية إلى المشرف.")
     context.user_data.pop('ticket_id', None)
     return MAIN_MENU
 
-def da_callback_handler(update: Update, context: CallbackContext):
+@routes.route("close", int)
+def close_ticket(update: Update, context: CallbackContext, ticket_id):
     query = update.callback_query
-    query.answer()
-    data = query.data
-    logger.debug("da_callback_handler: Received callback data: %s", data)
-    if data.startswith("close|"):
-        ticket_id = int(data.split("|")[1])
-        db.update_ticket_status(ticket_id, "Closed", {"action": "da_closed"})
-        safe_edit_message(query, text="تم إغلاق التذكرة بنجاح.")
-        bot_sup = Bot(token=config.SUPERVISOR_BOT_TOKEN)
-        for sup in db.get_supervisors():
-            try:
-                bot_sup.send_message(chat_id=sup['chat_id'],
-                                     text=f"التذكرة #{ticket_id} تم إغلاقها من قبل الوكيل.",
-                                     parse_mode="HTML")
-            except Exception as e:
-                logger.error("da_callback_handler: Error notifying supervisor of closure for ticket %s: %s", ticket_id, e)
+    ticket = db.get_ticket(ticket_id)
+    if ticket is None:
+        safe_edit_message(query, text="التذكرة غير موجودة.")
         return MAIN_MENU
-    elif data.startswith("da_moreinfo|"):
-        return da_moreinfo_callback_handler(update, context)
-    else:
-        safe_edit_message(query, text="الإجراء غير معروف.")
+    event_id = db.transition_ticket(
+        ticket_id, "da_closed", actor=query.from_user.id,
+        notifications=digest.supervisor_notifications("da_closed", ticket,
+                                                      f"التذكرة #{ticket_id} تم إغلاقها من قبل الوكيل.",
+                                                      key=f"event:{db.EVENT_ID}"))
+    if not event_id:
+        safe_edit_message(query, text="التذكرة مغلقة بالفعل.")
         return MAIN_MENU
+    safe_edit_message(query, text="تم إغلاق التذكرة بنجاح.")
+    return MAIN_MENU
 
-def da_moreinfo_callback_handler(update: Update, context: CallbackContext):
+@routes.route("da_moreinfo", int)
+def ask_for_more_info(update: Update, context: CallbackContext, ticket_id):
     query = update.callback_query
-    query.answer()
-    data = query.data
-    try:
-        ticket_id = int(data.split("|")[1])
-    except (IndexError, ValueError):
-        safe_edit_message(query, text="خطأ في بيانات التذكرة.")
-        return MAIN_MENU
     context.user_data['ticket_id'] = ticket_id
-    logger.debug("da_moreinfo_callback_handler: Stored ticket_id=%s", ticket_id)
+    logger.debug("ask_for_more_info: Stored ticket_id=%s", ticket_id)
     prompt_da_for_more_info(ticket_id, query.message.chat.id, context)
     return MORE_INFO_PROMPT
 
@@ -540,26 +631,18 @@ def prompt_da_for_more_info(ticket_id: int, chat_id: int, context: CallbackConte
     logger.debug("prompt_da_for_more_info: Prompting DA in chat %s for ticket %s", chat_id, ticket_id)
     context.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", reply_markup=ForceReply(selective=True))
 
-def notify_supervisors_da_moreinfo(ticket_id: int, additional_info: str):
-    ticket = db.get_ticket(ticket_id)
-    if not ticket:
-        logger.error("notify_supervisors_da_moreinfo: Ticket %s not found", ticket_id)
-        return
-    bot = Bot(token=config.SUPERVISOR_BOT_TOKEN)
+def da_moreinfo_notifications(ticket, additional_info: str):
+    """Supervisor notifications for the da_moreinfo transition of `ticket`."""
+    ticket_id = ticket['ticket_id']
     text = (f"<b>معلومات إضافية من الوكيل للتذكرة #{ticket_id}</b>\n"
             f"رقم الطلب: {ticket['order_id']}\n"
             f"الوصف: {ticket['issue_description']}\n"
             f"المعلومات الإضافية: {additional_info}\n"
-            f"الحالة: {ticket['status']}")
+            f"الحالة: {db.TRANSITIONS['da_moreinfo'][1]}")
     keyboard = [[InlineKeyboardButton("عرض التفاصيل", callback_data=f"view|{ticket_id}")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    logger.debug("notify_supervisors_da_moreinfo: Notifying supervisors for ticket %s", ticket_id)
-    for sup in db.get_supervisors():
-        try:
-            bot.send_message(chat_id=sup['chat_id'], text=text, reply_markup=reply_markup, parse_mode="HTML")
-            logger.debug("notify_supervisors_da_moreinfo: Notified supervisor %s", sup['chat_id'])
-        except Exception as e:
-            logger.error("notify_supervisors_da_moreinfo: Error notifying supervisor %s: %s", sup['chat_id'], e)
+    return digest.supervisor_notifications("da_moreinfo", ticket, text, key=f"event:{db.EVENT_ID}",
+                                           reply_markup=reply_markup)
 
 # =============================================================================
 # Default Handlers
@@ -581,26 +664,31 @@ def default_handler_da_edit(update: Update, context: CallbackContext):
 # Main function
 # =============================================================================
 def main():
-    updater = Updater(config.DA_BOT_TOKEN, use_context=True)
+    updater = Updater(bot=bots.get("da"), use_context=True)
+    updater.job_queue.run_repeating(bots.log_stats, interval=bots.BOT_STATS_INTERVAL, first=bots.BOT_STATS_INTERVAL)
+    updater.job_queue.run_repeating(router.log_stats, interval=router.ROUTER_STATS_INTERVAL, first=router.ROUTER_STATS_INTERVAL)
     dp = updater.dispatcher
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
             SUBSCRIPTION_PHONE: [MessageHandler(Filters.text & ~Filters.command, subscription_phone)],
             MAIN_MENU: [
-                CallbackQueryHandler(da_main_menu_callback,
-                                     pattern="^(menu_add_issue|menu_query_issue|issue_reason_.*|issue_type_.*|attach_.*|edit_ticket_.*|edit_field_.*|da_moreinfo\\|.*)"),
+                routes.handler("menu_add_issue", "menu_query_issue", "issue_reason", "issue_type",
+                               "attach_yes", "attach_no", "da_moreinfo", *EDIT_ROUTES),
                 MessageHandler(Filters.text & ~Filters.command, default_handler_da)
             ],
-            NEW_ISSUE_ORDER: [CallbackQueryHandler(da_main_menu_callback, pattern="^select_order\\|.*")],
+            NEW_ISSUE_ORDER: [
+                routes.handler("select_order", "orders_page"),
+                MessageHandler(Filters.text & ~Filters.command, order_search)
+            ],
             NEW_ISSUE_DESCRIPTION: [MessageHandler(Filters.text & ~Filters.command, new_issue_description)],
-            NEW_ISSUE_REASON: [CallbackQueryHandler(da_main_menu_callback, pattern="^issue_reason_.*")],
-            NEW_ISSUE_TYPE: [CallbackQueryHandler(da_main_menu_callback, pattern="^issue_type_.*")],
-            ASK_IMAGE: [CallbackQueryHandler(da_main_menu_callback, pattern="^(attach_yes|attach_no)$")],
+            NEW_ISSUE_REASON: [routes.handler("issue_reason")],
+            NEW_ISSUE_TYPE: [routes.handler("issue_type")],
+            ASK_IMAGE: [routes.handler("attach_yes", "attach_no")],
             WAIT_IMAGE: [MessageHandler(Filters.photo, wait_image)],
-            EDIT_PROMPT: [CallbackQueryHandler(edit_ticket_prompt_callback, pattern="^(edit_ticket_yes|edit_ticket_no)$")],
+            EDIT_PROMPT: [routes.handler("edit_ticket_yes", "edit_ticket_no")],
             EDIT_FIELD: [
-                CallbackQueryHandler(edit_field_callback, pattern="^edit_field_.*"),
+                routes.handler(*EDIT_FIELD_ROUTES),
                 MessageHandler(Filters.text & ~Filters.command, edit_field_input_handler)
             ],
             MORE_INFO_PROMPT: [MessageHandler(Filters.text & ~Filters.command, da_awaiting_response_handler)]
@@ -608,7 +696,7 @@ def main():
         fallbacks=[CommandHandler('cancel', lambda u, c: u.message.reply_text("تم إلغاء العملية."))]
     )
     dp.add_handler(conv_handler)
-    dp.add_handler(CallbackQueryHandler(da_callback_handler, pattern="^(close\\||da_moreinfo\\|).*"))
+    dp.add_handler(routes.handler("close", "da_moreinfo"))
     updater.start_polling()
     updater.idle()
 
@@ -1,173 +1,1506 @@
 # db.py
+import os
+import re
+import html
 import sqlite3
 import json
+import threading
+import time
+import functools
+import unicodedata
+from contextlib import contextmanager
 from datetime import datetime
-from config import DATABASE
+from config import DATABASE, ARCHIVE_DATABASE
+import cache
 
-def get_connection():
-    # Added a timeout to help with potential SQLite locking issues.
-    conn = sqlite3.connect(DATABASE, check_same_thread=False, timeout=10)
+# PRAGMAs applied once to every pooled connection. WAL lets the three bot
+# processes read while one of them writes, and NORMAL synchronous is safe
+# under WAL (only the last transactions can be lost on power failure).
+CONNECTION_PRAGMAS = (
+    # Must precede journal_mode so a brand-new file is created with it;
+    # maintain_database() converts older files.
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # ~16 MB page cache
+    "PRAGMA mmap_size=268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=10000",
+    "PRAGMA foreign_keys=ON",
+)
+
+# Closed tickets older than config.ARCHIVE_AFTER_DAYS are moved into a
+# separate database file attached as `archive` (see archive_closed_tickets).
+# The all_tickets / all_ticket_events views put both halves back together
+# for history, search and the webapp; hot queries stay on main.tickets.
+TICKET_COLUMNS = ("ticket_id, order_id, issue_description, issue_reason, issue_type, client, image_url, "
+                  "status, da_id, logs, created_at, latest_client_solution, latest_supervisor_message, "
+                  "last_status_change_at, resolved_at")
+EVENT_COLUMNS = "event_id, ticket_id, action, actor, message, details, timestamp"
+
+ARCHIVE_SETUP = (
+    "PRAGMA archive.auto_vacuum=INCREMENTAL",
+    "PRAGMA archive.journal_mode=WAL",
+    "PRAGMA archive.synchronous=NORMAL",
+)
+
+# Created per connection; they name every ticket column, so on a database
+# that init_db() has not migrated yet they fail and are retried by init_db().
+ARCHIVE_VIEWS = (
+    f"""CREATE TEMP VIEW IF NOT EXISTS all_tickets AS
+        SELECT {TICKET_COLUMNS} FROM main.tickets
+        UNION ALL
+        SELECT {TICKET_COLUMNS} FROM archive.tickets""",
+    f"""CREATE TEMP VIEW IF NOT EXISTS all_ticket_events AS
+        SELECT {EVENT_COLUMNS} FROM main.ticket_events
+        UNION ALL
+        SELECT {EVENT_COLUMNS} FROM archive.ticket_events""",
+)
+
+_local = threading.local()
+
+def _open_connection():
+    # isolation_level=None puts the connection in autocommit mode; writes are
+    # grouped explicitly with transaction() below.
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, timeout=10, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DATABASE,))
+    for statement in ARCHIVE_SETUP:
+        conn.execute(statement)
+    try:
+        _create_archive_views(conn)
+    except sqlite3.OperationalError:
+        pass
     return conn
 
-def init_db():
+def _create_archive_views(conn):
+    for statement in ARCHIVE_VIEWS:
+        conn.execute(statement)
+
+def get_connection():
+    """
+    Return the connection owned by the current thread, opening it on first use.
+    Connections are keyed by PID as well so a forked bot process (see main.py)
+    never reuses the parent's handle.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = _open_connection()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.depth = 0
+    return conn
+
+def close_connection():
+    """Close the current thread's pooled connection (if any)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        conn.close()
+    _local.conn = None
+    _local.depth = 0
+
+@contextmanager
+def transaction():
+    """
+    Run a block of statements as one transaction on the pooled connection.
+    Nested use turns into a SAVEPOINT, so helpers can be combined into a
+    larger unit of work without committing halfway through.
+    """
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            user_id INTEGER,
-            role TEXT,
-            bot TEXT,
-            phone TEXT,
-            client TEXT,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            chat_id INTEGER,
-            PRIMARY KEY (user_id, bot)
+    depth = _local.depth
+    if depth == 0:
+        conn.execute("BEGIN IMMEDIATE")
+    else:
+        conn.execute(f"SAVEPOINT sp_{depth}")
+    _local.depth = depth + 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth = depth
+        if depth == 0:
+            conn.execute("ROLLBACK")
+        else:
+            conn.execute(f"ROLLBACK TO sp_{depth}")
+            conn.execute(f"RELEASE sp_{depth}")
+        raise
+    _local.depth = depth
+    if depth == 0:
+        conn.execute("COMMIT")
+    else:
+        conn.execute(f"RELEASE sp_{depth}")
+
+# =============================================================================
+# Write operations
+#
+# Every function that mutates the database is registered here. In
+# single-writer mode (see db_writer.py) a bot process installs a forwarder
+# and its top-level writes are shipped to the writer process instead of
+# being executed locally; reads always stay local.
+#
+# Standalone operations (archiving, vacuum) run for long and commit as they
+# go, or cannot run inside a transaction at all; the writer runs them on
+# their own instead of inside one of its batched transactions.
+# =============================================================================
+WRITE_OPERATIONS = {}
+STANDALONE_OPERATIONS = set()
+_write_forwarder = None
+
+def set_write_forwarder(forwarder):
+    """Install (or with None, remove) the callable that executes writes out of process."""
+    global _write_forwarder
+    _write_forwarder = forwarder
+
+def _write_operation(func=None, *, after_forward=None, standalone=False):
+    """
+    Register a mutating function. `after_forward` runs locally after a
+    forwarded call, for process-local state such as caches; `standalone`
+    marks it for STANDALONE_OPERATIONS.
+    """
+    if func is None:
+        return functools.partial(_write_operation, after_forward=after_forward, standalone=standalone)
+    WRITE_OPERATIONS[func.__name__] = func
+    if standalone:
+        STANDALONE_OPERATIONS.add(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Nested calls belong to an enclosing local transaction.
+        if _write_forwarder is None or getattr(_local, "depth", 0):
+            return func(*args, **kwargs)
+        result = _write_forwarder(func.__name__, args, kwargs)
+        if after_forward is not None:
+            after_forward()
+        return result
+    return wrapper
+
+def init_db():
+    with transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                user_id INTEGER,
+                role TEXT,
+                bot TEXT,
+                phone TEXT,
+                client TEXT,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                chat_id INTEGER,
+                PRIMARY KEY (user_id, bot)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tickets (
+                ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id TEXT,
+                issue_description TEXT,
+                issue_reason TEXT,
+                issue_type TEXT,
+                client TEXT,
+                image_url TEXT,
+                status TEXT,
+                da_id INTEGER,
+                logs TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                latest_client_solution TEXT,
+                latest_supervisor_message TEXT,
+                last_status_change_at TIMESTAMP,
+                resolved_at TIMESTAMP
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ticket_events (
+                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ticket_id INTEGER NOT NULL,
+                action TEXT,
+                actor INTEGER,
+                message TEXT,
+                details TEXT,
+                timestamp TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ticket_events_ticket ON ticket_events(ticket_id, event_id)")
+        conn.execute(TEXT_SEARCH_TABLE)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_status_client ON tickets(status, client)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_da_created ON tickets(da_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_created ON tickets(created_at, ticket_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_order ON tickets(order_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_role_client ON subscriptions(role, client)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive.tickets (
+                ticket_id INTEGER PRIMARY KEY,
+                order_id TEXT,
+                issue_description TEXT,
+                issue_reason TEXT,
+                issue_type TEXT,
+                client TEXT,
+                image_url TEXT,
+                status TEXT,
+                da_id INTEGER,
+                logs TEXT,
+                created_at TIMESTAMP,
+                latest_client_solution TEXT,
+                latest_supervisor_message TEXT,
+                last_status_change_at TIMESTAMP,
+                resolved_at TIMESTAMP
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive.ticket_events (
+                event_id INTEGER PRIMARY KEY,
+                ticket_id INTEGER NOT NULL,
+                action TEXT,
+                actor INTEGER,
+                message TEXT,
+                details TEXT,
+                timestamp TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_ticket_events_ticket ON ticket_events(ticket_id, event_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_tickets_da_created ON tickets(da_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_tickets_created ON tickets(created_at, ticket_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_tickets_order ON tickets(order_id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """)
+        _run_migrations(conn)
+        _create_archive_views(conn)
+
+# =============================================================================
+# Schema migrations
+#
+# Each entry runs once, in order, and bumps PRAGMA user_version so the
+# three bot processes calling init_db() never repeat a migration.
+# =============================================================================
+def _migrate_logs_to_events(conn):
+    """Copy every legacy JSON `logs` blob into ticket_events."""
+    rows = conn.execute("SELECT ticket_id, logs FROM tickets WHERE logs IS NOT NULL AND logs != ''").fetchall()
+    for row in rows:
+        try:
+            entries = json.loads(row["logs"])
+        except ValueError:
+            continue
+        for entry in entries:
+            _insert_event(conn, row["ticket_id"], entry)
+
+def _create_order_search_index(conn):
+    """
+    FTS5 trigram index over tickets.order_id (rowid = ticket_id), kept in
+    sync by triggers. Tickets are never deleted, so there is no delete
+    trigger. SQLite builds without the trigram tokenizer (< 3.34) skip this
+    and search_tickets_by_order() falls back to LIKE.
+    """
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tickets_order_fts USING fts5(order_id, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tickets_order_fts_insert AFTER INSERT ON tickets BEGIN
+            INSERT INTO tickets_order_fts(rowid, order_id) VALUES (new.ticket_id, new.order_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tickets_order_fts_update AFTER UPDATE OF order_id ON tickets BEGIN
+            UPDATE tickets_order_fts SET order_id = new.order_id WHERE rowid = new.ticket_id;
+        END
+    """)
+    conn.execute("INSERT INTO tickets_order_fts(rowid, order_id) SELECT ticket_id, order_id FROM tickets")
+
+def _rebuild_text_search_index(conn):
+    """Index descriptions and history messages of every existing ticket, live and archived."""
+    conn.execute("DELETE FROM ticket_text_fts")
+    for schema in ("main", "archive"):
+        for row in conn.execute(f"SELECT ticket_id, issue_description FROM {schema}.tickets").fetchall():
+            _index_text(conn, row["ticket_id"], "description", row["issue_description"])
+        for row in conn.execute(f"SELECT ticket_id, action, message FROM {schema}.ticket_events "
+                                "WHERE message IS NOT NULL").fetchall():
+            _index_text(conn, row["ticket_id"], row["action"], row["message"])
+
+def _create_ticket_stats(conn):
+    """Counter table plus the triggers that keep it current; backfilled from existing tickets."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ticket_stats (
+            metric TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (metric, key)
+        ) WITHOUT ROWID
+    """)
+    for trigger in _ticket_stats_triggers():
+        conn.execute(trigger)
+    _rebuild_ticket_stats(conn)
+
+def _add_missing_columns(conn, table, columns):
+    """ALTER TABLE ADD COLUMN for each (name, type) not yet present; `table` may be schema-qualified."""
+    schema, _, name = table.rpartition(".")
+    pragma = f"PRAGMA {schema}.table_info({name})" if schema else f"PRAGMA table_info({name})"
+    existing = {row["name"] for row in conn.execute(pragma)}
+    for column, column_type in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+def _add_resolution_columns(conn):
+    """
+    Denormalized latest solution / status-change / resolution fields on both
+    ticket tables, backfilled from the event history and with resolved_at
+    indexed for resolution-time queries.
+    """
+    for schema in ("main", "archive"):
+        _add_missing_columns(conn, f"{schema}.tickets", RESOLUTION_COLUMNS)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_tickets_resolved ON tickets(resolved_at)")
+        status_actions = ", ".join(f"'{a}'" for a in _STATUS_CHANGE_ACTIONS)
+        latest = f"""
+            SELECT {{value}} FROM {schema}.ticket_events e
+            WHERE e.ticket_id = tickets.ticket_id AND e.action IN ({{actions}})
+            ORDER BY e.event_id DESC LIMIT 1
+        """
+        # Event timestamps are local time; the ticket columns use UTC like created_at.
+        conn.execute(f"""
+            UPDATE {schema}.tickets SET
+                latest_client_solution = ({latest.format(value="message", actions="'client_solution'")}),
+                latest_supervisor_message = ({latest.format(value="message",
+                                                             actions="'supervisor_solution', 'supervisor_forward'")}),
+                last_status_change_at = coalesce(({latest.format(value="datetime(e.timestamp, 'utc')",
+                                                                 actions=status_actions)}), created_at),
+                resolved_at = CASE WHEN status = 'Closed'
+                                   THEN ({latest.format(value="datetime(e.timestamp, 'utc')", actions="'da_closed'")})
+                              END
+        """)
+
+def _create_outbox(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE,
+            bot TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            method TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+
+def _create_telegram_files(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS telegram_files (
+            bot TEXT NOT NULL,
+            url TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot, url)
+        ) WITHOUT ROWID
+    """)
+
+def _create_digests(conn):
+    _add_missing_columns(conn, "subscriptions", [("digest_minutes", "INTEGER")])
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS digest_items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE,
+            chat_id INTEGER NOT NULL,
+            ticket_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            due_at REAL NOT NULL
         )
     """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS tickets (
-            ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id TEXT,
-            issue_description TEXT,
-            issue_reason TEXT,
-            issue_type TEXT,
-            client TEXT,
-            image_url TEXT,
-            status TEXT,
-            da_id INTEGER,
-            logs TEXT,
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_digest_items_due ON digest_items(due_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_digest_items_chat ON digest_items(chat_id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS digests (
+            digest_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            items TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    conn.commit()
-    conn.close()
 
+def _create_callback_tokens(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS callback_tokens (
+            token TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+def _keep_original_search_text(conn):
+    """Recreate ticket_text_fts with the text as written next to the normalized body it indexes."""
+    conn.execute("DROP TABLE IF EXISTS ticket_text_fts")
+    conn.execute(TEXT_SEARCH_TABLE)
+    _rebuild_text_search_index(conn)
+
+MIGRATIONS = [
+    _migrate_logs_to_events,
+    _create_order_search_index,
+    _rebuild_text_search_index,
+    _create_ticket_stats,
+    _add_resolution_columns,
+    _create_outbox,
+    _create_telegram_files,
+    _create_digests,
+    _create_callback_tokens,
+    _keep_original_search_text,
+]
+
+def _run_migrations(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version={number}")
+
+# =============================================================================
+# Subscription cache
+#
+# Subscriptions almost never change but are read on every /start, menu tap
+# and notification. Lookups are served from a bounded LRU with a TTL. Each
+# write bumps a version row in cache_versions; every process re-reads that
+# row at most once per SUBSCRIPTION_CACHE_CHECK_INTERVAL seconds and drops
+# its cache when the version moved, so the three bot processes converge
+# without going to SQLite on every lookup.
+# =============================================================================
+SUBSCRIPTION_CACHE_SIZE = 1024
+SUBSCRIPTION_CACHE_TTL = 300
+SUBSCRIPTION_CACHE_CHECK_INTERVAL = 2
+
+_MISSING = object()
+
+class _LookupCache:
+    def __init__(self, name, maxsize, ttl, check_interval):
+        self.name = name
+        self.check_interval = check_interval
+        self._entries = cache.LRUCache(maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def _sync_version(self, now):
+        if now - self._checked_at < self.check_interval:
+            return
+        row = get_connection().execute("SELECT version FROM cache_versions WHERE name=?", (self.name,)).fetchone()
+        version = row["version"] if row else 0
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked_at = now
+
+    def get(self, key):
+        self._sync_version(time.monotonic())
+        value = self._entries.get(key, _MISSING)
+        return (False, None) if value is _MISSING else (True, value)
+
+    def put(self, key, value):
+        self._entries.put(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            # Force a version check on the next lookup.
+            self._checked_at = 0.0
+
+_subscription_cache = _LookupCache("subscriptions", SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_CACHE_TTL,
+                                   SUBSCRIPTION_CACHE_CHECK_INTERVAL)
+
+def _cached_subscription_lookup(func):
+    """Serve a subscription query from _subscription_cache; lists are returned as fresh copies."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        hit, value = _subscription_cache.get(key)
+        if not hit:
+            value = func(*args, **kwargs)
+            if isinstance(value, list):
+                value = tuple(value)
+            _subscription_cache.put(key, value)
+        return list(value) if isinstance(value, tuple) else value
+    return wrapper
+
+@_write_operation(after_forward=_subscription_cache.clear)
+def invalidate_subscription_cache():
+    """Drop cached subscription lookups in this process and, within the check interval, in every other one."""
+    with transaction() as conn:
+        conn.execute("""
+            INSERT INTO cache_versions (name, version) VALUES ('subscriptions', 1)
+            ON CONFLICT(name) DO UPDATE SET version = version + 1
+        """)
+    _subscription_cache.clear()
+
+@_write_operation(after_forward=_subscription_cache.clear)
 def add_subscription(user_id, phone, role, bot, client, username, first_name, last_name, chat_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        INSERT OR REPLACE INTO subscriptions 
-        (user_id, role, bot, phone, client, username, first_name, last_name, chat_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, role, bot, phone, client, username, first_name, last_name, chat_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO subscriptions 
+            (user_id, role, bot, phone, client, username, first_name, last_name, chat_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, role, bot, phone, client, username, first_name, last_name, chat_id))
+        invalidate_subscription_cache()
 
+@_cached_subscription_lookup
 def get_subscription(user_id, bot):
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM subscriptions WHERE user_id=? AND bot=?", (user_id, bot))
-    sub = c.fetchone()
-    conn.close()
-    return sub
+    return conn.execute("SELECT * FROM subscriptions WHERE user_id=? AND bot=?", (user_id, bot)).fetchone()
 
 def get_all_subscriptions():
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM subscriptions")
-    subs = c.fetchall()
-    conn.close()
-    return subs
+    return conn.execute("SELECT * FROM subscriptions").fetchall()
 
+@_write_operation
 def add_ticket(order_id, issue_description, issue_reason, issue_type, client, image_url, status, da_id):
-    # Log ticket creation with initial details.
-    logs = json.dumps([{"action": "ticket_created", "by": da_id, "timestamp": datetime.now().isoformat()}])
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO tickets 
-        (order_id, issue_description, issue_reason, issue_type, client, image_url, status, da_id, logs)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (order_id, issue_description, issue_reason, issue_type, client, image_url, status, da_id, logs))
-    ticket_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    return ticket_id
+    with transaction() as conn:
+        c = conn.execute("""
+            INSERT INTO tickets 
+            (order_id, issue_description, issue_reason, issue_type, client, image_url, status, da_id,
+             last_status_change_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (order_id, issue_description, issue_reason, issue_type, client, image_url, status, da_id))
+        ticket_id = c.lastrowid
+        _index_text(conn, ticket_id, "description", issue_description)
+        # Log ticket creation with initial details.
+        _insert_event(conn, ticket_id, {"action": "ticket_created", "by": da_id})
+        return ticket_id
+
+@_write_operation
+def create_ticket(order_id, issue_description, issue_reason, issue_type, client, image_url, status, da_id,
+                  events=(), notifications=None):
+    """
+    Insert a ticket together with its initial history entries (e.g. the
+    DA's edit log) and the notifications announcing it (see
+    _queue_notifications; TICKET_ID stands for the new id) in one
+    transaction and return the stored row.
+    """
+    with transaction() as conn:
+        ticket_id = add_ticket(order_id, issue_description, issue_reason, issue_type,
+                               client, image_url, status, da_id)
+        for log_entry in events:
+            _insert_event(conn, ticket_id, log_entry)
+        _queue_notifications(conn, notifications, {TICKET_ID: ticket_id})
+        return conn.execute("SELECT * FROM tickets WHERE ticket_id=?", (ticket_id,)).fetchone()
 
 def get_ticket(ticket_id):
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM tickets WHERE ticket_id=?", (ticket_id,))
-    ticket = c.fetchone()
-    conn.close()
-    return ticket
+    return conn.execute("SELECT * FROM all_tickets WHERE ticket_id=?", (ticket_id,)).fetchone()
+
+# =============================================================================
+# Ticket records for bulk reads
+#
+# A TicketRecord keeps only the column values in __slots__ (no per-row
+# dict or key map like sqlite3.Row), and leaves the history alone until
+# someone asks for it. The iter_* variants stream rows in batches so large
+# result sets are never held in memory at once; they keep a read statement
+# (and its WAL snapshot) open while iterated, so they are for consumers
+# that only touch the database. Code doing network I/O per ticket reads
+# bounded pages instead (get_open_tickets).
+# =============================================================================
+TICKET_FIELDS = tuple(column.strip() for column in TICKET_COLUMNS.split(","))
+TICKET_FETCH_SIZE = 500
+
+class TicketRecord:
+    """
+    One ticket row; read it as ticket['status'] or ticket.status. `events`
+    loads the ticket's history on first access and `legacy_logs` decodes
+    the old JSON `logs` column on first access.
+    """
+    __slots__ = TICKET_FIELDS + ("_events", "_legacy_logs")
+
+    def __init__(self, *values):
+        for field, value in zip(TICKET_FIELDS, values):
+            setattr(self, field, value)
+        self._events = None
+        self._legacy_logs = None
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            key = TICKET_FIELDS[key]
+        elif key not in TICKET_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def keys(self):
+        return list(TICKET_FIELDS)
+
+    def __reduce__(self):
+        # Pickle the column values only; the loaded history holds sqlite3.Row objects.
+        return TicketRecord, tuple(getattr(self, field) for field in TICKET_FIELDS)
+
+    def __repr__(self):
+        return f"<TicketRecord #{self.ticket_id} {self.status!r}>"
+
+    @property
+    def events(self):
+        if self._events is None:
+            self._events = get_ticket_events(self.ticket_id)
+        return self._events
+
+    @property
+    def legacy_logs(self):
+        if self._legacy_logs is None:
+            try:
+                self._legacy_logs = json.loads(self.logs) if self.logs else []
+            except ValueError:
+                self._legacy_logs = []
+        return self._legacy_logs
+
+def _ticket_record_factory(cursor, row):
+    return TicketRecord(*row)
+
+def _iter_ticket_records(sql, params=(), batch_size=TICKET_FETCH_SIZE):
+    cursor = get_connection().cursor()
+    cursor.row_factory = _ticket_record_factory
+    cursor.execute(sql, params)
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield from batch
+    finally:
+        cursor.close()
+
+def iter_all_tickets(batch_size=TICKET_FETCH_SIZE):
+    """Stream every ticket, live and archived, as TicketRecords in ticket_id order."""
+    return _iter_ticket_records(f"SELECT {TICKET_COLUMNS} FROM all_tickets ORDER BY ticket_id",
+                                batch_size=batch_size)
 
 def get_all_tickets():
+    return list(iter_all_tickets())
+
+# =============================================================================
+# Keyset pagination
+#
+# Pages are addressed by a cursor "<created_at>|<ticket_id>" taken from the
+# first/last row of the current page, so every page is a range scan on
+# idx_tickets_created no matter how deep the user has paged.
+# =============================================================================
+def _ticket_cursor(row):
+    return f"{row['created_at']}|{row['ticket_id']}"
+
+def _parse_ticket_cursor(cursor):
+    created_at, _, ticket_id = cursor.rpartition("|")
+    if not created_at:
+        raise ValueError(f"invalid ticket cursor: {cursor!r}")
+    return created_at, int(ticket_id)
+
+def get_tickets_page(cursor=None, direction="next", limit=50, order="desc",
+                     status=None, client=None, da_id=None, date_from=None, date_to=None):
+    """
+    Return (tickets, next_cursor, prev_cursor) for one page of tickets.
+    `order` is "desc" (newest first) or "asc"; `direction` says whether
+    `cursor` is the last row of the previous page ("next") or the first row
+    of the following page ("prev"). date_from/date_to are inclusive
+    YYYY-MM-DD strings.
+    """
+    if order not in ("asc", "desc"):
+        raise ValueError(f"invalid order: {order!r}")
+    if direction not in ("next", "prev"):
+        raise ValueError(f"invalid direction: {direction!r}")
+    clauses, params = [], []
+    if status:
+        clauses.append("status=?")
+        params.append(status)
+    if client:
+        clauses.append("client=?")
+        params.append(client)
+    if da_id is not None:
+        clauses.append("da_id=?")
+        params.append(da_id)
+    if date_from:
+        clauses.append("created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        clauses.append("created_at < date(?, '+1 day')")
+        params.append(date_to)
+    # Walking backwards is the same scan with the comparison and sort flipped.
+    forward = (order == "desc") == (direction == "next")
+    if cursor:
+        clauses.append(f"(created_at, ticket_id) {'<' if forward else '>'} (?, ?)")
+        params.extend(_parse_ticket_cursor(cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sort = "DESC" if forward else "ASC"
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM tickets")
-    tickets = c.fetchall()
-    conn.close()
-    return tickets
+    rows = conn.execute(f"""
+        SELECT * FROM all_tickets {where}
+        ORDER BY created_at {sort}, ticket_id {sort}
+        LIMIT ?
+    """, params + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "prev":
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+    if direction == "next":
+        next_cursor = _ticket_cursor(rows[-1]) if has_more else None
+        prev_cursor = _ticket_cursor(rows[0]) if cursor else None
+    else:
+        next_cursor = _ticket_cursor(rows[-1])
+        prev_cursor = _ticket_cursor(rows[0]) if has_more else None
+    return rows, next_cursor, prev_cursor
+
+# =============================================================================
+# Latest resolution fields
+#
+# Kept on the ticket row by every status change so the bots read the last
+# client solution / supervisor message with the ticket instead of searching
+# its history. Timestamps are UTC, like created_at.
+# =============================================================================
+RESOLUTION_COLUMNS = (
+    ("latest_client_solution", "TEXT"),
+    ("latest_supervisor_message", "TEXT"),
+    ("last_status_change_at", "TIMESTAMP"),
+    ("resolved_at", "TIMESTAMP"),
+)
+# Which history action's message lands in which column.
+LATEST_MESSAGE_COLUMNS = {
+    "client_solution": "latest_client_solution",
+    "supervisor_solution": "latest_supervisor_message",
+    "supervisor_forward": "latest_supervisor_message",
+}
+# Actions recorded by status changes; used to backfill last_status_change_at.
+_STATUS_CHANGE_ACTIONS = ("client_ignored", "client_final_response", "client_solution", "da_moreinfo",
+                          "da_closed", "supervisor_forward", "supervisor_solution", "request_more_info")
+
+def _status_assignments(new_status, log_entry):
+    assignments = ["status=?", "last_status_change_at=CURRENT_TIMESTAMP",
+                   "resolved_at=CASE WHEN ?='Closed' THEN CURRENT_TIMESTAMP ELSE resolved_at END"]
+    params = [new_status, new_status]
+    column = LATEST_MESSAGE_COLUMNS.get(log_entry.get("action"))
+    if column and log_entry.get("message"):
+        assignments.append(f"{column}=?")
+        params.append(log_entry["message"])
+    return ", ".join(assignments), params
 
+@_write_operation
 def update_ticket_status(ticket_id, new_status, log_entry):
-    # Add a timestamp to every log entry for better tracking.
-    log_entry['timestamp'] = datetime.now().isoformat()
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT logs FROM tickets WHERE ticket_id=?", (ticket_id,))
-    row = c.fetchone()
-    logs = []
-    if row and row["logs"]:
-        logs = json.loads(row["logs"])
-    logs.append(log_entry)
-    logs_str = json.dumps(logs, ensure_ascii=False)
-    c.execute("UPDATE tickets SET status=?, logs=? WHERE ticket_id=?", (new_status, logs_str, ticket_id))
-    conn.commit()
-    conn.close()
-
-def search_tickets_by_order(order_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM tickets WHERE order_id LIKE ?", ('%' + order_id + '%',))
-    tickets = c.fetchall()
-    conn.close()
-    return tickets
+    """Set the status unconditionally; the bots go through transition_ticket() instead."""
+    assignments, params = _status_assignments(new_status, log_entry)
+    with transaction() as conn:
+        conn.execute(f"UPDATE tickets SET {assignments} WHERE ticket_id=?", params + [ticket_id])
+        _insert_event(conn, ticket_id, log_entry)
 
-def get_all_open_tickets():
+# =============================================================================
+# Ticket state machine
+#
+# Every status change the bots make is one of these actions. A transition is
+# a single compare-and-set UPDATE guarded by the allowed source statuses, so
+# two people acting on the same ticket cannot both win and nobody needs to
+# read the ticket first to check its status.
+# =============================================================================
+TICKET_STATUSES = ('Opened', 'Pending DA Action', 'Awaiting Client Response', 'Awaiting Supervisor Approval',
+                   'Client Responded', 'Client Ignored', 'Pending DA Response', 'Additional Info Provided', 'Closed')
+_NOT_CLOSED = tuple(s for s in TICKET_STATUSES if s != 'Closed')
+_CLIENT_CAN_ANSWER = tuple(s for s in _NOT_CLOSED if s not in ('Client Responded', 'Client Ignored'))
+
+# action: (statuses it may start from, status it moves the ticket to)
+TRANSITIONS = {
+    "supervisor_solution": (_NOT_CLOSED, "Pending DA Action"),
+    "request_more_info": (_NOT_CLOSED, "Pending DA Response"),
+    "sent_to_client": (_NOT_CLOSED, "Awaiting Client Response"),
+    "supervisor_forward": (("Client Responded", "Client Ignored"), "Pending DA Action"),
+    "client_solution": (_CLIENT_CAN_ANSWER, "Client Responded"),
+    "client_ignored": (_CLIENT_CAN_ANSWER, "Client Ignored"),
+    "da_moreinfo": (("Pending DA Response",), "Additional Info Provided"),
+    "da_closed": (_NOT_CLOSED, "Closed"),
+}
+
+@_write_operation
+def transition_ticket(ticket_id, action, actor=None, message=None, notifications=None, **details):
+    """
+    Apply TRANSITIONS[action] to a ticket and record it in the history,
+    queueing `notifications` (see _queue_notifications; EVENT_ID stands for
+    the new event's id, a natural notification key) only if it moved.
+    Returns the event id (truthy) if the ticket moved, False if it no
+    longer was in one of the allowed statuses (someone else acted first) or
+    does not exist.
+    """
+    try:
+        allowed, new_status = TRANSITIONS[action]
+    except KeyError:
+        raise ValueError(f"unknown ticket transition: {action!r}")
+    log_entry = {"action": action, "by": actor, "message": message, **details}
+    assignments, params = _status_assignments(new_status, log_entry)
+    placeholders = ", ".join("?" * len(allowed))
+    with transaction() as conn:
+        cursor = conn.execute(f"UPDATE tickets SET {assignments} WHERE ticket_id=? AND status IN ({placeholders})",
+                              params + [ticket_id, *allowed])
+        if cursor.rowcount == 0:
+            return False
+        event_id = _insert_event(conn, ticket_id, log_entry)
+        _queue_notifications(conn, notifications, {TICKET_ID: ticket_id, EVENT_ID: event_id})
+        return event_id
+
+def get_resolution_stats(days=None):
+    """
+    (resolved_count, average_hours_to_resolve) over tickets resolved in the
+    last `days` days (all time if None); a range scan on idx_tickets_resolved.
+    """
+    since = "datetime('now', ?)" if days else "''"
+    params = (f"-{int(days)} days",) if days else ()
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT * FROM tickets 
-        WHERE status IN ('Opened', 'Pending DA Action', 'Awaiting Client Response', 'Awaiting Supervisor Approval', 'Client Responded', 'Client Ignored')
+    row = conn.execute(f"""
+        SELECT count(*), avg((julianday(resolved_at) - julianday(created_at)) * 24)
+        FROM all_tickets WHERE resolved_at > {since}
+    """, params).fetchone()
+    return row[0], row[1]
+
+# =============================================================================
+# Ticket events (append-only history, replaces the JSON `logs` column)
+# =============================================================================
+EVENT_FIELDS = ("action", "by", "message", "timestamp")
+
+def _insert_event(conn, ticket_id, log_entry):
+    """
+    Append one history entry and return its event_id. `by` is stored as the
+    actor, keys other than action/by/message/timestamp (e.g. edit_field's
+    field/new_value) go to the `details` JSON column.
+    """
+    details = {k: v for k, v in log_entry.items() if k not in EVENT_FIELDS}
+    event_id = conn.execute("""
+        INSERT INTO ticket_events (ticket_id, action, actor, message, details, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (ticket_id, log_entry.get("action"), log_entry.get("by"), log_entry.get("message"),
+          json.dumps(details, ensure_ascii=False) if details else None,
+          log_entry.get("timestamp") or datetime.now().isoformat())).lastrowid
+    _index_text(conn, ticket_id, log_entry.get("action"), log_entry.get("message"))
+    return event_id
+
+def get_ticket_events(ticket_id):
+    conn = get_connection()
+    return conn.execute("SELECT * FROM all_ticket_events WHERE ticket_id=? ORDER BY event_id",
+                        (ticket_id,)).fetchall()
+
+def get_latest_event(ticket_id, action):
+    conn = get_connection()
+    return conn.execute("""
+        SELECT * FROM all_ticket_events WHERE ticket_id=? AND action=?
+        ORDER BY event_id DESC LIMIT 1
+    """, (ticket_id, action)).fetchone()
+
+# =============================================================================
+# Notification outbox
+#
+# Notifications are written by the same write operation as the ticket
+# change they announce (create_ticket, transition_ticket, take_digest take
+# them as a `notifications` argument); outbox.py delivers them in the
+# background. A row with an idempotency_key that is already present is
+# silently dropped, so queueing the same notification twice sends it once.
+#
+# Notifications are built before the write that assigns the ids they
+# mention, so their strings may carry these placeholders; the write fills
+# them in. A value that is just a placeholder becomes the id itself.
+# =============================================================================
+OUTBOX_COLUMNS = ("idempotency_key", "bot", "chat_id", "method", "payload")
+TICKET_ID = "⟦ticket_id⟧"
+EVENT_ID = "⟦event_id⟧"
+DIGEST_ID = "⟦digest_id⟧"
+
+def _fill_ids(row, ids):
+    def fill(value):
+        if not isinstance(value, str):
+            return value
+        for placeholder, id_value in ids.items():
+            if value == placeholder:
+                return id_value
+            value = value.replace(placeholder, str(id_value))
+        return value
+    return {column: fill(value) for column, value in row.items()}
+
+def _insert_rows(conn, table, columns, rows):
+    before = conn.total_changes
+    conn.executemany(f"""
+        INSERT OR IGNORE INTO {table} ({", ".join(columns)})
+        VALUES ({", ".join("?" * len(columns))})
+    """, [tuple(row.get(column) for column in columns) for row in rows])
+    return conn.total_changes - before
+
+def _queue_notifications(conn, notifications, ids):
+    """
+    Insert `notifications` ({"outbox": rows with OUTBOX_COLUMNS, "digest":
+    items with DIGEST_ITEM_COLUMNS}, either may be missing) with the
+    placeholders in `ids` ({TICKET_ID: ticket_id, ...}) filled in.
+    """
+    if not notifications:
+        return
+    _insert_rows(conn, "outbox", OUTBOX_COLUMNS,
+                 [_fill_ids(row, ids) for row in notifications.get("outbox", ())])
+    _insert_rows(conn, "digest_items", DIGEST_ITEM_COLUMNS,
+                 [_fill_ids(item, ids) for item in notifications.get("digest", ())])
+
+@_write_operation
+def enqueue_notifications(messages):
+    """Insert outbox rows (dicts with OUTBOX_COLUMNS); returns how many were new."""
+    with transaction() as conn:
+        return _insert_rows(conn, "outbox", OUTBOX_COLUMNS, messages)
+
+def get_due_notifications(limit, now=None):
+    """Pending outbox rows whose next attempt is due, oldest first."""
+    conn = get_connection()
+    return conn.execute("""
+        SELECT * FROM outbox WHERE status='pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at, message_id LIMIT ?
+    """, (time.time() if now is None else now, limit)).fetchall()
+
+@_write_operation
+def record_notification_results(sent_ids, failures):
+    """
+    Mark delivered rows as sent. `failures` holds (message_id, error,
+    retry_at) tuples; retry_at None dead-letters the row.
+    """
+    with transaction() as conn:
+        conn.executemany("""
+            UPDATE outbox SET status='sent', attempts=attempts + 1, sent_at=CURRENT_TIMESTAMP, last_error=NULL
+            WHERE message_id=?
+        """, [(message_id,) for message_id in sent_ids])
+        conn.executemany("""
+            UPDATE outbox SET status=CASE WHEN ? IS NULL THEN 'dead' ELSE 'pending' END,
+                attempts=attempts + 1, next_attempt_at=coalesce(?, next_attempt_at), last_error=?
+            WHERE message_id=?
+        """, [(retry_at, retry_at, error, message_id) for message_id, error, retry_at in failures])
+
+@_write_operation
+def requeue_dead_notifications():
+    """Give every dead-lettered notification a fresh set of attempts; returns how many."""
+    with transaction() as conn:
+        return conn.execute("UPDATE outbox SET status='pending', attempts=0, next_attempt_at=0 "
+                            "WHERE status='dead'").rowcount
+
+@_write_operation
+def purge_sent_notifications(older_than_days):
+    with transaction() as conn:
+        return conn.execute("DELETE FROM outbox WHERE status='sent' AND sent_at < datetime('now', ?)",
+                            (f"-{int(older_than_days)} days",)).rowcount
+
+def get_outbox_counts():
+    conn = get_connection()
+    return {row["status"]: row["n"] for row in
+            conn.execute("SELECT status, count(*) AS n FROM outbox GROUP BY status")}
+
+# =============================================================================
+# Telegram file_id cache
+#
+# Telegram answers a send_photo by URL with a file_id that the same bot can
+# send again without Telegram fetching the image. file_ids belong to the
+# bot that received them, so the cache is keyed by (bot, url).
+# =============================================================================
+def get_file_ids(bot, urls):
+    """{url: file_id} for the urls `bot` has already sent."""
+    urls = list(set(urls))
+    if not urls:
+        return {}
+    conn = get_connection()
+    return {row["url"]: row["file_id"] for row in conn.execute(f"""
+        SELECT url, file_id FROM telegram_files WHERE bot=? AND url IN ({", ".join("?" * len(urls))})
+    """, [bot] + urls)}
+
+@_write_operation
+def save_file_ids(bot, file_ids):
+    """Remember {url: file_id} for `bot`."""
+    with transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO telegram_files (bot, url, file_id) VALUES (?, ?, ?)",
+                         [(bot, url, file_id) for url, file_id in file_ids.items()])
+
+@_write_operation
+def forget_file_id(bot, url):
+    with transaction() as conn:
+        conn.execute("DELETE FROM telegram_files WHERE bot=? AND url=?", (bot, url))
+
+# =============================================================================
+# Supervisor digests
+#
+# A supervisor with a digest window gets non-urgent events as digest_items,
+# each due `window` after it was queued. Once a chat's oldest item is due,
+# all of its items become one digests row (kept so the summary can be
+# paged) and one outbox message.
+# =============================================================================
+DIGEST_ITEM_COLUMNS = ("idempotency_key", "chat_id", "ticket_id", "kind", "summary", "due_at")
+
+@_write_operation(after_forward=_subscription_cache.clear)
+def set_digest_minutes(user_id, minutes):
+    """Set a supervisor's digest window; 0 sends every event immediately."""
+    with transaction() as conn:
+        conn.execute("UPDATE subscriptions SET digest_minutes=? WHERE user_id=? AND role='Supervisor'",
+                     (minutes, user_id))
+        invalidate_subscription_cache()
+
+def get_due_digest_chats(now=None):
+    conn = get_connection()
+    return [row[0] for row in conn.execute("SELECT DISTINCT chat_id FROM digest_items WHERE due_at <= ?",
+                                           (time.time() if now is None else now,))]
+
+def get_digest_items(chat_id):
+    """Queued items of `chat_id` in order, as dicts with item_id, ticket_id, kind, summary."""
+    conn = get_connection()
+    return [dict(row) for row in conn.execute(
+        "SELECT item_id, ticket_id, kind, summary FROM digest_items WHERE chat_id=? ORDER BY item_id", (chat_id,))]
+
+@_write_operation
+def take_digest(chat_id, item_ids, notifications=None):
+    """
+    Move the queued items `item_ids` of `chat_id` into a new digest and
+    queue `notifications` (see _queue_notifications; DIGEST_ID stands for
+    the new digest's id); returns the digest_id, or None when the items
+    are no longer all queued (another flush took them).
+    """
+    item_ids = list(item_ids)
+    if not item_ids:
+        return None
+    placeholders = ", ".join("?" * len(item_ids))
+    with transaction() as conn:
+        items = [dict(row) for row in conn.execute(f"""
+            SELECT ticket_id, kind, summary FROM digest_items
+            WHERE chat_id=? AND item_id IN ({placeholders}) ORDER BY item_id
+        """, [chat_id] + item_ids)]
+        if len(items) != len(item_ids):
+            return None
+        conn.execute(f"DELETE FROM digest_items WHERE item_id IN ({placeholders})", item_ids)
+        digest_id = conn.execute("INSERT INTO digests (chat_id, items) VALUES (?, ?)",
+                                 (chat_id, json.dumps(items, ensure_ascii=False))).lastrowid
+        _queue_notifications(conn, notifications, {DIGEST_ID: digest_id})
+        return digest_id
+
+def get_digest(digest_id):
+    conn = get_connection()
+    row = conn.execute("SELECT * FROM digests WHERE digest_id=?", (digest_id,)).fetchone()
+    if row is None:
+        return None
+    return dict(row, items=json.loads(row["items"]))
+
+@_write_operation
+def purge_digests(older_than_days):
+    with transaction() as conn:
+        return conn.execute("DELETE FROM digests WHERE created_at < datetime('now', ?)",
+                            (f"-{int(older_than_days)} days",)).rowcount
+
+# =============================================================================
+# Callback tokens (see callbacks.py)
+# =============================================================================
+@_write_operation
+def save_callback_tokens(rows):
+    """Store (token, payload, expires_at) rows, e.g. every token of one keyboard."""
+    with transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO callback_tokens (token, payload, expires_at) VALUES (?, ?, ?)",
+                         rows)
+
+def get_callback_token(token):
+    conn = get_connection()
+    return conn.execute("SELECT payload, expires_at FROM callback_tokens WHERE token=? AND expires_at > ?",
+                        (token, time.time())).fetchone()
+
+@_write_operation
+def purge_expired_callback_tokens():
+    with transaction() as conn:
+        return conn.execute("DELETE FROM callback_tokens WHERE expires_at < ?", (time.time(),)).rowcount
+
+# =============================================================================
+# Archival and maintenance
+# =============================================================================
+ARCHIVE_BATCH_SIZE = 500
+VACUUM_PAGES = 2000
+
+@_write_operation(standalone=True)
+def archive_closed_tickets(older_than_days, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move Closed tickets created more than `older_than_days` ago, with their
+    events, from the main database into the archive. Works in batches so no
+    single transaction holds the write lock for long; returns how many
+    tickets were moved. The copy uses INSERT OR REPLACE so a batch that was
+    interrupted between the two files is simply redone on the next run.
+    """
+    moved = 0
+    while True:
+        with transaction() as conn:
+            ids = [row[0] for row in conn.execute("""
+                SELECT ticket_id FROM main.tickets
+                WHERE status='Closed' AND created_at < datetime('now', ?)
+                LIMIT ?
+            """, (f"-{int(older_than_days)} days", batch_size))]
+            if not ids:
+                return moved
+            placeholders = ", ".join("?" * len(ids))
+            conn.execute(f"""
+                INSERT OR REPLACE INTO archive.tickets ({TICKET_COLUMNS})
+                SELECT {TICKET_COLUMNS} FROM main.tickets WHERE ticket_id IN ({placeholders})
+            """, ids)
+            conn.execute(f"""
+                INSERT OR REPLACE INTO archive.ticket_events ({EVENT_COLUMNS})
+                SELECT {EVENT_COLUMNS} FROM main.ticket_events WHERE ticket_id IN ({placeholders})
+            """, ids)
+            conn.execute(f"DELETE FROM main.ticket_events WHERE ticket_id IN ({placeholders})", ids)
+            conn.execute(f"DELETE FROM main.tickets WHERE ticket_id IN ({placeholders})", ids)
+        moved += len(ids)
+
+@_write_operation(standalone=True)
+def maintain_database(vacuum_pages=VACUUM_PAGES):
+    """
+    Give free pages back to the OS a little at a time and refresh planner
+    statistics. The first run on a file created before incremental
+    auto-vacuum was enabled does one full VACUUM to switch it over.
+    """
+    conn = get_connection()
+    for schema in ("main", "archive"):
+        if conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+            conn.execute(f"PRAGMA {schema}.auto_vacuum=INCREMENTAL")
+            conn.execute(f"VACUUM {schema}")
+        else:
+            conn.execute(f"PRAGMA {schema}.incremental_vacuum({int(vacuum_pages)})").fetchall()
+    # Sample instead of reading every row so ANALYZE stays cheap on big tables.
+    conn.execute("PRAGMA analysis_limit=1000")
+    conn.execute("ANALYZE")
+
+# =============================================================================
+# Ticket statistics
+#
+# ticket_stats holds one counter per (metric, key), maintained by triggers
+# on main.tickets so every insert and status change updates them in the
+# same transaction. client and da_id never change after creation, so only
+# status updates move tickets between counters. Archiving deletes from
+# main.tickets without a delete trigger, so totals keep archived tickets.
+#
+#   status       tickets currently in each status
+#   client_open  open tickets per client (backlog)
+#   da_open      open tickets per DA
+#   reason/type  tickets ever raised per issue reason / issue type
+#   created_on   tickets created per day (UTC)
+#   closed_on    tickets closed per day (UTC)
+# =============================================================================
+STAT_METRICS = ("status", "client_open", "da_open", "reason", "type")
+DASHBOARD_DAYS = 14
+
+_UPSERT_COUNT = "ON CONFLICT(metric, key) DO UPDATE SET count = count + excluded.count"
+
+def _ticket_stats_triggers():
+    open_list = ", ".join(f"'{s}'" for s in OPEN_STATUSES)
+    return (
+        f"""
+        CREATE TRIGGER IF NOT EXISTS ticket_stats_insert AFTER INSERT ON tickets BEGIN
+            INSERT INTO ticket_stats(metric, key, count) VALUES
+                ('status', coalesce(new.status, ''), 1),
+                ('reason', coalesce(new.issue_reason, ''), 1),
+                ('type', coalesce(new.issue_type, ''), 1),
+                ('created_on', date(new.created_at), 1)
+            {_UPSERT_COUNT};
+            INSERT INTO ticket_stats(metric, key, count)
+                SELECT 'client_open', coalesce(new.client, ''), 1 WHERE new.status IN ({open_list})
+                UNION ALL
+                SELECT 'da_open', coalesce(new.da_id, ''), 1 WHERE new.status IN ({open_list})
+            {_UPSERT_COUNT};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS ticket_stats_status AFTER UPDATE OF status ON tickets
+        WHEN old.status IS NOT new.status BEGIN
+            UPDATE ticket_stats SET count = count - 1
+            WHERE (metric = 'status' AND key = coalesce(old.status, ''))
+               OR (old.status IN ({open_list}) AND (
+                      (metric = 'client_open' AND key = coalesce(old.client, ''))
+                   OR (metric = 'da_open' AND key = coalesce(old.da_id, ''))));
+            INSERT INTO ticket_stats(metric, key, count)
+                SELECT 'status', coalesce(new.status, ''), 1 WHERE 1
+                UNION ALL
+                SELECT 'client_open', coalesce(new.client, ''), 1 WHERE new.status IN ({open_list})
+                UNION ALL
+                SELECT 'da_open', coalesce(new.da_id, ''), 1 WHERE new.status IN ({open_list})
+                UNION ALL
+                SELECT 'closed_on', date('now'), 1 WHERE new.status = 'Closed'
+            {_UPSERT_COUNT};
+        END
+        """,
+    )
+
+def _rebuild_ticket_stats(conn):
+    # Reads the base tables rather than the all_* views: this also runs as a
+    # migration, before _add_resolution_columns has given the tables every
+    # column the views name.
+    open_list = ", ".join(f"'{s}'" for s in OPEN_STATUSES)
+    ticket_columns = "status, issue_reason, issue_type, created_at"
+    conn.execute("DELETE FROM ticket_stats")
+    conn.execute(f"""
+        INSERT INTO ticket_stats(metric, key, count)
+        WITH all_tickets AS (
+            SELECT {ticket_columns} FROM main.tickets
+            UNION ALL
+            SELECT {ticket_columns} FROM archive.tickets
+        ), all_ticket_events AS (
+            SELECT ticket_id, action, timestamp FROM main.ticket_events
+            UNION ALL
+            SELECT ticket_id, action, timestamp FROM archive.ticket_events
+        )
+        SELECT 'status', coalesce(status, ''), count(*) FROM all_tickets GROUP BY 2
+        UNION ALL
+        SELECT 'reason', coalesce(issue_reason, ''), count(*) FROM all_tickets GROUP BY 2
+        UNION ALL
+        SELECT 'type', coalesce(issue_type, ''), count(*) FROM all_tickets GROUP BY 2
+        UNION ALL
+        SELECT 'created_on', date(created_at), count(*) FROM all_tickets GROUP BY 2
+        UNION ALL
+        SELECT 'client_open', coalesce(client, ''), count(*) FROM main.tickets WHERE status IN ({open_list}) GROUP BY 2
+        UNION ALL
+        SELECT 'da_open', coalesce(da_id, ''), count(*) FROM main.tickets WHERE status IN ({open_list}) GROUP BY 2
+        UNION ALL
+        SELECT 'closed_on', date(timestamp), count(DISTINCT ticket_id) FROM all_ticket_events
+        WHERE action = 'da_closed' GROUP BY 2
     """)
-    tickets = c.fetchall()
-    conn.close()
-    return tickets
 
+@_write_operation
+def rebuild_ticket_stats():
+    """Recompute every counter from the tickets themselves (repair tool; the triggers keep them current)."""
+    with transaction() as conn:
+        _rebuild_ticket_stats(conn)
+
+def get_ticket_stats(metric):
+    """{key: count} for one of STAT_METRICS, largest first."""
+    if metric not in STAT_METRICS:
+        raise ValueError(f"unknown ticket metric: {metric!r}")
+    conn = get_connection()
+    rows = conn.execute("SELECT key, count FROM ticket_stats WHERE metric=? AND count > 0 ORDER BY count DESC",
+                        (metric,)).fetchall()
+    return {row["key"]: row["count"] for row in rows}
+
+def get_open_status_counts():
+    """{status: count} for every open status, zeros included."""
+    counts = get_ticket_stats("status")
+    return {status: counts.get(status, 0) for status in OPEN_STATUSES}
+
+def get_daily_ticket_stats(days=DASHBOARD_DAYS):
+    """[(day, created, closed)] for the last `days` days, newest first."""
+    conn = get_connection()
+    rows = conn.execute("""
+        SELECT key AS day,
+               sum(CASE WHEN metric='created_on' THEN count ELSE 0 END) AS created,
+               sum(CASE WHEN metric='closed_on' THEN count ELSE 0 END) AS closed
+        FROM ticket_stats
+        WHERE metric IN ('created_on', 'closed_on') AND key >= date('now', ?)
+        GROUP BY key ORDER BY key DESC
+    """, (f"-{int(days) - 1} days",)).fetchall()
+    return [(row["day"], row["created"], row["closed"]) for row in rows]
+
+# =============================================================================
+# Order ID search
+# =============================================================================
+ORDER_SEARCH_LIMIT = 20
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name=?", (name,)).fetchone() is not None
+
+def search_tickets_by_order(order_id, limit=ORDER_SEARCH_LIMIT):
+    """
+    Find tickets whose order ID contains `order_id`, best matches first:
+    exact match, then prefix match, then FTS rank, newest ticket first on
+    ties. Queries shorter than a trigram can only be served by the
+    order_id index, so they match as a prefix (in order_id order, which
+    also puts an exact match first).
+    """
+    order_id = order_id.strip()
+    if not order_id:
+        return []
+    conn = get_connection()
+    if len(order_id) < 3:
+        return conn.execute("""
+            SELECT * FROM all_tickets WHERE order_id >= ? AND order_id < ?
+            ORDER BY order_id LIMIT ?
+        """, (order_id, order_id + "\uffff", limit)).fetchall()
+    if not _has_table(conn, "tickets_order_fts"):
+        return conn.execute("SELECT * FROM all_tickets WHERE order_id LIKE ? ORDER BY ticket_id DESC LIMIT ?",
+                            ('%' + order_id + '%', limit)).fetchall()
+    # Quote the term so the trigram tokenizer treats it as one substring.
+    match = '"' + order_id.replace('"', '""') + '"'
+    return conn.execute("""
+        SELECT t.* FROM tickets_order_fts f JOIN all_tickets t ON t.ticket_id = f.rowid
+        WHERE tickets_order_fts MATCH ?
+        ORDER BY t.order_id = ? COLLATE NOCASE DESC, substr(t.order_id, 1, ?) = ? COLLATE NOCASE DESC,
+                 f.rank, t.ticket_id DESC
+        LIMIT ?
+    """, (match, order_id, len(order_id), order_id, limit)).fetchall()
+
+# =============================================================================
+# Arabic full-text search over descriptions and history messages
+#
+# Text is normalized the same way when indexed and when queried, so a
+# search for "مشكله" finds "مُشْكِلَة" and "اسم" finds "إسم". The index
+# keeps the text as written next to the normalized body, and snippets are
+# cut from it, so results read the way people wrote them.
+# =============================================================================
+TEXT_SEARCH_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS ticket_text_fts USING fts5(
+        body, original UNINDEXED, ticket_id UNINDEXED, source UNINDEXED, tokenize='unicode61'
+    )
+"""
+_ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_ARABIC_LETTER_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ة": "ه",
+})
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+SNIPPET_TOKENS = 12
+TEXT_SEARCH_PAGE_SIZE = 10
+
+def normalize_arabic(text):
+    """Fold presentation forms, strip diacritics/tatweel and unify alef, ya and ta marbuta."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text)
+    text = _ARABIC_DIACRITICS.sub("", text)
+    return text.translate(_ARABIC_LETTER_MAP).casefold()
+
+def _index_text(conn, ticket_id, source, text):
+    if text:
+        conn.execute("INSERT INTO ticket_text_fts (body, original, ticket_id, source) VALUES (?, ?, ?, ?)",
+                     (normalize_arabic(text), text, ticket_id, source))
+
+def _query_words(query):
+    return re.findall(r"\w+", normalize_arabic(query))
+
+def _text_match_expression(words):
+    # Every word must appear, each as a prefix so "مشكل" finds "مشكله".
+    return " ".join('"' + w + '"*' for w in words)
+
+def _word_spans(text):
+    """(start, end, normalized word) for every word of `text`, with offsets into `text` itself."""
+    normalized, offsets = [], []
+    for index, char in enumerate(text):
+        for folded in normalize_arabic(char):
+            normalized.append(folded)
+            offsets.append(index)
+    normalized = "".join(normalized)
+    spans = []
+    for match in re.finditer(r"\w+", normalized):
+        end = offsets[match.end() - 1] + 1
+        # Keep the diacritics and tatweel that normalization dropped with their word.
+        while end < len(text) and not normalize_arabic(text[end]):
+            end += 1
+        spans.append((offsets[match.start()], end, match.group()))
+    return spans
+
+def _strip_marks(word):
+    # unicode61 also drops Latin accents (remove_diacritics), so "cafe" matched "café".
+    return "".join(c for c in unicodedata.normalize("NFD", word) if not unicodedata.combining(c))
+
+def _snippet(text, words, tokens=SNIPPET_TOKENS):
+    """
+    The run of `tokens` words of `text` holding the most words that start
+    with one of `words`, matches wrapped in SNIPPET_START/SNIPPET_END, like
+    FTS5's snippet() but cut from the text as written.
+    """
+    spans = _word_spans(text or "")
+    if not spans:
+        return text or ""
+    words = tuple(_strip_marks(word) for word in words)
+    hits = [_strip_marks(word).startswith(words) for _, _, word in spans]
+    # Try a window starting a quarter before each match; keep the one with most matches.
+    last_start = max(len(spans) - tokens, 0)
+    starts = {min(max(i - tokens // 4, 0), last_start) for i, hit in enumerate(hits) if hit} or {0}
+    best = max(starts, key=lambda start: (sum(hits[start:start + tokens]), -start))
+    window = range(best, min(best + tokens, len(spans)))
+    parts = ["…"] if best > 0 else []
+    position = spans[best][0]
+    for i in window:
+        start, end, _ = spans[i]
+        parts.append(text[position:start])
+        parts.append(f"{SNIPPET_START}{text[start:end]}{SNIPPET_END}" if hits[i] else text[start:end])
+        position = end
+    if window.stop < len(spans):
+        parts.append("…")
+    return "".join(parts)
+
+def search_ticket_text(query, page=1, per_page=TEXT_SEARCH_PAGE_SIZE):
+    """
+    Full-text search over ticket descriptions and history messages.
+    Returns (hits, has_next). Each hit carries the ticket columns plus
+    `source` (description or the event action) and `snippet`, whose matches
+    are wrapped in SNIPPET_START/SNIPPET_END; use render_snippet() to turn
+    those into markup.
+    """
+    words = _query_words(query)
+    if not words:
+        return [], False
+    conn = get_connection()
+    rows = conn.execute("""
+        SELECT t.*, f.source AS source, f.original AS original
+        FROM ticket_text_fts f JOIN all_tickets t ON t.ticket_id = f.ticket_id
+        WHERE ticket_text_fts MATCH ?
+        ORDER BY f.rank
+        LIMIT ? OFFSET ?
+    """, (_text_match_expression(words), per_page + 1, (page - 1) * per_page)).fetchall()
+    hits = []
+    for row in rows[:per_page]:
+        hit = dict(row)
+        hit["snippet"] = _snippet(hit.pop("original"), words)
+        hits.append(hit)
+    return hits, len(rows) > per_page
+
+def render_snippet(snippet, start="<b>", end="</b>"):
+    """HTML-escape a search snippet and turn its match markers into tags."""
+    return html.escape(snippet or "").replace(SNIPPET_START, start).replace(SNIPPET_END, end)
+
+OPEN_STATUSES = ('Opened', 'Pending DA Action', 'Awaiting Client Response', 'Awaiting Supervisor Approval',
+                 'Client Responded', 'Client Ignored')
+
+def iter_open_tickets(batch_size=TICKET_FETCH_SIZE):
+    """Stream open tickets as TicketRecords (served by idx_tickets_status_client)."""
+    placeholders = ", ".join("?" * len(OPEN_STATUSES))
+    return _iter_ticket_records(f"SELECT {TICKET_COLUMNS} FROM tickets WHERE status IN ({placeholders})",
+                                OPEN_STATUSES, batch_size)
+
+def get_all_open_tickets():
+    return list(iter_open_tickets())
+
+def get_open_tickets(after_ticket_id=0, limit=TICKET_FETCH_SIZE):
+    """
+    Up to `limit` open tickets with ticket_id > after_ticket_id, in
+    ticket_id order, as TicketRecords. The page is read completely before
+    it is returned; pass the last ticket_id back for the next page.
+    """
+    placeholders = ", ".join("?" * len(OPEN_STATUSES))
+    return list(_iter_ticket_records(f"""
+        SELECT {TICKET_COLUMNS} FROM tickets WHERE status IN ({placeholders}) AND ticket_id > ?
+        ORDER BY ticket_id LIMIT ?
+    """, OPEN_STATUSES + (after_ticket_id, limit), limit))
+
+def get_tickets_by_client_status(client, status):
+    """Tickets of one client in one status (served by idx_tickets_status_client)."""
+    conn = get_connection()
+    return conn.execute("SELECT * FROM tickets WHERE status=? AND client=? ORDER BY ticket_id",
+                        (status, client)).fetchall()
+
+def get_tickets_by_da(da_id):
+    """Tickets raised by one DA, oldest first (served by idx_tickets_da_created)."""
+    conn = get_connection()
+    return conn.execute("SELECT * FROM all_tickets WHERE da_id=? ORDER BY created_at, ticket_id",
+                        (da_id,)).fetchall()
+
+@_cached_subscription_lookup
 def get_supervisors():
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM subscriptions WHERE role='Supervisor'")
-    supervisors = c.fetchall()
-    conn.close()
-    return supervisors
+    return conn.execute("SELECT * FROM subscriptions WHERE role='Supervisor'").fetchall()
 
+@_cached_subscription_lookup
 def get_clients_by_name(client_name):
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT * FROM subscriptions WHERE role='Client' AND client=?", (client_name,))
-    clients = c.fetchall()
-    conn.close()
-    return clients
+    return conn.execute("SELECT * FROM subscriptions WHERE role='Client' AND client=?", (client_name,)).fetchall()
 
+@_cached_subscription_lookup
 def get_users_by_role(role, client=None):
     """
     Helper function for the notifier module (and others) to retrieve users by role.
     Optionally, filter by client name.
     """
     conn = get_connection()
-    c = conn.cursor()
     if client:
-        c.execute("SELECT * FROM subscriptions WHERE role=? AND client=?", (role.capitalize(), client))
-    else:
-        c.execute("SELECT * FROM subscriptions WHERE role=?", (role.capitalize(),))
-    users = c.fetchall()
-    conn.close()
-    return users
+        return conn.execute("SELECT * FROM subscriptions WHERE role=? AND client=?", (role.capitalize(), client)).fetchall()
+    return conn.execute("SELECT * FROM subscriptions WHERE role=?", (role.capitalize(),)).fetchall()
 
 def get_user(user_id, bot):
     """
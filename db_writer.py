@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# db_writer.py
+#
+# Optional single-writer database service (config.DB_SINGLE_WRITER).
+#
+# One process owns every mutation. Bot processes forward their writes to it
+# over a local authenticated socket (multiprocessing.connection); the writer
+# groups requests that arrive together into one transaction, gives each
+# request its own SAVEPOINT so one failure does not sink the batch, and
+# acknowledges every caller after COMMIT. db.STANDALONE_OPERATIONS (archiving,
+# vacuum) go to a second thread that runs them one at a time outside any
+# batch, so their own commits stay commits and the batches keep flowing
+# between them. Reads keep using the local pooled connection in each bot
+# process.
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+import db
+import config
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on requests committed together, and how long the writer waits
+# for more requests once the first one of a batch has arrived.
+WRITER_MAX_BATCH = 64
+WRITER_BATCH_WINDOW = 0.002
+# How long a bot waits for an acknowledgement, and for the writer to come up.
+WRITER_REQUEST_TIMEOUT = 30
+WRITER_STANDALONE_TIMEOUT = 3600  # archiving / vacuum of a large database
+WRITER_CONNECT_TIMEOUT = 30
+# Listener's default backlog of 1 stalls when several bot threads connect at once.
+WRITER_BACKLOG = 64
+
+class WriterError(Exception):
+    """Raised in a bot process when the writer could not execute a request."""
+
+def _portable(value):
+    # sqlite3.Row cannot be pickled; callers only index rows by column name.
+    if isinstance(value, sqlite3.Row):
+        return dict(value)
+    if isinstance(value, list):
+        return [_portable(v) for v in value]
+    return value
+
+# =============================================================================
+# Writer process
+# =============================================================================
+class _Request:
+    __slots__ = ("channel", "request_id", "name", "args", "kwargs")
+
+    def __init__(self, channel, request_id, name, args, kwargs):
+        self.channel = channel
+        self.request_id = request_id
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+
+class _Channel:
+    """One bot-side connection; replies may come from the writer thread while the reader thread blocks on recv."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def reply(self, request_id, ok, payload):
+        try:
+            with self.lock:
+                self.conn.send((request_id, ok, payload))
+        except (OSError, EOFError) as e:
+            logger.warning("db_writer: could not acknowledge request %s: %s", request_id, e)
+
+def _read_requests(channel, requests, standalone):
+    try:
+        while True:
+            request_id, name, args, kwargs = channel.conn.recv()
+            target = standalone if name in db.STANDALONE_OPERATIONS else requests
+            target.put(_Request(channel, request_id, name, args, kwargs))
+    except (EOFError, OSError):
+        pass
+    finally:
+        channel.conn.close()
+
+def _next_batch(requests):
+    batch = [requests.get()]
+    deadline = time.monotonic() + WRITER_BATCH_WINDOW
+    while len(batch) < WRITER_MAX_BATCH:
+        remaining = deadline - time.monotonic()
+        try:
+            batch.append(requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _execute_batch(batch):
+    results = []
+    try:
+        with db.transaction():
+            for request in batch:
+                func = db.WRITE_OPERATIONS.get(request.name)
+                if func is None:
+                    results.append((False, WriterError(f"unknown write operation {request.name!r}")))
+                    continue
+                try:
+                    with db.transaction():
+                        results.append((True, _portable(func(*request.args, **request.kwargs))))
+                except Exception as e:
+                    results.append((False, e))
+    except Exception as e:
+        logger.error("db_writer: batch of %d failed to commit: %s", len(batch), e)
+        results = [(False, e)] * len(batch)
+    for request, (ok, payload) in zip(batch, results):
+        _reply(request, ok, payload)
+
+def _execute_standalone(request):
+    # The operation opens (and commits) its own transactions.
+    try:
+        result = (True, _portable(db.WRITE_OPERATIONS[request.name](*request.args, **request.kwargs)))
+    except Exception as e:
+        logger.error("db_writer: %s failed: %s", request.name, e)
+        result = (False, e)
+    _reply(request, *result)
+
+def _reply(request, ok, payload):
+    if not ok and not isinstance(payload, WriterError):
+        # Send a plain message; arbitrary exceptions may not survive pickling.
+        payload = WriterError(f"{type(payload).__name__}: {payload}")
+    request.channel.reply(request.request_id, ok, payload)
+
+def _write_loop(requests):
+    while True:
+        _execute_batch(_next_batch(requests))
+
+def _standalone_loop(standalone):
+    while True:
+        _execute_standalone(standalone.get())
+
+def serve(address=None, authkey=None):
+    """Run the writer: accept bot connections and apply their writes in batches."""
+    address = address or config.DB_WRITER_ADDRESS
+    authkey = authkey or config.DB_WRITER_AUTHKEY
+    db.init_db()
+    requests, standalone = queue.Queue(), queue.Queue()
+    threading.Thread(target=_write_loop, args=(requests,), daemon=True, name="db-writer").start()
+    threading.Thread(target=_standalone_loop, args=(standalone,), daemon=True, name="db-writer-standalone").start()
+    with Listener(address, authkey=authkey, backlog=WRITER_BACKLOG) as listener:
+        logger.info("db_writer: listening on %s", address)
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logger.warning("db_writer: rejected connection: %s", e)
+                continue
+            threading.Thread(target=_read_requests, args=(_Channel(conn), requests, standalone), daemon=True).start()
+
+# =============================================================================
+# Bot side
+# =============================================================================
+class WriterClient:
+    """Forwards db write operations to the writer; one socket per thread so threads never wait on each other."""
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address or config.DB_WRITER_ADDRESS
+        self.authkey = authkey or config.DB_WRITER_AUTHKEY
+        self._local = threading.local()
+        self._ids = iter(range(1, 1 << 62))
+        self._ids_lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            deadline = time.monotonic() + WRITER_CONNECT_TIMEOUT
+            while True:
+                try:
+                    conn = Client(self.address, authkey=self.authkey)
+                    break
+                except ConnectionRefusedError:
+                    # The writer process may still be starting up.
+                    if time.monotonic() > deadline:
+                        raise WriterError(f"database writer not reachable at {self.address}")
+                    time.sleep(0.1)
+            self._local.conn = conn
+        return conn
+
+    def __call__(self, name, args, kwargs):
+        with self._ids_lock:
+            request_id = next(self._ids)
+        conn = self._connection()
+        try:
+            conn.send((request_id, name, args, kwargs))
+            timeout = WRITER_STANDALONE_TIMEOUT if name in db.STANDALONE_OPERATIONS else WRITER_REQUEST_TIMEOUT
+            if not conn.poll(timeout):
+                raise WriterError(f"database writer did not acknowledge {name} in {timeout}s")
+            reply_id, ok, payload = conn.recv()
+        except (OSError, EOFError, WriterError):
+            # Drop the socket so the next call reconnects cleanly.
+            self._local.conn = None
+            conn.close()
+            raise
+        if reply_id != request_id:
+            raise WriterError(f"out-of-order reply from database writer ({reply_id} != {request_id})")
+        if not ok:
+            raise payload
+        return payload
+
+def run_as_client(target):
+    """Process entry point for a bot that must send its writes to the writer process."""
+    db.set_write_forwarder(WriterClient())
+    target()
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    serve()
+
+if __name__ == '__main__':
+    main()
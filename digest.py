@@ -0,0 +1,90 @@
+# digest.py
+#
+# Supervisor notifications, sent right away or grouped into digests.
+# supervisor_notifications() builds them for the db write that makes the
+# change, like outbox.messages(). Each supervisor with a digest window
+# (see /digest in supervisor_bot.py) gets a one-line entry instead of the
+# full message, unless the event is urgent; the supervisor bot runs
+# flush_due() every DIGEST_FLUSH_INTERVAL seconds to send the digests that
+# are due as one paginated message each.
+import html
+import time
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import config
+import db
+import outbox
+
+DIGEST_PAGE_SIZE = 10
+DIGEST_FLUSH_INTERVAL = 60
+DIGEST_CHOICES = (0, 15, 30, 60)  # minutes offered by /digest; 0 = immediate
+
+EVENT_LABELS = {
+    "ticket_created": "بلاغ جديد",
+    "da_moreinfo": "معلومات إضافية من الوكيل",
+    "client_solution": "حل من العميل",
+    "client_ignored": "تجاهل من العميل",
+    "da_closed": "أغلقها الوكيل",
+}
+
+def window_minutes(supervisor):
+    minutes = supervisor["digest_minutes"]
+    return config.SUPERVISOR_DIGEST_MINUTES if minutes is None else minutes
+
+def summary(kind, ticket):
+    return (f"#{ticket['ticket_id']} {EVENT_LABELS.get(kind, kind)} - "
+            f"طلب {html.escape(str(ticket['order_id']))}")
+
+def supervisor_notifications(kind, ticket, text, photo=None, key=None, reply_markup=None):
+    """
+    Notifications (for db.transition_ticket / db.create_ticket) telling
+    every supervisor about event `kind` on `ticket`: `text` (with `photo`
+    and `reply_markup`) now, or an entry in their next digest.
+    """
+    now = time.time()
+    urgent = kind in config.DIGEST_URGENT_EVENTS
+    chat_ids, items = [], []
+    for sup in db.get_supervisors():
+        minutes = 0 if urgent else window_minutes(sup)
+        if minutes <= 0:
+            chat_ids.append(sup["chat_id"])
+            continue
+        items.append({"idempotency_key": f"{key}:{sup['chat_id']}" if key else None,
+                      "chat_id": sup["chat_id"], "ticket_id": ticket["ticket_id"], "kind": kind,
+                      "summary": summary(kind, ticket), "due_at": now + minutes * 60})
+    return {"outbox": outbox.messages("supervisor", chat_ids, text, photo=photo, key=key,
+                                      reply_markup=reply_markup, parse_mode="HTML"),
+            "digest": items}
+
+def render(digest_id, items, page=0):
+    """Text and inline keyboard for one page of a digest."""
+    pages = max(1, -(-len(items) // DIGEST_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    shown = items[page * DIGEST_PAGE_SIZE:(page + 1) * DIGEST_PAGE_SIZE]
+    text = f"<b>ملخص الإشعارات ({len(items)})</b>\n" + "\n".join(item["summary"] for item in shown)
+    if pages > 1:
+        text += f"\n\nصفحة {page + 1} من {pages}"
+    ticket_ids = list(dict.fromkeys(item["ticket_id"] for item in shown))
+    keyboard = [[InlineKeyboardButton(f"عرض #{ticket_id}", callback_data=f"view|{ticket_id}")
+                 for ticket_id in ticket_ids[i:i + 2]] for i in range(0, len(ticket_ids), 2)]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("السابق", callback_data=f"digest_page|{digest_id}|{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("التالي", callback_data=f"digest_page|{digest_id}|{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    return text, InlineKeyboardMarkup(keyboard)
+
+def flush_due(context=None):
+    """Queue every digest that is due; returns how many. Usable as a JobQueue callback."""
+    flushed = 0
+    for chat_id in db.get_due_digest_chats():
+        items = db.get_digest_items(chat_id)
+        # The digest and its message are written by one take_digest() call,
+        # which fills in the digest id the message refers to.
+        text, markup = render(db.DIGEST_ID, items)
+        messages = outbox.messages("supervisor", [chat_id], text, key=f"digest:{db.DIGEST_ID}",
+                                   reply_markup=markup, parse_mode="HTML")
+        if db.take_digest(chat_id, [item["item_id"] for item in items], {"outbox": messages}):
+            flushed += 1
+    return flushed
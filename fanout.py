@@ -0,0 +1,189 @@
+# fanout.py
+#
+# Concurrent, rate-limited delivery of notifications.
+#
+#   future = fanout.send(bot, chat_id, "send_message", text=text)
+#   future = fanout.get_engine().submit(bot, chat_id, "send_photo", photo=url)
+#
+# return a Future immediately; worker threads do the Bot API calls. Each chat gets
+# its messages in submission order, and token buckets keep every bot under
+# Telegram's limits (about 30 messages/s per bot, 1 message/s per chat).
+# A 429 answer pauses the whole bot for the retry_after Telegram asks for
+# and the message is sent again.
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from telegram.error import RetryAfter
+import cache
+
+logger = logging.getLogger(__name__)
+
+FANOUT_WORKERS = 16
+# Sends are paced evenly rather than in bursts: Telegram counts over a
+# sliding second, so a full burst followed by refill would overshoot it.
+BOT_RATE = 30           # messages per second per bot token
+BOT_BURST = 1
+CHAT_RATE = 1           # messages per second per chat
+CHAT_BURST = 1
+FANOUT_MAX_RETRIES = 3  # RetryAfter answers tolerated for one message
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. reserve() takes a token immediately (the
+    balance may go negative) and returns how long the caller must wait
+    before using it, so waiting callers are served in order without polling.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        # A 429 may have paused the bucket while this caller slept.
+        with self.lock:
+            wait = self.paused_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds` (Telegram's retry_after)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self):
+        with self.lock:
+            return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+class FanOut:
+    """
+    Sends Bot API calls on a thread pool. Messages wait in one FIFO lane per
+    (bot, chat); a dispatcher thread hands a lane to a worker only when its
+    chat may receive the next message, so no worker sleeps on a per-chat
+    limit while other chats are waiting.
+    """
+
+    def __init__(self, workers=FANOUT_WORKERS, bot_rate=BOT_RATE, bot_burst=BOT_BURST,
+                 chat_rate=CHAT_RATE, chat_burst=CHAT_BURST):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout")
+        self._bot_limits = (bot_rate, bot_burst)
+        self._chat_limits = (chat_rate, chat_burst)
+        self._cond = threading.Condition()
+        self._lanes = {}
+        self._due = []
+        self._order = itertools.count()
+        self._bot_buckets = {}
+        self._chat_buckets = {}
+        self._closed = False
+        threading.Thread(target=self._dispatch, daemon=True, name="fanout-dispatch").start()
+
+    def submit(self, bot, chat_id, method, **kwargs):
+        """Queue bot.<method>(chat_id=chat_id, **kwargs); returns a Future with the API result."""
+        future = Future()
+        key = (bot.token, chat_id)
+        with self._cond:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = deque()
+                self._schedule(bot, key)
+            lane.append([method, kwargs, future, 0])
+        return future
+
+    def _schedule(self, bot, key):
+        # Caller holds self._cond. Reserving the chat's next slot here is what
+        # spaces messages to one chat.
+        delay = self._buckets(key)[1].reserve()
+        heapq.heappush(self._due, (time.monotonic() + delay, next(self._order), bot, key))
+        self._cond.notify()
+
+    def _dispatch(self):
+        with self._cond:
+            while not self._closed:
+                if not self._due:
+                    self._cond.wait()
+                    continue
+                wait = self._due[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                _, _, bot, key = heapq.heappop(self._due)
+                self._executor.submit(self._send_next, bot, key)
+
+    def _buckets(self, key):
+        bot_bucket = self._bot_buckets.get(key[0])
+        if bot_bucket is None:
+            bot_bucket = self._bot_buckets[key[0]] = TokenBucket(*self._bot_limits)
+        chat_bucket = self._chat_buckets.get(key)
+        if chat_bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Forget chats that have been quiet long enough to be full again.
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items()
+                                      if k in self._lanes or not b.idle()}
+            chat_bucket = self._chat_buckets[key] = TokenBucket(*self._chat_limits)
+        return bot_bucket, chat_bucket
+
+    def _send_next(self, bot, key):
+        with self._cond:
+            lane = self._lanes[key]
+            entry = lane[0]
+            bot_bucket, chat_bucket = self._buckets(key)
+        method, kwargs, future, retries = entry
+        done = True
+        if future.set_running_or_notify_cancel() if retries == 0 else True:
+            bot_bucket.acquire()
+            try:
+                future.set_result(getattr(bot, method)(chat_id=key[1], **kwargs))
+            except RetryAfter as e:
+                entry[3] = retries + 1
+                if entry[3] > FANOUT_MAX_RETRIES:
+                    logger.error("fanout: %s to chat %s still rate limited, giving up", method, key[1])
+                    future.set_exception(e)
+                else:
+                    logger.warning("fanout: rate limited by Telegram, pausing bot for %ss", e.retry_after)
+                    bot_bucket.pause(e.retry_after)
+                    chat_bucket.pause(e.retry_after)
+                    done = False
+            except Exception as e:
+                logger.error("fanout: %s to chat %s failed: %s", method, key[1], e)
+                future.set_exception(e)
+        with self._cond:
+            if done:
+                lane.popleft()
+            if lane:
+                self._schedule(bot, key)
+            else:
+                del self._lanes[key]
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._executor.shutdown(wait=wait)
+
+_engine = cache.PerProcess(FanOut)
+
+def get_engine():
+    """The process-wide FanOut, created on first use (and again after a fork)."""
+    return _engine.get()
+
+def send(bot, chat_id, method, **kwargs):
+    return get_engine().submit(bot, chat_id, method, **kwargs)
@@ -1,21 +1,28 @@
 # main.py
 import multiprocessing
 import db
+import db_writer
+import maintenance
+import outbox
+from config import DB_SINGLE_WRITER
 from da_bot import main as da_main
 from supervisor_bot import main as supervisor_main
 from client_bot import main as client_main
 
 if __name__ == '__main__':
     db.init_db()
-    
-    p1 = multiprocessing.Process(target=da_main)
-    p2 = multiprocessing.Process(target=supervisor_main)
-    p3 = multiprocessing.Process(target=client_main)
-    
-    p1.start()
-    p2.start()
-    p3.start()
-    
-    p1.join()
-    p2.join()
-    p3.join()
+
+    workers = [da_main, supervisor_main, client_main, maintenance.main, outbox.main]
+    processes = []
+    if DB_SINGLE_WRITER:
+        # One process owns all writes; the others forward theirs to it.
+        processes.append(multiprocessing.Process(target=db_writer.main))
+        processes += [multiprocessing.Process(target=db_writer.run_as_client, args=(worker,)) for worker in workers]
+    else:
+        processes += [multiprocessing.Process(target=worker) for worker in workers]
+
+    for p in processes:
+        p.start()
+
+    for p in processes:
+        p.join()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# maintenance.py
+#
+# Periodic housekeeping: archive old closed tickets, drop delivered outbox
+# rows, old digests and expired callback tokens, then vacuum/analyze.
+# Started by main.py; can also be run once by hand with `python maintenance.py --once`.
+import logging
+import sys
+import time
+import db
+import config
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_once():
+    moved = db.archive_closed_tickets(config.ARCHIVE_AFTER_DAYS)
+    logger.info("Archived %d closed tickets older than %d days", moved, config.ARCHIVE_AFTER_DAYS)
+    purged = db.purge_sent_notifications(config.OUTBOX_RETENTION_DAYS)
+    logger.info("Purged %d delivered notifications", purged)
+    purged = db.purge_digests(config.OUTBOX_RETENTION_DAYS)
+    logger.info("Purged %d old supervisor digests", purged)
+    purged = db.purge_expired_callback_tokens()
+    logger.info("Purged %d expired callback tokens", purged)
+    db.maintain_database()
+    logger.info("Database maintenance finished")
+
+def main():
+    while True:
+        try:
+            run_once()
+        except Exception as e:
+            logger.error("Database maintenance failed: %s", e)
+        time.sleep(config.MAINTENANCE_INTERVAL_HOURS * 3600)
+
+if __name__ == '__main__':
+    if "--once" in sys.argv:
+        run_once()
+    else:
+        main()
@@ -1,59 +1,42 @@
 # notifier.py
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+# Notifications are queued in the outbox. new_ticket_notifications() is passed
+# to db.create_ticket() so it is written with the ticket; the notify_* helpers
+# queue theirs on their own.
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 import db
-from config import DA_BOT_TOKEN, SUPERVISOR_BOT_TOKEN, CLIENT_BOT_TOKEN
+import digest
+import outbox
 
-# Create standalone Bot objects (used only for sending notifications)
-da_bot = Bot(token=DA_BOT_TOKEN)
-supervisor_bot = Bot(token=SUPERVISOR_BOT_TOKEN)
-client_bot = Bot(token=CLIENT_BOT_TOKEN)
+def new_ticket_notifications(ticket):
+    """Supervisor notifications for a ticket about to be created; its id is db.TICKET_ID."""
+    message = (
+        f"تم إنشاء بلاغ جديد.\n"
+        f"رقم التذكرة: {ticket['ticket_id']}\n"
+        f"رقم الأوردر: {ticket['order_id']}\n"
+        f"الوصف: {ticket['issue_description']}"
+    )
+    buttons = [
+        [InlineKeyboardButton("عرض التفاصيل", callback_data=f"view|{ticket['ticket_id']}")]
+    ]
+    markup = InlineKeyboardMarkup(buttons)
+    return digest.supervisor_notifications("ticket_created", ticket, message, photo=ticket['image_url'],
+                                           key=f"ticket_created:{ticket['ticket_id']}", reply_markup=markup)
 
-def notify_supervisors(ticket):
-    supervisors = db.get_users_by_role("supervisor")
-    for sup in supervisors:
-        message = (
-            f"تم إنشاء بلاغ جديد.\n"
-            f"رقم التذكرة: {ticket['ticket_id']}\n"
-            f"رقم الأوردر: {ticket['order_id']}\n"
-            f"الوصف: {ticket['issue_description']}"
-        )
-        buttons = [
-            [InlineKeyboardButton("عرض التفاصيل", callback_data=f"view|{ticket['ticket_id']}")]
-        ]
-        markup = InlineKeyboardMarkup(buttons)
-        try:
-            if ticket['image_url']:
-                supervisor_bot.send_photo(chat_id=sup["chat_id"], photo=ticket['image_url'],
-                                            caption=message, reply_markup=markup, parse_mode="HTML")
-            else:
-                supervisor_bot.send_message(chat_id=sup["chat_id"], text=message,
-                                              reply_markup=markup, parse_mode="HTML")
-        except Exception as e:
-            print("Error notifying supervisor:", e)
-
-def notify_client(ticket):
-    clients = db.get_users_by_role("client", client=ticket["client"])
-    for client in clients:
-        message = (
-            f"تم رفع بلاغ يتعلق بطلب {ticket['order_id']}.\n"
-            f"الوصف: {ticket['issue_description']}\n"
-            f"النوع: {ticket['issue_type']}"
-        )
-        buttons = [
-            [InlineKeyboardButton("عرض التفاصيل", callback_data=f"client_view|{ticket['ticket_id']}")]
-        ]
-        markup = InlineKeyboardMarkup(buttons)
-        try:
-            if ticket['image_url']:
-                client_bot.send_photo(chat_id=client["chat_id"], photo=ticket['image_url'],
-                                        caption=message, reply_markup=markup, parse_mode="HTML")
-            else:
-                client_bot.send_message(chat_id=client["chat_id"], text=message,
-                                        reply_markup=markup, parse_mode="HTML")
-        except Exception as e:
-            print("Error notifying client:", e)
+def notify_client(ticket, key=None):
+    message = (
+        f"تم رفع بلاغ يتعلق بطلب {ticket['order_id']}.\n"
+        f"الوصف: {ticket['issue_description']}\n"
+        f"النوع: {ticket['issue_type']}"
+    )
+    buttons = [
+        [InlineKeyboardButton("عرض التفاصيل", callback_data=f"client_view|{ticket['ticket_id']}")]
+    ]
+    markup = InlineKeyboardMarkup(buttons)
+    chat_ids = [client["chat_id"] for client in db.get_users_by_role("client", client=ticket["client"])]
+    outbox.enqueue("client", chat_ids, message, photo=ticket['image_url'], key=key,
+                   reply_markup=markup, parse_mode="HTML")
 
-def notify_da(ticket):
+def notify_da(ticket, key=None):
     # Get the DA by using the da_id field from the ticket
     da_user = db.get_user(ticket["da_id"], "da")
     if da_user:
@@ -66,12 +49,5 @@ def notify_da(ticket):
             [InlineKeyboardButton("عرض التفاصيل", callback_data=f"da_view|{ticket['ticket_id']}")]
         ]
         markup = InlineKeyboardMarkup(buttons)
-        try:
-            if ticket['image_url']:
-                da_bot.send_photo(chat_id=da_user["chat_id"], photo=ticket['image_url'],
-                                  caption=message, reply_markup=markup, parse_mode="HTML")
-            else:
-                da_bot.send_message(chat_id=da_user["chat_id"], text=message,
-                                    reply_markup=markup, parse_mode="HTML")
-        except Exception as e:
-            print("Error notifying DA:", e)
+        outbox.enqueue("da", [da_user["chat_id"]], message, photo=ticket['image_url'], key=key,
+                       reply_markup=markup, parse_mode="HTML")
@@ -0,0 +1,166 @@
+# orders.py
+#
+# Client for the external order lookup (locus_info) used when a DA adds an
+# issue:
+#
+#   orders.get_orders(agent_phone)     # list of {"order_id", "client_name", ...}
+#   orders.prefetch(agent_phone)       # warm the cache in the background
+#
+# Requests share one keep-alive session and have strict timeouts. Answers
+# are cached per (agent_phone, date) for ORDERS_CACHE_TTL, and concurrent
+# lookups of the same key share one request. After ORDERS_BREAKER_FAILURES
+# consecutive failures the circuit breaker fails every lookup immediately
+# for ORDERS_BREAKER_RESET seconds, then lets one request through to probe.
+# Failures raise OrdersUnavailable.
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import cache
+import config
+
+logger = logging.getLogger(__name__)
+
+ORDERS_CONNECT_TIMEOUT = 3.05
+ORDERS_READ_TIMEOUT = 5
+ORDERS_POOL_SIZE = 8
+ORDERS_CACHE_TTL = 120       # seconds an answer is reused
+ORDERS_CACHE_SIZE = 1000
+ORDERS_BREAKER_FAILURES = 5
+ORDERS_BREAKER_RESET = 30    # seconds the breaker stays open
+ORDERS_PREFETCH_WORKERS = 2
+
+class OrdersUnavailable(Exception):
+    """The order lookup failed, timed out, or the circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures; once open, allow() refuses calls until
+    `reset_timeout` has passed and then admits a single probe whose outcome
+    closes or reopens the breaker.
+    """
+
+    def __init__(self, failure_threshold=ORDERS_BREAKER_FAILURES, reset_timeout=ORDERS_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    logger.warning("orders: lookup failing, circuit open for %ss", self.reset_timeout)
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+class OrdersClient:
+    def __init__(self, base_url=None, cache_ttl=ORDERS_CACHE_TTL, breaker=None):
+        self.base_url = base_url or config.ORDERS_API_URL
+        self.cache_ttl = cache_ttl
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        # Retry only failed connects: the lookup is idempotent, but a slow
+        # read is exactly what must not be waited for twice.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=ORDERS_POOL_SIZE,
+                              max_retries=Retry(total=1, connect=1, read=0, status=0))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._cache = cache.LRUCache(ORDERS_CACHE_SIZE, ttl=cache_ttl)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._prefetcher = ThreadPoolExecutor(max_workers=ORDERS_PREFETCH_WORKERS,
+                                              thread_name_prefix="orders-prefetch")
+
+    def get_orders(self, agent_phone, order_date=None):
+        """Orders of `agent_phone` for `order_date` (default: ORDERS_DATE or today)."""
+        key = (agent_phone, order_date or _default_date())
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            orders = self._fetch(*key)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(orders)
+            self._cache.put(key, orders)
+            return orders
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _fetch(self, agent_phone, order_date):
+        if not self.breaker.allow():
+            raise OrdersUnavailable("order lookup temporarily disabled after repeated failures")
+        try:
+            response = self.session.get(self.base_url,
+                                        params={"agent_phone": agent_phone, "order_date": f"'{order_date}'"},
+                                        timeout=(ORDERS_CONNECT_TIMEOUT, ORDERS_READ_TIMEOUT))
+            response.raise_for_status()
+            orders = response.json().get("data", [])
+        except (requests.RequestException, ValueError, AttributeError) as e:
+            # AttributeError: valid JSON that is not an object has no .get().
+            self.breaker.record_failure()
+            raise OrdersUnavailable(str(e)) from e
+        except BaseException:
+            # Anything unexpected still counts, or a half-open probe would
+            # never be released and the breaker would stay open for good.
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return orders
+
+    def prefetch(self, agent_phone, order_date=None):
+        """Start a lookup in the background so the next get_orders() is a cache hit."""
+        def run():
+            try:
+                self.get_orders(agent_phone, order_date)
+            except OrdersUnavailable as e:
+                logger.info("orders: prefetch for %s failed: %s", agent_phone, e)
+        self._prefetcher.submit(run)
+
+def _default_date():
+    return config.ORDERS_DATE or datetime.date.today().strftime("%Y-%m-%d")
+
+_client = cache.PerProcess(OrdersClient)
+
+def get_client():
+    """The process-wide OrdersClient (recreated after a fork)."""
+    return _client.get()
+
+def get_orders(agent_phone, order_date=None):
+    return get_client().get_orders(agent_phone, order_date)
+
+def prefetch(agent_phone, order_date=None):
+    get_client().prefetch(agent_phone, order_date)
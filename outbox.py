@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# outbox.py
+#
+# Durable notifications. Handlers build rows with outbox.messages() and
+# pass them to the db write that makes the ticket change (e.g.
+# db.transition_ticket(..., notifications={"outbox": rows})), so a
+# notification exists exactly when the change committed; enqueue() queues
+# one on its own. The worker (main(), started by main.py) takes
+# due rows in batches, sends them through fanout, and records the outcome:
+# sent, retried later with exponential backoff, or dead-lettered. Photos
+# are sent by their cached Telegram file_id (see photos.py).
+#
+# Delivery is at-least-once: a crash between a send and its bookkeeping
+# sends that message again on restart.
+import json
+import logging
+import time
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Unauthorized
+import bots
+import db
+import config
+import fanout
+import photos
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_INTERVAL = 0.5
+OUTBOX_BACKOFF_BASE = 2
+OUTBOX_BACKOFF_MAX = 600
+
+# Telegram will never accept these (chat gone, bot blocked, bad markup).
+PERMANENT_ERRORS = (BadRequest, Unauthorized)
+
+def messages(bot_name, chat_ids, text, photo=None, key=None, reply_markup=None, parse_mode=None):
+    """
+    Outbox rows sending `text` to every chat through the named bot, as a
+    photo caption when `photo` is given. With a `key` (e.g.
+    f"event:{db.EVENT_ID}") each recipient gets the notification at most
+    once however often it is queued. Rows name the bot, never its token.
+    """
+    if bot_name not in bots.BOT_TOKENS:
+        raise ValueError(f"unknown bot {bot_name!r}")
+    payload = {"photo": photo, "caption": text} if photo else {"text": text}
+    if reply_markup is not None:
+        payload["reply_markup"] = reply_markup.to_dict()
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    payload = json.dumps(payload, ensure_ascii=False)
+    return [{"idempotency_key": f"{key}:{bot_name}:{chat_id}" if key else None,
+             "bot": bot_name, "chat_id": chat_id,
+             "method": "send_photo" if photo else "send_message",
+             "payload": payload}
+            for chat_id in chat_ids]
+
+def enqueue(bot_name, chat_ids, text, photo=None, key=None, reply_markup=None, parse_mode=None):
+    """Queue messages(...) right away, for notifications that go with no ticket change."""
+    rows = messages(bot_name, chat_ids, text, photo=photo, key=key, reply_markup=reply_markup, parse_mode=parse_mode)
+    if rows:
+        db.enqueue_notifications(rows)
+
+def _retry_at(attempts):
+    if attempts + 1 >= config.OUTBOX_MAX_ATTEMPTS:
+        return None
+    return time.time() + min(OUTBOX_BACKOFF_BASE ** attempts, OUTBOX_BACKOFF_MAX)
+
+def _send_batch(jobs, file_ids):
+    """
+    Send (row, kwargs) jobs through fanout and wait for them; photos go by
+    file_id when `file_ids` has one. Returns (row, error, by_file_id) and
+    adds file_ids learned from photos sent by URL.
+    """
+    sends = []
+    for row, kwargs in jobs:
+        bot = bots.get(row["bot"])
+        kwargs = dict(kwargs)
+        if "reply_markup" in kwargs:
+            kwargs["reply_markup"] = InlineKeyboardMarkup.de_json(kwargs["reply_markup"], bot)
+        url = kwargs.get("photo")
+        file_id = file_ids[row["bot"]].get(url) if url else None
+        if file_id is not None:
+            kwargs["photo"] = file_id
+        sends.append((row, url, file_id is not None, fanout.send(bot, row["chat_id"], row["method"], **kwargs)))
+    results, learned = [], {}
+    for row, url, by_file_id, future in sends:
+        error = future.exception()
+        if error is None and url and not by_file_id:
+            file_id = photos.file_id_of(future.result())
+            if file_id is not None:
+                learned.setdefault(row["bot"], {})[url] = file_id
+        results.append((row, error, by_file_id))
+    for bot_name, learned_ids in learned.items():
+        photos.remember(bot_name, learned_ids)
+        file_ids[bot_name].update(learned_ids)
+    return results
+
+def deliver_due():
+    """Send one batch of due notifications and record the results; returns the batch size."""
+    rows = db.get_due_notifications(OUTBOX_BATCH_SIZE)
+    jobs = [(row, json.loads(row["payload"])) for row in rows]
+    file_ids = {name: photos.lookup(name, [kwargs["photo"] for row, kwargs in jobs
+                                           if row["bot"] == name and "photo" in kwargs])
+                for name in {row["bot"] for row in rows}}
+    # An image the bot has never sent goes to one recipient first; the
+    # others get it by the file_id that send returns.
+    first, waiting, leading = [], [], set()
+    for row, kwargs in jobs:
+        url = kwargs.get("photo")
+        if url and url not in file_ids[row["bot"]]:
+            if (row["bot"], url) in leading:
+                waiting.append((row, kwargs))
+                continue
+            leading.add((row["bot"], url))
+        first.append((row, kwargs))
+    results = _send_batch(first, file_ids)
+    results += _send_batch(waiting, file_ids)
+    sent, failures = [], []
+    for row, error, by_file_id in results:
+        if error is None:
+            sent.append(row["message_id"])
+            continue
+        if by_file_id and isinstance(error, BadRequest):
+            # Telegram no longer knows the file_id; the retry sends the URL.
+            photos.forget(row["bot"], json.loads(row["payload"])["photo"])
+            retry_at = _retry_at(row["attempts"])
+        else:
+            retry_at = None if isinstance(error, PERMANENT_ERRORS) else _retry_at(row["attempts"])
+        if retry_at is None:
+            logger.error("outbox: dead-lettering message %s to chat %s: %s", row["message_id"], row["chat_id"], error)
+        failures.append((row["message_id"], f"{type(error).__name__}: {error}", retry_at))
+    if rows:
+        db.record_notification_results(sent, failures)
+    return len(rows)
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    next_stats = time.monotonic() + bots.BOT_STATS_INTERVAL
+    while True:
+        if time.monotonic() >= next_stats:
+            bots.log_stats()
+            next_stats = time.monotonic() + bots.BOT_STATS_INTERVAL
+        try:
+            if deliver_due() == OUTBOX_BATCH_SIZE:
+                continue
+        except Exception as e:
+            logger.error("outbox: delivery pass failed: %s", e)
+        time.sleep(OUTBOX_POLL_INTERVAL)
+
+if __name__ == '__main__':
+    main()
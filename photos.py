@@ -0,0 +1,72 @@
+# photos.py
+#
+# Ticket images live on Cloudinary. Sending one by URL makes Telegram
+# download and process it again for every recipient; sending the file_id
+# Telegram returned for an earlier send of that URL costs nothing. This
+# module keeps the file_ids per bot (a file_id only works for the bot that
+# received it), in memory and in the telegram_files table:
+#
+#   photos.send_photo("supervisor", query.message.reply_photo, ticket['image_url'])
+import logging
+from telegram.error import BadRequest
+import cache
+import db
+
+logger = logging.getLogger(__name__)
+
+PHOTO_CACHE_SIZE = 2048
+
+_cache = cache.LRUCache(PHOTO_CACHE_SIZE)  # (bot_name, url) -> file_id
+
+def file_id_of(message):
+    """The file_id of the largest size of the photo in `message`, if any."""
+    if message is not None and getattr(message, "photo", None):
+        return message.photo[-1].file_id
+    return None
+
+def lookup(bot_name, urls):
+    """{url: file_id} for the urls `bot_name` has sent before."""
+    found, missing = {}, []
+    for url in set(urls):
+        file_id = _cache.get((bot_name, url))
+        if file_id is None:
+            missing.append(url)
+        else:
+            found[url] = file_id
+    if missing:
+        stored = db.get_file_ids(bot_name, missing)
+        _remember_locally(bot_name, stored)
+        found.update(stored)
+    return found
+
+def _remember_locally(bot_name, file_ids):
+    _cache.update({(bot_name, url): file_id for url, file_id in file_ids.items()})
+
+def remember(bot_name, file_ids):
+    """Store {url: file_id} learned from successful sends."""
+    if file_ids:
+        _remember_locally(bot_name, file_ids)
+        db.save_file_ids(bot_name, file_ids)
+
+def forget(bot_name, url):
+    """Drop a file_id Telegram no longer accepts."""
+    _cache.pop((bot_name, url))
+    db.forget_file_id(bot_name, url)
+
+def send_photo(bot_name, send, url, **kwargs):
+    """
+    Call send(photo=..., **kwargs) with the cached file_id for `url`, or with
+    the URL itself the first time (remembering the file_id it yields).
+    """
+    file_id = lookup(bot_name, [url]).get(url)
+    if file_id is not None:
+        try:
+            return send(photo=file_id, **kwargs)
+        except BadRequest as e:
+            logger.warning("photos: %s bot's file_id for %s was rejected (%s), sending the URL", bot_name, url, e)
+            forget(bot_name, url)
+    message = send(photo=url, **kwargs)
+    file_id = file_id_of(message)
+    if file_id is not None:
+        remember(bot_name, {url: file_id})
+    return message
@@ -0,0 +1,119 @@
+# router.py
+#
+# Callback query routing shared by the bots. A route is the part of
+# callback_data before the first "|"; the rest are "|"-separated arguments.
+#
+#   router = Router("supervisor")
+#
+#   @router.route("view", int)
+#   def view_ticket(update, context, ticket_id):
+#       ...
+#
+#   MAIN_MENU: [router.handler("view", "solve", ...)]
+#
+# router.handler() accepts an update with one set lookup instead of a regex,
+# and dispatch() answers the query, finds the route with one dict lookup,
+# converts the arguments with the registered types and times the call.
+# Routes registered with payload=True get the payload that callbacks.py
+# stored for the button instead. log_stats() reports count and latency per
+# route, busiest first.
+import logging
+import threading
+import time
+from telegram.ext import CallbackQueryHandler
+import callbacks
+
+logger = logging.getLogger(__name__)
+
+ROUTER_STATS_INTERVAL = 600  # seconds between latency log lines
+ROUTER_STATS_TOP = 10
+
+_routers = []
+
+class Router:
+    def __init__(self, name, unknown=None, expired=None):
+        """
+        `unknown(update, context)` answers callbacks without a route or with
+        malformed arguments; `expired(update, context)` answers payload
+        routes whose token is no longer known.
+        """
+        self.name = name
+        self.unknown = unknown
+        self.expired = expired or unknown
+        self._routes = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        _routers.append(self)
+
+    def route(self, name, *types, payload=False):
+        """Decorator registering `func(update, context, *args)` as route `name`; stack it for aliases."""
+        def register(func):
+            self.add(name, func, *types, payload=payload)
+            return func
+        return register
+
+    def add(self, name, func, *types, payload=False):
+        if name in self._routes:
+            raise ValueError(f"route {name!r} registered twice")
+        self._routes[name] = (func, types, payload)
+
+    def matches(self, names):
+        """A CallbackQueryHandler pattern accepting exactly the routes in `names`."""
+        names = frozenset(names)
+        return lambda data: isinstance(data, str) and data.partition("|")[0] in names
+
+    def handler(self, *names):
+        """A CallbackQueryHandler dispatching the given routes (all routes when none are given)."""
+        return CallbackQueryHandler(self.dispatch, pattern=self.matches(names or self._routes))
+
+    def dispatch(self, update, context):
+        query = update.callback_query
+        query.answer()
+        name, _, rest = query.data.partition("|")
+        route = self._routes.get(name)
+        if route is None:
+            logger.warning("router: %s has no route for %r", self.name, query.data)
+            return self.unknown(update, context) if self.unknown else None
+        func, types, payload = route
+        if payload:
+            value = callbacks.resolve(query.data)
+            if value is None:
+                return self.expired(update, context) if self.expired else None
+            args = (value,)
+        else:
+            parts = rest.split("|") if rest else []
+            try:
+                # Trailing parts without a type are optional flags, passed as strings.
+                args = tuple(t(part) for t, part in zip(types, parts)) + tuple(parts[len(types):])
+                if len(parts) < len(types):
+                    raise ValueError("missing arguments")
+            except ValueError:
+                logger.warning("router: %s got malformed callback data %r", self.name, query.data)
+                return self.unknown(update, context) if self.unknown else None
+        start = time.perf_counter()
+        try:
+            return func(update, context, *args)
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def _record(self, name, elapsed):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def stats(self):
+        """{route: (calls, total seconds, slowest seconds)} since start-up."""
+        with self._lock:
+            return {name: tuple(values) for name, values in self._stats.items()}
+
+def log_stats(context=None):
+    """Log the busiest routes of every router in this process; usable as a JobQueue callback."""
+    for router in _routers:
+        busiest = sorted(router.stats().items(), key=lambda item: item[1][1], reverse=True)
+        for name, (calls, total, slowest) in busiest[:ROUTER_STATS_TOP]:
+            logger.info("router: %s/%s %d calls, avg %.1f ms, max %.1f ms, total %.2f s",
+                        router.name, name, calls, total / calls * 1000, slowest * 1000, total)
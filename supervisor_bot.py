@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
 # supervisor_bot.py
 import logging
-import json
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply, Bot
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, ConversationHandler, CallbackContext
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler, CallbackContext
+import bots
 import db
-import config
+import digest
+import outbox
+import photos
+import router
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Conversation states
-(SUBSCRIPTION_PHONE, MAIN_MENU, SEARCH_TICKETS, AWAITING_RESPONSE) = range(4)
+(SUBSCRIPTION_PHONE, MAIN_MENU, SEARCH_TICKETS, AWAITING_RESPONSE, SEARCH_TEXT) = range(5)
 
 def safe_edit_message(query, text, reply_markup=None, parse_mode="HTML"):
     """
@@ -32,7 +35,8 @@ def start(update: Update, context: CallbackContext):
         return SUBSCRIPTION_PHONE
     else:
         keyboard = [[InlineKeyboardButton("عرض الكل", callback_data="menu_show_all"),
-                     InlineKeyboardButton("استعلام عن مشكلة", callback_data="menu_query_issue")]]
+                     InlineKeyboardButton("استعلام عن مشكلة", callback_data="menu_query_issue")],
+                    [InlineKeyboardButton("بحث في النصوص", callback_data="menu_text_search")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         update.message.reply_text(f"مرحباً {user.first_name}", reply_markup=reply_markup)
         return MAIN_MENU
@@ -43,136 +47,182 @@ def subscription_phone(update: Update, context: CallbackContext):
     db.add_subscription(user.id, phone, 'Supervisor', "Supervisor", None,
                         user.username, user.first_name, user.last_name, update.effective_chat.id)
     keyboard = [[InlineKeyboardButton("عرض الكل", callback_data="menu_show_all"),
-                 InlineKeyboardButton("استعلام عن مشكلة", callback_data="menu_query_issue")]]
+                 InlineKeyboardButton("استعلام عن مشكلة", callback_data="menu_query_issue")],
+                [InlineKeyboardButton("بحث في النصوص", callback_data="menu_text_search")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     update.message.reply_text("تم الاشتراك بنجاح كـ Supervisor!", reply_markup=reply_markup)
     return MAIN_MENU
 
-def supervisor_main_menu_callback(update: Update, context: CallbackContext):
+# =============================================================================
+# Callback routes
+# =============================================================================
+def unknown_callback(update: Update, context: CallbackContext):
+    safe_edit_message(update.callback_query, text="الإجراء غير معروف.")
+    return MAIN_MENU
+
+routes = router.Router("supervisor", unknown=unknown_callback)
+
+SHOW_ALL_PAGE_SIZE = 50
+
+@routes.route("menu_show_all")
+def show_all_tickets(update: Update, context: CallbackContext):
     query = update.callback_query
-    query.answer()
-    data = query.data
-    if data == "menu_show_all":
-        tickets = db.get_all_open_tickets()
-        if tickets:
-            for ticket in tickets:
-                text = (f"<b>تذكرة #{ticket['ticket_id']}</b>\n"
-                        f"رقم الطلب: {ticket['order_id']}\n"
-                        f"العميل: {ticket['client']}\n"
-                        f"الوصف: {ticket['issue_description']}\n"
-                        f"الحالة: {ticket['status']}")
-                keyboard = [[InlineKeyboardButton("عرض التفاصيل", callback_data=f"view|{ticket['ticket_id']}")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                # If the ticket has an image, send it as a photo message
-                if ticket['image_url']:
-                    query.message.reply_photo(photo=ticket['image_url'])
-                safe_edit_message(query, text=text, reply_markup=reply_markup, parse_mode="HTML")
-        else:
-            safe_edit_message(query, text="لا توجد تذاكر مفتوحة حالياً.")
-        return MAIN_MENU
-    elif data == "menu_query_issue":
-        safe_edit_message(query, text="أدخل رقم الطلب:")
-        return SEARCH_TICKETS
-    elif data.startswith("view|"):
-        ticket_id = int(data.split("|")[1])
-        ticket = db.get_ticket(ticket_id)
-        if ticket:
-            try:
-                logs = ""
-                if ticket["logs"]:
-                    logs_list = json.loads(ticket["logs"])
-                    logs = "\n".join([f"{entry.get('timestamp', '')}: {entry.get('action', '')} - {entry.get('message', '')}"
-                                       for entry in logs_list])
-            except Exception:
-                logs = "لا توجد سجلات إضافية."
-            text = (f"<b>تفاصيل التذكرة #{ticket['ticket_id']}</b>\n"
+    # Read a page, then talk to Telegram, so no read stays open during the sends.
+    tickets = db.get_open_tickets(limit=SHOW_ALL_PAGE_SIZE)
+    if not tickets:
+        safe_edit_message(query, text="لا توجد تذاكر مفتوحة حالياً.")
+    while tickets:
+        for ticket in tickets:
+            text = (f"<b>تذكرة #{ticket['ticket_id']}</b>\n"
                     f"رقم الطلب: {ticket['order_id']}\n"
                     f"العميل: {ticket['client']}\n"
                     f"الوصف: {ticket['issue_description']}\n"
-                    f"سبب المشكلة: {ticket['issue_reason']}\n"
-                    f"نوع المشكلة: {ticket['issue_type']}\n"
-                    f"الحالة: {ticket['status']}\n\n"
-                    f"السجلات:\n{logs}")
-            keyboard = [
-                [InlineKeyboardButton("حل المشكلة", callback_data=f"solve|{ticket_id}")],
-                [InlineKeyboardButton("طلب المزيد من المعلومات", callback_data=f"moreinfo|{ticket_id}")],
-                [InlineKeyboardButton("إرسال إلى العميل", callback_data=f"sendclient|{ticket_id}")]
-            ]
-            if ticket["status"] == "Client Responded":
-                keyboard.insert(0, [InlineKeyboardButton("إرسال للحالة إلى الوكيل", callback_data=f"sendto_da|{ticket_id}")])
+                    f"الحالة: {ticket['status']}")
+            keyboard = [[InlineKeyboardButton("عرض التفاصيل", callback_data=f"view|{ticket['ticket_id']}")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            # If the original message was a photo message, edit its caption; otherwise, edit its text.
+            # If the ticket has an image, send it as a photo message
+            if ticket['image_url']:
+                photos.send_photo("supervisor", query.message.reply_photo, ticket['image_url'])
             safe_edit_message(query, text=text, reply_markup=reply_markup, parse_mode="HTML")
-        else:
-            safe_edit_message(query, text="التذكرة غير موجودة.")
-        return MAIN_MENU
-    elif data.startswith("solve|"):
-        ticket_id = int(data.split("|")[1])
-        context.user_data['ticket_id'] = ticket_id
-        context.user_data['action'] = 'solve'
-        context.user_data['awaiting_response'] = True
-        context.bot.send_message(chat_id=query.message.chat_id,
-                                 text="أدخل رسالة الحل للمشكلة:",
-                                 reply_markup=ForceReply(selective=True))
-        return AWAITING_RESPONSE
-    elif data.startswith("moreinfo|"):
-        ticket_id = int(data.split("|")[1])
-        context.user_data['ticket_id'] = ticket_id
-        context.user_data['action'] = 'moreinfo'
-        context.user_data['awaiting_response'] = True
-        context.bot.send_message(chat_id=query.message.chat_id,
-                                 text="أدخل المعلومات الإضافية المطلوبة:",
-                                 reply_markup=ForceReply(selective=True))
-        return AWAITING_RESPONSE
-    elif data.startswith("sendclient|"):
-        ticket_id = int(data.split("|")[1])
-        keyboard = [[InlineKeyboardButton("نعم", callback_data=f"confirm_sendclient|{ticket_id}"),
-                     InlineKeyboardButton("لا", callback_data=f"cancel_sendclient|{ticket_id}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        safe_edit_message(query, text="هل أنت متأكد من إرسال التذكرة إلى العميل؟", reply_markup=reply_markup)
-        return MAIN_MENU
-    elif data.startswith("confirm_sendclient|"):
-        ticket_id = int(data.split("|")[1])
-        send_to_client(ticket_id)
-        safe_edit_message(query, text="تم إرسال التذكرة إلى العميل.")
-        return MAIN_MENU
-    elif data.startswith("cancel_sendclient|"):
-        ticket_id = int(data.split("|")[1])
-        safe_edit_message(query, text="تم إلغاء الإرسال إلى العميل.")
+        if len(tickets) < SHOW_ALL_PAGE_SIZE:
+            break
+        tickets = db.get_open_tickets(after_ticket_id=tickets[-1]['ticket_id'], limit=SHOW_ALL_PAGE_SIZE)
+    return MAIN_MENU
+
+@routes.route("menu_query_issue")
+def ask_order_search(update: Update, context: CallbackContext):
+    safe_edit_message(update.callback_query, text="أدخل رقم الطلب:")
+    return SEARCH_TICKETS
+
+@routes.route("menu_text_search")
+def ask_text_search(update: Update, context: CallbackContext):
+    safe_edit_message(update.callback_query, text="أدخل نص البحث (الوصف، حل العميل، معلومات الوكيل):")
+    return SEARCH_TEXT
+
+@routes.route("text_search_page", int)
+def text_search_page(update: Update, context: CallbackContext, page):
+    query = update.callback_query
+    search_query = context.user_data.get('text_search_query')
+    if not search_query:
+        safe_edit_message(query, text="انتهت صلاحية البحث. أعد البحث مرة أخرى.")
         return MAIN_MENU
-    elif data.startswith("sendto_da|"):
-        ticket_id = int(data.split("|")[1])
-        keyboard = [[InlineKeyboardButton("نعم", callback_data=f"confirm_sendto_da|{ticket_id}"),
-                     InlineKeyboardButton("لا", callback_data=f"cancel_sendto_da|{ticket_id}")]]
+    text, reply_markup = render_text_search(search_query, page)
+    safe_edit_message(query, text=text, reply_markup=reply_markup, parse_mode="HTML")
+    return MAIN_MENU
+
+@routes.route("view", int)
+def view_ticket(update: Update, context: CallbackContext, ticket_id):
+    query = update.callback_query
+    ticket = db.get_ticket(ticket_id)
+    if ticket:
+        events = db.get_ticket_events(ticket_id)
+        if events:
+            logs = "\n".join([f"{entry['timestamp'] or ''}: {entry['action'] or ''} - {entry['message'] or ''}"
+                               for entry in events])
+        else:
+            logs = "لا توجد سجلات إضافية."
+        text = (f"<b>تفاصيل التذكرة #{ticket['ticket_id']}</b>\n"
+                f"رقم الطلب: {ticket['order_id']}\n"
+                f"العميل: {ticket['client']}\n"
+                f"الوصف: {ticket['issue_description']}\n"
+                f"سبب المشكلة: {ticket['issue_reason']}\n"
+                f"نوع المشكلة: {ticket['issue_type']}\n"
+                f"الحالة: {ticket['status']}\n\n"
+                f"السجلات:\n{logs}")
+        keyboard = [
+            [InlineKeyboardButton("حل المشكلة", callback_data=f"solve|{ticket_id}")],
+            [InlineKeyboardButton("طلب المزيد من المعلومات", callback_data=f"moreinfo|{ticket_id}")],
+            [InlineKeyboardButton("إرسال إلى العميل", callback_data=f"sendclient|{ticket_id}")]
+        ]
+        if ticket["status"] in db.TRANSITIONS["supervisor_forward"][0]:
+            keyboard.insert(0, [InlineKeyboardButton("إرسال للحالة إلى الوكيل", callback_data=f"sendto_da|{ticket_id}")])
         reply_markup = InlineKeyboardMarkup(keyboard)
-        safe_edit_message(query, text="هل أنت متأكد من إرسال الحل إلى الوكيل؟", reply_markup=reply_markup)
+        # If the original message was a photo message, edit its caption; otherwise, edit its text.
+        safe_edit_message(query, text=text, reply_markup=reply_markup, parse_mode="HTML")
+    else:
+        safe_edit_message(query, text="التذكرة غير موجودة.")
+    return MAIN_MENU
+
+RESPONSE_PROMPTS = {
+    "solve": "أدخل رسالة الحل للمشكلة:",
+    "moreinfo": "أدخل المعلومات الإضافية المطلوبة:",
+}
+
+@routes.route("solve", int)
+@routes.route("moreinfo", int)
+def ask_for_response(update: Update, context: CallbackContext, ticket_id):
+    query = update.callback_query
+    action = query.data.partition("|")[0]
+    context.user_data['ticket_id'] = ticket_id
+    context.user_data['action'] = action
+    context.user_data['awaiting_response'] = True
+    context.bot.send_message(chat_id=query.message.chat_id,
+                             text=RESPONSE_PROMPTS[action],
+                             reply_markup=ForceReply(selective=True))
+    return AWAITING_RESPONSE
+
+@routes.route("sendclient", int)
+def ask_send_to_client(update: Update, context: CallbackContext, ticket_id):
+    keyboard = [[InlineKeyboardButton("نعم", callback_data=f"confirm_sendclient|{ticket_id}"),
+                 InlineKeyboardButton("لا", callback_data=f"cancel_sendclient|{ticket_id}")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    safe_edit_message(update.callback_query, text="هل أنت متأكد من إرسال التذكرة إلى العميل؟",
+                      reply_markup=reply_markup)
+    return MAIN_MENU
+
+@routes.route("confirm_sendclient", int)
+def confirm_send_to_client(update: Update, context: CallbackContext, ticket_id):
+    query = update.callback_query
+    ticket = db.get_ticket(ticket_id)
+    if ticket is None:
+        safe_edit_message(query, text="التذكرة غير موجودة.")
         return MAIN_MENU
-    elif data.startswith("confirm_sendto_da|"):
-        ticket_id = int(data.split("|")[1])
-        ticket = db.get_ticket(ticket_id)
-        client_solution = None
-        if ticket["logs"]:
-            try:
-                logs = json.loads(ticket["logs"])
-                for log in logs:
-                    if log.get("action") == "client_solution":
-                        client_solution = log.get("message")
-                        break
-            except Exception:
-                client_solution = None
-        if not client_solution:
-            client_solution = "لا يوجد حل من العميل."
-        db.update_ticket_status(ticket_id, "Pending DA Action", {"action": "supervisor_forward", "message": client_solution})
-        notify_da(ticket_id, client_solution, info_request=False)
-        safe_edit_message(query, text="تم إرسال التذكرة إلى الوكيل.")
+    event_id = db.transition_ticket(ticket_id, "sent_to_client", actor=query.from_user.id,
+                                    notifications=client_notifications(ticket))
+    if not event_id:
+        safe_edit_message(query, text="لا يمكن إرسال التذكرة إلى العميل في حالتها الحالية.")
         return MAIN_MENU
-    elif data.startswith("cancel_sendto_da|"):
-        ticket_id = int(data.split("|")[1])
-        safe_edit_message(query, text="تم إلغاء إرسال التذكرة إلى الوكيل.")
+    safe_edit_message(query, text="تم إرسال التذكرة إلى العميل.")
+    return MAIN_MENU
+
+@routes.route("cancel_sendclient", int)
+def cancel_send_to_client(update: Update, context: CallbackContext, ticket_id):
+    safe_edit_message(update.callback_query, text="تم إلغاء الإرسال إلى العميل.")
+    return MAIN_MENU
+
+@routes.route("sendto_da", int)
+def ask_send_to_da(update: Update, context: CallbackContext, ticket_id):
+    keyboard = [[InlineKeyboardButton("نعم", callback_data=f"confirm_sendto_da|{ticket_id}"),
+                 InlineKeyboardButton("لا", callback_data=f"cancel_sendto_da|{ticket_id}")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    safe_edit_message(update.callback_query, text="هل أنت متأكد من إرسال الحل إلى الوكيل؟",
+                      reply_markup=reply_markup)
+    return MAIN_MENU
+
+@routes.route("confirm_sendto_da", int)
+def confirm_send_to_da(update: Update, context: CallbackContext, ticket_id):
+    query = update.callback_query
+    ticket = db.get_ticket(ticket_id)
+    if ticket is None:
+        safe_edit_message(query, text="التذكرة غير موجودة.")
         return MAIN_MENU
-    else:
-        safe_edit_message(query, text="الإجراء غير معروف.")
+    client_solution = ticket['latest_client_solution']
+    if not client_solution:
+        client_solution = "لا يوجد حل من العميل."
+    event_id = db.transition_ticket(ticket_id, "supervisor_forward", actor=query.from_user.id,
+                                    message=client_solution,
+                                    notifications=da_notifications(ticket, "supervisor_forward",
+                                                                   client_solution))
+    if not event_id:
+        safe_edit_message(query, text="تمت معالجة التذكرة بالفعل ولا يمكن إرسالها إلى الوكيل.")
         return MAIN_MENU
+    safe_edit_message(query, text="تم إرسال التذكرة إلى الوكيل.")
+    return MAIN_MENU
+
+@routes.route("cancel_sendto_da", int)
+def cancel_send_to_da(update: Update, context: CallbackContext, ticket_id):
+    safe_edit_message(update.callback_query, text="تم إلغاء إرسال التذكرة إلى الوكيل.")
+    return MAIN_MENU
 
 def search_tickets(update: Update, context: CallbackContext):
     query_text = update.message.text.strip()
@@ -190,11 +240,50 @@ def search_tickets(update: Update, context: CallbackContext):
     else:
         update.message.reply_text("لم يتم العثور على تذاكر مطابقة.")
     keyboard = [[InlineKeyboardButton("عرض الكل", callback_data="menu_show_all"),
-                 InlineKeyboardButton("استعلام عن مشكلة", callback_data="menu_query_issue")]]
+                 InlineKeyboardButton("استعلام عن مشكلة", callback_data="menu_query_issue")],
+                [InlineKeyboardButton("بحث في النصوص", callback_data="menu_text_search")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     update.message.reply_text("اختر خياراً:", reply_markup=reply_markup)
     return MAIN_MENU
 
+TEXT_SEARCH_SOURCES = {
+    "description": "الوصف",
+    "client_solution": "حل العميل",
+    "da_moreinfo": "معلومات الوكيل",
+    "supervisor_solution": "حل المشرف",
+    "request_more_info": "طلب معلومات",
+    "supervisor_forward": "تحويل للوكيل",
+}
+
+def render_text_search(search_query, page):
+    """Build the text and keyboard for one page of full-text search results."""
+    hits, has_next = db.search_ticket_text(search_query, page=page)
+    if not hits:
+        return "لم يتم العثور على نتائج مطابقة.", None
+    lines = [f"<b>نتائج البحث (صفحة {page})</b>"]
+    keyboard = []
+    for hit in hits:
+        source = TEXT_SEARCH_SOURCES.get(hit['source'], hit['source'])
+        lines.append(f"\n<b>تذكرة #{hit['ticket_id']}</b> ({source}) - {hit['status']}\n"
+                     f"{db.render_snippet(hit['snippet'])}")
+        keyboard.append([InlineKeyboardButton(f"عرض التذكرة #{hit['ticket_id']}",
+                                              callback_data=f"view|{hit['ticket_id']}")])
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton("السابق", callback_data=f"text_search_page|{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("التالي", callback_data=f"text_search_page|{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+def search_text(update: Update, context: CallbackContext):
+    search_query = update.message.text.strip()
+    context.user_data['text_search_query'] = search_query
+    text, reply_markup = render_text_search(search_query, 1)
+    update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    return MAIN_MENU
+
 def awaiting_response_handler(update: Update, context: CallbackContext):
     response = update.message.text.strip()
     ticket_id = context.user_data.get('ticket_id')
@@ -202,101 +291,133 @@ def awaiting_response_handler(update: Update, context: CallbackContext):
     if not ticket_id or not action:
         update.message.reply_text("حدث خطأ. أعد المحاولة.")
         return MAIN_MENU
-    if action == 'solve':
-        db.update_ticket_status(ticket_id, "Pending DA Action", {"action": "supervisor_solution", "message": response})
-        notify_da(ticket_id, response, info_request=False)
+    transition = "supervisor_solution" if action == 'solve' else "request_more_info"
+    ticket = db.get_ticket(ticket_id)
+    if ticket is None:
+        update.message.reply_text("التذكرة غير موجودة.")
+        context.user_data.pop('ticket_id', None)
+        context.user_data.pop('action', None)
+        return MAIN_MENU
+    event_id = db.transition_ticket(ticket_id, transition, actor=update.effective_user.id,
+                                    message=response,
+                                    notifications=da_notifications(ticket, transition, response))
+    if not event_id:
+        update.message.reply_text("التذكرة مغلقة ولا يمكن تعديلها.")
+    elif action == 'solve':
         update.message.reply_text("تم إرسال الحل إلى الوكيل.")
     elif action == 'moreinfo':
-        db.update_ticket_status(ticket_id, "Pending DA Response", {"action": "request_more_info", "message": response})
-        notify_da(ticket_id, response, info_request=True)
         update.message.reply_text("تم إرسال الطلب إلى الوكيل.")
     context.user_data.pop('ticket_id', None)
     context.user_data.pop('action', None)
     return MAIN_MENU
 
-def notify_da(ticket_id, message, info_request=False):
-    ticket = db.get_ticket(ticket_id)
+def da_notifications(ticket, transition, message):
+    """Notifications telling the ticket's DA about `transition` (a solution or a request for more info)."""
+    ticket_id = ticket['ticket_id']
     da_id = ticket['da_id']
     if not da_id:
         logger.error("لا يوجد وكيل معين للتذكرة.")
-        return
-    bot = Bot(token=config.DA_BOT_TOKEN)
-    if info_request:
+        return None
+    status = db.TRANSITIONS[transition][1]
+    if transition == "request_more_info":
         text = (f"<b>طلب معلومات إضافية للتذكرة #{ticket_id}</b>\n"
                 f"رقم الطلب: {ticket['order_id']}\n"
                 f"الوصف: {ticket['issue_description']}\n"
-                f"الحالة: {ticket['status']}\n"
+                f"الحالة: {status}\n"
                 f"المعلومات المطلوبة: {message}")
         keyboard = [[InlineKeyboardButton("تطبيق المعلومات الإضافية", callback_data=f"da_moreinfo|{ticket_id}")]]
     else:
         text = (f"<b>حل للمشكلة للتذكرة #{ticket_id}</b>\n"
                 f"رقم الطلب: {ticket['order_id']}\n"
                 f"الوصف: {ticket['issue_description']}\n"
-                f"الحالة: {ticket['status']}\n"
+                f"الحالة: {status}\n"
                 f"الحل: {message}")
         keyboard = [[InlineKeyboardButton("إغلاق التذكرة", callback_data=f"close|{ticket_id}")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    try:
-        da_sub = db.get_subscription(da_id, "DA")
-        if da_sub:
-            if ticket['image_url']:
-                bot.send_photo(chat_id=da_sub['chat_id'], photo=ticket['image_url'],
-                               caption=text, reply_markup=reply_markup, parse_mode="HTML")
-            else:
-                bot.send_message(chat_id=da_sub['chat_id'], text=text,
-                                 reply_markup=reply_markup, parse_mode="HTML")
-    except Exception as e:
-        logger.error(f"Error notifying DA: {e}")
-
-def send_to_client(ticket_id):
-    ticket = db.get_ticket(ticket_id)
+    da_sub = db.get_subscription(da_id, "DA")
+    if not da_sub:
+        return None
+    return {"outbox": outbox.messages("da", [da_sub['chat_id']], text, photo=ticket['image_url'],
+                                      key=f"event:{db.EVENT_ID}", reply_markup=reply_markup, parse_mode="HTML")}
+
+def client_notifications(ticket):
+    """Notifications sending `ticket` to its client's users (the sent_to_client transition)."""
     client_name = ticket['client']
     clients = db.get_clients_by_name(client_name)
-    bot = Bot(token=config.CLIENT_BOT_TOKEN)
     message = (f"<b>تذكرة من المشرف</b>\n"
                f"تذكرة #{ticket['ticket_id']}\n"
                f"رقم الطلب: {ticket['order_id']}\n"
                f"الوصف: {ticket['issue_description']}\n"
-               f"الحالة: {ticket['status']}")
+               f"الحالة: {db.TRANSITIONS['sent_to_client'][1]}")
     keyboard = [
         [InlineKeyboardButton("حالياً", callback_data=f"notify_pref|{ticket['ticket_id']}|now")],
         [InlineKeyboardButton("خلال 15 دقيقة", callback_data=f"notify_pref|{ticket['ticket_id']}|15")],
         [InlineKeyboardButton("خلال 10 دقائق", callback_data=f"notify_pref|{ticket['ticket_id']}|10")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    for client in clients:
-        try:
-            if ticket['image_url']:
-                bot.send_photo(chat_id=client['chat_id'], photo=ticket['image_url'],
-                               caption=message, reply_markup=reply_markup, parse_mode="HTML")
-            else:
-                bot.send_message(chat_id=client['chat_id'], text=message,
-                                 reply_markup=reply_markup, parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Error notifying client {client['chat_id']}: {e}")
+    return {"outbox": outbox.messages("client", [client['chat_id'] for client in clients], message,
+                                      photo=ticket['image_url'], key=f"event:{db.EVENT_ID}",
+                                      reply_markup=reply_markup, parse_mode="HTML")}
+
+def digest_command(update: Update, context: CallbackContext):
+    sub = db.get_subscription(update.effective_user.id, "Supervisor")
+    if not sub:
+        update.message.reply_text("يرجى الاشتراك أولاً باستخدام /start.")
+        return
+    current = digest.window_minutes(sub)
+    keyboard = [[InlineKeyboardButton(("✓ " if minutes == current else "") +
+                                      ("فوري" if minutes == 0 else f"ملخص كل {minutes} دقيقة"),
+                                      callback_data=f"digest_set|{minutes}")]
+                for minutes in digest.DIGEST_CHOICES]
+    update.message.reply_text("اختر طريقة استلام الإشعارات:", reply_markup=InlineKeyboardMarkup(keyboard))
+
+@routes.route("digest_set", int)
+def set_digest(update: Update, context: CallbackContext, minutes):
+    query = update.callback_query
+    db.set_digest_minutes(query.from_user.id, minutes)
+    safe_edit_message(query, text="سيتم إرسال الإشعارات فوراً." if minutes == 0
+                      else f"سيتم إرسال ملخص بالإشعارات كل {minutes} دقيقة، والعاجلة فوراً.")
+
+@routes.route("digest_page", int, int)
+def digest_page(update: Update, context: CallbackContext, digest_id, page):
+    query = update.callback_query
+    sent = db.get_digest(digest_id)
+    if not sent or sent["chat_id"] != query.message.chat_id:
+        safe_edit_message(query, text="لم يعد هذا الملخص متاحاً.")
+        return
+    text, reply_markup = digest.render(sent["digest_id"], sent["items"], page)
+    safe_edit_message(query, text=text, reply_markup=reply_markup)
 
 def default_handler_supervisor(update: Update, context: CallbackContext):
     keyboard = [[InlineKeyboardButton("عرض الكل", callback_data="menu_show_all"),
-                 InlineKeyboardButton("استعلام عن مشكلة", callback_data="menu_query_issue")]]
+                 InlineKeyboardButton("استعلام عن مشكلة", callback_data="menu_query_issue")],
+                [InlineKeyboardButton("بحث في النصوص", callback_data="menu_text_search")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     update.message.reply_text("الرجاء اختيار خيار:", reply_markup=reply_markup)
     return MAIN_MENU
 
 def main():
-    updater = Updater(config.SUPERVISOR_BOT_TOKEN, use_context=True)
+    updater = Updater(bot=bots.get("supervisor"), use_context=True)
+    updater.job_queue.run_repeating(bots.log_stats, interval=bots.BOT_STATS_INTERVAL, first=bots.BOT_STATS_INTERVAL)
+    updater.job_queue.run_repeating(digest.flush_due, interval=digest.DIGEST_FLUSH_INTERVAL)
+    updater.job_queue.run_repeating(router.log_stats, interval=router.ROUTER_STATS_INTERVAL, first=router.ROUTER_STATS_INTERVAL)
     dp = updater.dispatcher
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
             SUBSCRIPTION_PHONE: [MessageHandler(Filters.text & ~Filters.command, subscription_phone)],
-            MAIN_MENU: [CallbackQueryHandler(supervisor_main_menu_callback,
-                                             pattern="^(menu_show_all|menu_query_issue|view\\|.*|solve\\|.*|moreinfo\\|.*|sendclient\\|.*|sendto_da\\|.*|confirm_sendclient\\|.*|cancel_sendclient\\|.*|confirm_sendto_da\\|.*|cancel_sendto_da\\|.*)")],
+            MAIN_MENU: [routes.handler("menu_show_all", "menu_query_issue", "menu_text_search", "text_search_page",
+                                       "view", "solve", "moreinfo", "sendclient", "sendto_da", "confirm_sendclient",
+                                       "cancel_sendclient", "confirm_sendto_da", "cancel_sendto_da")],
             SEARCH_TICKETS: [MessageHandler(Filters.text & ~Filters.command, search_tickets)],
+            SEARCH_TEXT: [MessageHandler(Filters.text & ~Filters.command, search_text)],
             AWAITING_RESPONSE: [MessageHandler(Filters.text & ~Filters.command, awaiting_response_handler)]
         },
         fallbacks=[CommandHandler('cancel', lambda u, c: u.message.reply_text("تم إلغاء العملية."))]
     )
     dp.add_handler(conv_handler)
+    dp.add_handler(CommandHandler('digest', digest_command))
+    dp.add_handler(routes.handler("digest_set", "digest_page"))
     dp.add_handler(MessageHandler(Filters.text, default_handler_supervisor))
     updater.start_polling()
     updater.idle()
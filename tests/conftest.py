@@ -0,0 +1,18 @@
+# tests/conftest.py
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Point db.py at throwaway main/archive files; yields the main file's path."""
+    path = str(tmp_path / "issue_resolution.db")
+    monkeypatch.setattr(db, "DATABASE", path)
+    monkeypatch.setattr(db, "ARCHIVE_DATABASE", str(tmp_path / "issue_resolution_archive.db"))
+    db.close_connection()
+    yield path
+    db.close_connection()
@@ -0,0 +1,40 @@
+# tests/test_cache.py
+import os
+import time
+import pytest
+import cache
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = cache.LRUCache(2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.pop("a") == 1
+    assert len(lru) == 1
+
+def test_lru_cache_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    lru = cache.LRUCache(10, ttl=5)
+    lru.put("a", None)
+    assert lru.get("a", "missing") is None
+    now[0] += 6
+    assert lru.get("a", "missing") == "missing"
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_per_process_recreates_after_fork():
+    holder = cache.PerProcess(object)
+    parent = holder.get()
+    assert holder.get() is parent
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        child_ok = holder.peek() is None and holder.get() is not parent and holder.get() is holder.get()
+        os.write(write_end, b"1" if child_ok else b"0")
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read_end, 1) == b"1"
+    assert holder.get() is parent
@@ -0,0 +1,77 @@
+# tests/test_db_notifications.py
+#
+# Ticket changes and the notifications announcing them are one write
+# operation, so single-writer forwarding ships them as one call.
+import json
+import pytest
+import db
+
+def _outbox_row(chat_id, text):
+    return {"idempotency_key": f"event:{db.EVENT_ID}:da:{chat_id}", "bot": "da", "chat_id": chat_id,
+            "method": "send_message",
+            "payload": json.dumps({"text": text, "callback": f"view|{db.TICKET_ID}"}, ensure_ascii=False)}
+
+def _outbox(conn):
+    return [dict(row) for row in conn.execute("SELECT idempotency_key, chat_id, payload FROM outbox ORDER BY message_id")]
+
+@pytest.fixture
+def fresh_db(database):
+    db.init_db()
+    return db.get_connection()
+
+def test_create_ticket_fills_ticket_id(fresh_db):
+    item = {"idempotency_key": f"ticket_created:{db.TICKET_ID}:5", "chat_id": 5, "ticket_id": db.TICKET_ID,
+            "kind": "ticket_created", "summary": f"#{db.TICKET_ID} new", "due_at": 0}
+    ticket = db.create_ticket("ORD1", "desc", "r", "t", "c", None, "Opened", 7,
+                              notifications={"digest": [item]})
+    ticket_id = ticket["ticket_id"]
+    row = dict(fresh_db.execute("SELECT ticket_id, summary, idempotency_key FROM digest_items").fetchone())
+    assert row == {"ticket_id": ticket_id, "summary": f"#{ticket_id} new",
+                   "idempotency_key": f"ticket_created:{ticket_id}:5"}
+
+def test_transition_queues_notifications_only_when_it_moves(fresh_db):
+    ticket_id = db.create_ticket("ORD1", "desc", "r", "t", "c", None, "Opened", 7)["ticket_id"]
+    notifications = {"outbox": [_outbox_row(9, "closed")]}
+
+    event_id = db.transition_ticket(ticket_id, "da_closed", actor=7, notifications=notifications)
+    assert event_id
+    assert not db.transition_ticket(ticket_id, "da_closed", actor=7, notifications=notifications)
+
+    rows = _outbox(fresh_db)
+    assert len(rows) == 1
+    assert rows[0]["idempotency_key"] == f"event:{event_id}:da:9"
+    assert json.loads(rows[0]["payload"])["callback"] == f"view|{ticket_id}"
+
+def test_transition_with_notifications_is_forwarded_as_one_call(fresh_db):
+    ticket_id = db.create_ticket("ORD1", "desc", "r", "t", "c", None, "Opened", 7)["ticket_id"]
+    calls = []
+
+    def forwarder(name, args, kwargs):
+        calls.append(name)
+        return db.WRITE_OPERATIONS[name](*args, **kwargs)
+
+    db.set_write_forwarder(forwarder)
+    try:
+        db.transition_ticket(ticket_id, "da_closed", actor=7, notifications={"outbox": [_outbox_row(9, "x")]})
+    finally:
+        db.set_write_forwarder(None)
+    assert calls == ["transition_ticket"]
+    assert len(_outbox(fresh_db)) == 1
+
+def test_take_digest_writes_digest_and_message_together(fresh_db):
+    db.create_ticket("ORD1", "desc", "r", "t", "c", None, "Opened", 7,
+                     notifications={"digest": [{"chat_id": 5, "ticket_id": db.TICKET_ID, "kind": "ticket_created",
+                                                "summary": "new", "due_at": 0}]})
+    items = db.get_digest_items(5)
+    message = {"idempotency_key": f"digest:{db.DIGEST_ID}", "bot": "supervisor", "chat_id": 5,
+               "method": "send_message", "payload": f"digest_page|{db.DIGEST_ID}|1"}
+
+    digest_id = db.take_digest(5, [item["item_id"] for item in items], {"outbox": [message]})
+    assert digest_id
+    assert db.get_digest(digest_id)["items"] == [{"ticket_id": items[0]["ticket_id"], "kind": "ticket_created",
+                                                   "summary": "new"}]
+    assert _outbox(fresh_db) == [{"idempotency_key": f"digest:{digest_id}", "chat_id": 5,
+                                  "payload": f"digest_page|{digest_id}|1"}]
+    # A second flush working from the same read finds the items gone and writes nothing.
+    assert db.take_digest(5, [item["item_id"] for item in items], {"outbox": [message]}) is None
+    assert len(_outbox(fresh_db)) == 1
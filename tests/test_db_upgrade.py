@@ -0,0 +1,81 @@
+# tests/test_db_upgrade.py
+#
+# init_db() on a database created by the first release of the bots: only
+# subscriptions and tickets, history kept as JSON in tickets.logs.
+import json
+import sqlite3
+import db
+
+BASELINE_SCHEMA = """
+    CREATE TABLE subscriptions (
+        user_id INTEGER,
+        phone TEXT,
+        role TEXT,
+        bot TEXT,
+        client TEXT,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        chat_id INTEGER,
+        PRIMARY KEY (user_id, bot)
+    );
+    CREATE TABLE tickets (
+        ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id TEXT,
+        issue_description TEXT,
+        issue_reason TEXT,
+        issue_type TEXT,
+        client TEXT,
+        image_url TEXT,
+        status TEXT,
+        da_id INTEGER,
+        logs TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+def _create_baseline(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    open_logs = [{"action": "create", "user": 7, "timestamp": "2024-11-05T09:00:00"}]
+    closed_logs = open_logs + [
+        {"action": "client_solution", "user": 9, "message": "أعد الإرسال", "timestamp": "2024-11-05T10:00:00"},
+        {"action": "da_closed", "user": 7, "timestamp": "2024-11-05T11:00:00"},
+    ]
+    conn.executemany("""
+        INSERT INTO tickets (order_id, issue_description, issue_reason, issue_type, client, image_url, status, da_id, logs)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        ("ORD1", "الطلب ناقص", "المخزن", "نقص", "بيبس", None, "Opened", 7, json.dumps(open_logs)),
+        ("ORD2", "الطلب تالف", "المخزن", "تالف", "بيبس", None, "Closed", 7, json.dumps(closed_logs)),
+    ])
+    conn.commit()
+    conn.close()
+
+def test_init_db_upgrades_baseline_database(database):
+    _create_baseline(database)
+
+    db.init_db()
+
+    conn = db.get_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+    assert [t["order_id"] for t in db.get_all_tickets()] == ["ORD1", "ORD2"]
+
+    closed = db.get_ticket(2)
+    assert closed["latest_client_solution"] == "أعد الإرسال"
+    assert closed["resolved_at"] is not None
+    assert [e["action"] for e in db.get_ticket_events(2)] == ["create", "client_solution", "da_closed"]
+
+    assert db.get_ticket_stats("status") == {"Opened": 1, "Closed": 1}
+    assert db.get_ticket_stats("da_open") == {"7": 1}
+    assert sum(closed for _, _, closed in db.get_daily_ticket_stats(days=100000)) == 1
+
+def test_init_db_is_idempotent_after_upgrade(database):
+    _create_baseline(database)
+    db.init_db()
+    db.close_connection()
+
+    db.init_db()
+
+    assert len(db.get_all_tickets()) == 2
+    assert db.get_ticket_stats("type") == {"نقص": 1, "تالف": 1}
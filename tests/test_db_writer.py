@@ -0,0 +1,51 @@
+# tests/test_db_writer.py
+import queue
+import db
+import db_writer
+
+class FakeConnection:
+    """Hands out `incoming` requests, then reports the bot as gone; collects replies."""
+
+    def __init__(self, incoming=()):
+        self.incoming = list(incoming)
+        self.sent = []
+
+    def recv(self):
+        if not self.incoming:
+            raise EOFError
+        return self.incoming.pop(0)
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def close(self):
+        pass
+
+def _request(conn, request_id, name, *args, **kwargs):
+    return db_writer._Request(db_writer._Channel(conn), request_id, name, args, kwargs)
+
+def test_standalone_operations_bypass_the_batch_queue():
+    conn = FakeConnection([(1, "add_subscription", (), {}), (2, "archive_closed_tickets", (30,), {}),
+                           (3, "maintain_database", (), {})])
+    requests, standalone = queue.Queue(), queue.Queue()
+    db_writer._read_requests(db_writer._Channel(conn), requests, standalone)
+    assert [r.name for r in requests.queue] == ["add_subscription"]
+    assert [r.name for r in standalone.queue] == ["archive_closed_tickets", "maintain_database"]
+
+def test_standalone_operations_commit_on_their_own(database):
+    db.init_db()
+    for i in range(3):
+        ticket_id = db.create_ticket(f"ORD{i}", "d", "r", "t", "c", None, "Opened", 7)["ticket_id"]
+        db.transition_ticket(ticket_id, "da_closed", actor=7)
+    db.get_connection().execute("UPDATE tickets SET created_at = datetime('now', '-60 days')")
+    conn = FakeConnection()
+    commits = []
+    db.get_connection().set_trace_callback(lambda sql: sql == "COMMIT" and commits.append(sql))
+
+    db_writer._execute_standalone(_request(conn, 1, "archive_closed_tickets", 30, batch_size=1))
+    # VACUUM fails inside a transaction, so this only passes outside a batch.
+    db_writer._execute_standalone(_request(conn, 2, "maintain_database"))
+
+    db.get_connection().set_trace_callback(None)
+    assert conn.sent == [(1, True, 3), (2, True, None)]
+    assert len(commits) == 4  # one per archived batch, plus the final empty check
@@ -0,0 +1,133 @@
+# tests/test_orders.py
+#
+# OrdersClient against a stub locus_info server on localhost.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import orders
+
+ORDERS = [{"order_id": "ORD1", "client_name": "بيبس"}]
+
+class StubOrdersAPI:
+    """Answers GET with `body` after `delay` seconds and counts the requests."""
+
+    def __init__(self):
+        self.status = 200
+        self.body = {"data": ORDERS}
+        self.delay = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def serve(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with api.lock:
+                    api.requests += 1
+                time.sleep(api.delay)
+                data = json.dumps(api.body, ensure_ascii=False).encode()
+                self.send_response(api.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                pass  # a timed-out client hangs up before the answer is written
+
+        server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        return server
+
+@pytest.fixture
+def api():
+    stub = StubOrdersAPI()
+    server = stub.serve()
+    stub.url = f"http://127.0.0.1:{server.server_port}/dev/locus_info"
+    yield stub
+    server.shutdown()
+    server.server_close()
+
+def make_client(api, failures=2, reset=0.2, cache_ttl=60):
+    return orders.OrdersClient(base_url=api.url, cache_ttl=cache_ttl,
+                               breaker=orders.CircuitBreaker(failure_threshold=failures, reset_timeout=reset))
+
+def test_answers_are_cached(api):
+    client = make_client(api)
+    assert client.get_orders("0500", "2024-11-05") == ORDERS
+    assert client.get_orders("0500", "2024-11-05") == ORDERS
+    assert api.requests == 1
+    client.get_orders("0500", "2024-11-06")
+    assert api.requests == 2
+
+def test_slow_answer_times_out(api, monkeypatch):
+    monkeypatch.setattr(orders, "ORDERS_READ_TIMEOUT", 0.2)
+    api.delay = 1
+    client = make_client(api)
+    start = time.monotonic()
+    with pytest.raises(orders.OrdersUnavailable):
+        client.get_orders("0500", "2024-11-05")
+    assert time.monotonic() - start < 1
+    assert api.requests == 1  # a slow read is not retried
+
+@pytest.mark.parametrize("status, body", [(500, {"message": "boom"}), (200, ["not", "an", "object"])])
+def test_bad_answer_is_unavailable(api, status, body):
+    api.status, api.body = status, body
+    with pytest.raises(orders.OrdersUnavailable):
+        make_client(api).get_orders("0500", "2024-11-05")
+
+def test_breaker_opens_then_probes(api):
+    api.status = 500
+    client = make_client(api, failures=2, reset=0.2)
+    for _ in range(2):
+        with pytest.raises(orders.OrdersUnavailable):
+            client.get_orders("0500", "2024-11-05")
+    assert api.requests == 2
+
+    # Open: fails without a request.
+    with pytest.raises(orders.OrdersUnavailable, match="temporarily disabled"):
+        client.get_orders("0500", "2024-11-05")
+    assert api.requests == 2
+
+    # After the reset timeout one failing probe reopens the breaker at once.
+    time.sleep(0.25)
+    with pytest.raises(orders.OrdersUnavailable):
+        client.get_orders("0500", "2024-11-05")
+    assert api.requests == 3
+    with pytest.raises(orders.OrdersUnavailable, match="temporarily disabled"):
+        client.get_orders("0500", "2024-11-05")
+
+    # A successful probe closes it again.
+    time.sleep(0.25)
+    api.status, api.body = 200, {"data": ORDERS}
+    assert client.get_orders("0500", "2024-11-05") == ORDERS
+    assert client.get_orders("0500", "2024-11-06") == ORDERS
+    assert api.requests == 5
+
+def test_unexpected_error_releases_the_probe(api, monkeypatch):
+    api.status = 500
+    client = make_client(api, failures=1, reset=0.2)
+    with pytest.raises(orders.OrdersUnavailable):
+        client.get_orders("0500", "2024-11-05")
+
+    time.sleep(0.25)
+    def broken_get(*args, **kwargs):
+        raise RuntimeError("bug in the transport")
+    monkeypatch.setattr(client.session, "get", broken_get)
+    with pytest.raises(RuntimeError):
+        client.get_orders("0500", "2024-11-05")
+
+    # The failed probe reopened the breaker; the next one is admitted again.
+    monkeypatch.undo()
+    time.sleep(0.25)
+    api.status, api.body = 200, {"data": ORDERS}
+    assert client.get_orders("0500", "2024-11-05") == ORDERS
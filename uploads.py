@@ -0,0 +1,94 @@
+# uploads.py
+#
+# Ticket photos sent to the DA bot, uploaded to Cloudinary in the background:
+#
+#   upload = uploads.start(update.message.photo)   # returns immediately (a Future)
+#   upload.add_done_callback(on_uploaded)          # or: uploads.result(upload),
+#                                                  # which waits; None on failure
+#
+# start() picks the smallest PhotoSize that still covers UPLOAD_MAX_SIDE
+# pixels (Telegram sends several), and a worker downloads it into a single
+# buffer that is handed to Cloudinary as is. With Pillow installed, images
+# larger than UPLOAD_MAX_SIDE are downscaled and re-encoded as JPEG first.
+# The Telegram file_id is remembered for the Cloudinary URL (see photos.py),
+# so the DA bot never has to send that image by URL.
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from io import BytesIO
+import cloudinary
+import cloudinary.uploader
+import cache
+import config
+import photos
+
+try:
+    from PIL import Image
+except ImportError:  # optional dependency
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Configure Cloudinary using credentials from config.py
+cloudinary.config(
+    cloud_name = config.CLOUDINARY_CLOUD_NAME,
+    api_key = config.CLOUDINARY_API_KEY,
+    api_secret = config.CLOUDINARY_API_SECRET
+)
+
+UPLOAD_WORKERS = 4
+UPLOAD_MAX_SIDE = 1280       # pixels on the longer side
+UPLOAD_JPEG_QUALITY = 85
+UPLOAD_TIMEOUT = 60          # seconds result() waits for an upload
+
+def choose_size(sizes, max_side=UPLOAD_MAX_SIDE):
+    """The smallest PhotoSize covering `max_side` on its longer side, else the largest one."""
+    sizes = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in sizes:
+        if max(size.width, size.height) >= max_side:
+            return size
+    return sizes[-1]
+
+def shrink(data, max_side=UPLOAD_MAX_SIDE):
+    """`data` (bytes or bytearray) downscaled to `max_side` and re-encoded as JPEG, or unchanged without Pillow or when already small."""
+    if Image is None:
+        return data
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if max(image.size) <= max_side:
+                return data
+            image.thumbnail((max_side, max_side))
+            out = BytesIO()
+            image.convert("RGB").save(out, "JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("uploads: could not re-encode photo, uploading original: %s", e)
+        return data
+    return out.getvalue() if out.tell() < len(data) else data
+
+def _upload(size, file_id):
+    data = shrink(size.get_file().download_as_bytearray())
+    result = cloudinary.uploader.upload(data, timeout=UPLOAD_TIMEOUT)
+    url = result.get('secure_url')
+    if not url:
+        raise ValueError(f"Cloudinary returned no secure_url: {result}")
+    try:
+        photos.remember("da", {url: file_id})
+    except Exception as e:
+        logger.warning("uploads: could not remember file_id for %s: %s", url, e)
+    return url
+
+_executor = cache.PerProcess(lambda: ThreadPoolExecutor(max_workers=UPLOAD_WORKERS,
+                                                        thread_name_prefix="uploads"))
+
+def start(photo_sizes):
+    """Start uploading the photo given as its PhotoSizes; returns a handle for result()."""
+    return _executor.get().submit(_upload, choose_size(photo_sizes), photo_sizes[-1].file_id)
+
+def result(upload, timeout=UPLOAD_TIMEOUT):
+    """The Cloudinary URL of a started upload, or None if it failed or timed out."""
+    try:
+        return upload.result(timeout=timeout)
+    except TimeoutError:
+        logger.error("uploads: photo upload still running after %ss", timeout)
+    except Exception as e:
+        logger.error(f"Error uploading image: {e}")
+    return None
@@ -1,7 +1,7 @@
 # webapp.py
-from flask import Flask, render_template_string, request
+from flask import Flask, redirect, render_template_string, request, url_for
+from markupsafe import Markup
 import db
-import json
 
 app = Flask(__name__)
 
@@ -140,6 +140,23 @@ TICKETS_TEMPLATE = COMMON_STYLE + """
 <!doctype html>
 <title>Tickets</title>
 <h1>Tickets</h1>
+<form class="filters" method="get" action="/tickets">
+  <select name="status">
+    <option value="">All statuses</option>
+    {% for s in statuses %}
+    <option value="{{ s }}" {% if filters.status == s %}selected{% endif %}>{{ s }}</option>
+    {% endfor %}
+  </select>
+  <input name="client" placeholder="Client" value="{{ filters.client or '' }}">
+  <input name="da_id" placeholder="DA ID" value="{{ filters.da_id if filters.da_id is not none else '' }}">
+  <input type="date" name="date_from" value="{{ filters.date_from or '' }}">
+  <input type="date" name="date_to" value="{{ filters.date_to or '' }}">
+  <select name="order">
+    <option value="desc" {% if filters.order == 'desc' %}selected{% endif %}>Newest first</option>
+    <option value="asc" {% if filters.order == 'asc' %}selected{% endif %}>Oldest first</option>
+  </select>
+  <button class="button" type="submit">Filter</button>
+</form>
 <table>
   <tr>
     <th>ID</th>
@@ -179,7 +196,30 @@ TICKETS_TEMPLATE = COMMON_STYLE + """
   </tr>
   {% endfor %}
 </table>
+<div class="pager">
+  {% if prev_cursor %}<a class="button" href="{{ url_for('tickets', cursor=prev_cursor, dir='prev', **filters) }}">&laquo; Previous</a>{% endif %}
+  {% if next_cursor %}<a class="button" href="{{ url_for('tickets', cursor=next_cursor, dir='next', **filters) }}">Next &raquo;</a>{% endif %}
+</div>
 <a class="button" href="/">Back to Home</a>
+<style>
+.filters {
+    display: flex;
+    gap: 0.5rem;
+    flex-wrap: wrap;
+    align-items: center;
+}
+
+.filters input, .filters select {
+    padding: 6px 8px;
+    border: 1px solid #e0e0e0;
+    border-radius: 4px;
+}
+
+.pager {
+    display: flex;
+    gap: 1rem;
+}
+</style>
 """
 
 SUBSCRIPTIONS_TEMPLATE = COMMON_STYLE + """
@@ -215,6 +255,126 @@ SUBSCRIPTIONS_TEMPLATE = COMMON_STYLE + """
 <a class="button" href="/">Back to Home</a>
 """
 
+SEARCH_TEMPLATE = COMMON_STYLE + """
+<!doctype html>
+<title>Search</title>
+<h1>Search Tickets</h1>
+<form method="get" action="/search">
+  <input name="q" value="{{ q }}" placeholder="ابحث في الوصف والسجلات" dir="auto">
+  <button class="button" type="submit">Search</button>
+</form>
+{% if q %}
+<table>
+  <tr>
+    <th>Ticket</th>
+    <th>Order ID</th>
+    <th>Status</th>
+    <th>Source</th>
+    <th>Match</th>
+  </tr>
+  {% for h in hits %}
+  <tr>
+    <td><a href="/ticket/{{ h['ticket_id'] }}/activity">#{{ h['ticket_id'] }}</a></td>
+    <td>{{ h['order_id'] }}</td>
+    <td>{{ h['status'] }}</td>
+    <td>{{ h['source'] }}</td>
+    <td dir="auto">{{ render_snippet(h['snippet']) }}</td>
+  </tr>
+  {% else %}
+  <tr><td colspan="5">No matches.</td></tr>
+  {% endfor %}
+</table>
+{% if page > 1 %}<a class="button" href="{{ url_for('search', q=q, page=page - 1) }}">&laquo; Previous</a>{% endif %}
+{% if has_next %}<a class="button" href="{{ url_for('search', q=q, page=page + 1) }}">Next &raquo;</a>{% endif %}
+{% endif %}
+<a class="button" href="/">Back to Home</a>
+<style>
+mark { background: #fff3b0; }
+</style>
+"""
+
+DASHBOARD_TEMPLATE = COMMON_STYLE + """
+<!doctype html>
+<title>Dashboard</title>
+<h1>Dashboard</h1>
+<div class="stats-grid">
+  <table>
+    <tr><th>Open status</th><th>Tickets</th></tr>
+    {% for status, count in open_counts.items() %}
+    <tr><td>{{ status }}</td><td>{{ count }}</td></tr>
+    {% endfor %}
+    <tr><td><b>Total open</b></td><td><b>{{ open_counts.values() | sum }}</b></td></tr>
+  </table>
+  <table>
+    <tr><th>Client</th><th>Open tickets</th></tr>
+    {% for client, count in client_open.items() %}
+    <tr><td><a href="{{ url_for('tickets', client=client) }}">{{ client or '-' }}</a></td><td>{{ count }}</td></tr>
+    {% else %}
+    <tr><td colspan="2">No open tickets.</td></tr>
+    {% endfor %}
+  </table>
+  <table>
+    <tr><th>DA ID</th><th>Open tickets</th></tr>
+    {% for da_id, count in da_open.items() %}
+    <tr><td><a href="{{ url_for('tickets', da_id=da_id) }}">{{ da_id or '-' }}</a></td><td>{{ count }}</td></tr>
+    {% else %}
+    <tr><td colspan="2">No open tickets.</td></tr>
+    {% endfor %}
+  </table>
+  <table>
+    <tr><th>سبب المشكلة</th><th>Tickets</th></tr>
+    {% for reason, count in reasons.items() %}
+    <tr><td>{{ reason or '-' }}</td><td>{{ count }}</td></tr>
+    {% endfor %}
+  </table>
+  <table>
+    <tr><th>نوع المشكلة</th><th>Tickets</th></tr>
+    {% for issue_type, count in types.items() %}
+    <tr><td>{{ issue_type or '-' }}</td><td>{{ count }}</td></tr>
+    {% endfor %}
+  </table>
+  <table>
+    <tr><th>Resolved</th><th>Tickets</th><th>Avg. hours to resolve</th></tr>
+    {% for label, (count, hours) in resolution %}
+    <tr><td>{{ label }}</td><td>{{ count }}</td><td>{{ '%.1f' % hours if hours is not none else '-' }}</td></tr>
+    {% endfor %}
+  </table>
+  <table>
+    <tr><th>Day</th><th>Created</th><th>Closed</th></tr>
+    {% for day, created, closed in daily %}
+    <tr><td>{{ day }}</td><td>{{ created }}</td><td>{{ closed }}</td></tr>
+    {% endfor %}
+  </table>
+</div>
+<a class="button" href="/">Back to Home</a>
+<style>
+.stats-grid {
+    display: grid;
+    grid-template-columns: repeat(auto-fit, minmax(320px, 1fr));
+    gap: 0 1.5rem;
+}
+</style>
+"""
+
+OUTBOX_TEMPLATE = COMMON_STYLE + """
+<!doctype html>
+<title>Notification Outbox</title>
+<h1>Notification Outbox</h1>
+<table>
+  <tr><th>Status</th><th>Messages</th></tr>
+  {% for status, count in counts.items() %}
+  <tr><td>{{ status }}</td><td>{{ count }}</td></tr>
+  {% endfor %}
+</table>
+{% if requeued is not none %}<p>{{ requeued }} dead message(s) requeued.</p>{% endif %}
+{% if counts['dead'] %}
+<form method="post" action="/outbox/requeue">
+  <button class="button" type="submit">Retry dead messages</button>
+</form>
+{% endif %}
+<a class="button" href="/">Back to Home</a>
+"""
+
 HOME_TEMPLATE = COMMON_STYLE + """
 <!doctype html>
 <title>Issue Resolution Admin</title>
@@ -223,6 +383,9 @@ HOME_TEMPLATE = COMMON_STYLE + """
   <div class="card">
     <h2>Tickets Management</h2>
     <a class="button" href="/tickets">View All Tickets</a>
+    <a class="button" href="/search">Search Tickets</a>
+    <a class="button" href="/dashboard">Dashboard</a>
+    <a class="button" href="/outbox">Notification Outbox</a>
   </div>
   <div class="card">
     <h2>Subscriptions</h2>
@@ -268,8 +431,11 @@ ACTIVITY_TEMPLATE = COMMON_STYLE + """
     <img src="{{ image_url }}" width="200">
   </div>
   {% endif %}
-  {% for entry in logs.split('\n') %}
-  <div class="log-entry">{{ entry }}</div>
+  {% for e in events %}
+  <div class="log-entry">
+    {{ e['timestamp'] }}: {{ e['action'] }}{% if e['actor'] %} ({{ e['actor'] }}){% endif %}{% if e['message'] %} - {{ e['message'] }}{% endif %}
+    {% if e['details'] %}<pre>{{ e['details'] }}</pre>{% endif %}
+  </div>
   {% endfor %}
 </div>
 <a class="button" href="/tickets">Back to Tickets</a>
@@ -279,19 +445,76 @@ ACTIVITY_TEMPLATE = COMMON_STYLE + """
 def home():
     return render_template_string(HOME_TEMPLATE)
 
+TICKETS_PAGE_SIZE = 50
+TICKET_STATUSES = db.TICKET_STATUSES
+
 @app.route("/tickets")
 def tickets():
-    tickets = db.get_all_tickets()
-    return render_template_string(TICKETS_TEMPLATE, tickets=tickets)
+    args = request.args
+    filters = {
+        "status": args.get("status") or None,
+        "client": args.get("client") or None,
+        "da_id": args.get("da_id", type=int),
+        "date_from": args.get("date_from") or None,
+        "date_to": args.get("date_to") or None,
+        "order": args.get("order", "desc"),
+    }
+    try:
+        tickets, next_cursor, prev_cursor = db.get_tickets_page(
+            cursor=args.get("cursor"), direction=args.get("dir", "next"),
+            limit=TICKETS_PAGE_SIZE, **filters)
+    except ValueError as e:
+        return f"Bad request: {e}", 400
+    # Drop empty filters so the next/prev links stay short.
+    filters = {k: v for k, v in filters.items() if v is not None}
+    return render_template_string(TICKETS_TEMPLATE, tickets=tickets, filters=filters,
+                                  statuses=TICKET_STATUSES,
+                                  next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 @app.route("/ticket/<int:ticket_id>/activity")
 def ticket_activity(ticket_id):
     t = db.get_ticket(ticket_id)
     if not t:
         return "Ticket not found", 404
-    logs = json.dumps(json.loads(t['logs']), ensure_ascii=False, indent=2)
+    events = db.get_ticket_events(ticket_id)
     image_url = t['image_url']
-    return render_template_string(ACTIVITY_TEMPLATE, ticket_id=ticket_id, logs=logs, image_url=image_url)
+    return render_template_string(ACTIVITY_TEMPLATE, ticket_id=ticket_id, events=events, image_url=image_url)
+
+@app.route("/search")
+def search():
+    q = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    hits, has_next = db.search_ticket_text(q, page=page) if q else ([], False)
+    return render_template_string(SEARCH_TEMPLATE, q=q, hits=hits, page=page, has_next=has_next,
+                                  render_snippet=lambda s: Markup(db.render_snippet(s, "<mark>", "</mark>")))
+
+@app.route("/dashboard")
+def dashboard():
+    # Counts come from the ticket_stats counters and resolution times from
+    # the resolved_at index; nothing here scans the tickets table.
+    return render_template_string(DASHBOARD_TEMPLATE,
+                                  open_counts=db.get_open_status_counts(),
+                                  client_open=db.get_ticket_stats("client_open"),
+                                  da_open=db.get_ticket_stats("da_open"),
+                                  reasons=db.get_ticket_stats("reason"),
+                                  types=db.get_ticket_stats("type"),
+                                  daily=db.get_daily_ticket_stats(),
+                                  resolution=[(f"Last {db.DASHBOARD_DAYS} days",
+                                               db.get_resolution_stats(db.DASHBOARD_DAYS)),
+                                              ("All time", db.get_resolution_stats())])
+
+OUTBOX_STATUSES = ("pending", "sent", "dead")
+
+@app.route("/outbox")
+def outbox():
+    counts = db.get_outbox_counts()
+    counts = {status: counts.get(status, 0) for status in OUTBOX_STATUSES}
+    return render_template_string(OUTBOX_TEMPLATE, counts=counts,
+                                  requeued=request.args.get("requeued", type=int))
+
+@app.route("/outbox/requeue", methods=["POST"])
+def requeue_outbox():
+    return redirect(url_for("outbox", requeued=db.requeue_dead_notifications()))
 
 @app.route("/subscriptions")
 def subscriptions():